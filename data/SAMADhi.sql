@@ -25,6 +25,7 @@ CREATE TABLE analysis
     description text,
     cadiline tinytext,
     contact tinytext,
+    last_modified timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     PRIMARY KEY (analysis_id),
 ) ENGINE = INNODB;
 
@@ -42,6 +43,7 @@ globaltag varchar(255),
 energy float,
 creation_time datetime,
 user_comment text,
+last_modified timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
 PRIMARY KEY (dataset_id),
 KEY idx_name (name)
 ) ENGINE = INNODB;
@@ -58,6 +60,11 @@ normalization float NOT NULL DEFAULT 1.0,
 event_weight_sum double NOT NULL DEFAULT 1.0,
 extras_event_weight_sum mediumtext,
 processed_lumi mediumtext,
+-- files aggregates: maintained by File.bulkInsert and File.removeForSamples only (no triggers),
+-- recompute them with update_samples_files_aggregates.py after other changes to the file table
+nfiles int NOT NULL DEFAULT 0,
+files_nevents bigint NOT NULL DEFAULT 0,
+files_event_weight_sum double NOT NULL DEFAULT 0,
 luminosity float,
 code_version varchar(255),
 user_comment text,
@@ -65,6 +72,7 @@ author tinytext,
 creation_time timestamp,
 source_dataset_id int,
 source_sample_id int,
+last_modified timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
 PRIMARY KEY (sample_id),
 KEY idx_name (name),
 FOREIGN KEY (source_dataset_id) REFERENCES dataset(dataset_id),
@@ -80,6 +88,7 @@ author tinytext,
 creation_time timestamp,
 analysis_id int NULL,
 elog varchar(255),
+last_modified timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
 PRIMARY KEY (result_id),
 KEY idx_path (path),
 FOREIGN KEY (analysis_id) REFERENCES analysis(analysis_id)
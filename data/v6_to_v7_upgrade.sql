@@ -0,0 +1,20 @@
+-- Upgrade SAMADhi from v6 to v7
+-- Add denormalised files aggregates to the sample table:
+-- number of files, sum of file nevents and sum of file event_weight_sum.
+-- There are no triggers: they are maintained by File.bulkInsert and File.removeForSamples,
+-- and update_samples_files_aggregates.py recomputes them after other changes to the file table
+-- Add a `last_modified` column to the analysis, dataset, sample and result tables,
+-- used for the incremental sync of local replicas
+
+ALTER TABLE sample ADD nfiles int NOT NULL DEFAULT 0;
+ALTER TABLE sample ADD files_nevents bigint NOT NULL DEFAULT 0;
+ALTER TABLE sample ADD files_event_weight_sum double NOT NULL DEFAULT 0;
+
+-- Initialize them from the file table
+UPDATE sample LEFT JOIN (SELECT sample_id, COUNT(*) AS nfiles, SUM(nevents) AS nevents, SUM(event_weight_sum) AS weight_sum FROM file GROUP BY sample_id) AS agg ON agg.sample_id = sample.sample_id
+SET sample.nfiles = COALESCE(agg.nfiles, 0), sample.files_nevents = COALESCE(agg.nevents, 0), sample.files_event_weight_sum = COALESCE(agg.weight_sum, 0);
+
+ALTER TABLE analysis ADD last_modified timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+ALTER TABLE dataset ADD last_modified timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+ALTER TABLE sample ADD last_modified timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
+ALTER TABLE result ADD last_modified timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP;
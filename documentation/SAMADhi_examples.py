@@ -1,4 +1,6 @@
 from cp3_llbb.SAMADhi import SAMADhi
+from cp3_llbb.SAMADhi.provenance import ProvenanceGraph
+from cp3_llbb.SAMADhi.lumimask import LumiMask, findOverlaps
 
 # Example method to generate a dictionary relating PAT name and luminosity
 # This version is optimized and only load the needed columns. 
@@ -13,6 +15,34 @@ def getPATlumi(sampletype=u"mc"): # can be u"mc", u"data", u"%"
     dictionary[name]=lumi
   return dictionary
 
+# Example method to get the (effective) luminosity of many samples at once.
+# The sample ancestry is resolved with a few batched queries instead of
+# following the source samples one by one.
+def getLuminosities(names):
+  dbstore = SAMADhi.DbStore()
+  samples = dbstore.find(SAMADhi.Sample,SAMADhi.Sample.name.is_in(names))
+  ids = dict(samples.values(SAMADhi.Sample.sample_id, SAMADhi.Sample.name))
+  luminosities = SAMADhi.LuminosityResolver(dbstore).getLuminosities(ids.keys())
+  return dict((ids[sample_id],lumi) for sample_id,lumi in luminosities.items())
+
+# Example method to list the results that depend on a dataset, e.g. before deprecating it.
+# The provenance graph is loaded once, and then traversed in memory.
+def getDependingResults(dataset):
+  dbstore = SAMADhi.DbStore()
+  dset = dbstore.find(SAMADhi.Dataset,SAMADhi.Dataset.name==dataset).one()
+  graph = ProvenanceGraph(dbstore)
+  return dbstore.find(SAMADhi.Result,SAMADhi.Result.result_id.is_in(list(graph.results_depending_on(dset))))
+
+# Example method to check that data samples do not share luminosity sections,
+# and to get the luminosity sections covered by all of them.
+def getLumiOverlaps(names):
+  dbstore = SAMADhi.DbStore()
+  samples = dbstore.find(SAMADhi.Sample,SAMADhi.Sample.name.is_in(names))
+  masks = dict((sample.name,sample.getLumiMask()) for sample in samples)
+  for (name1,name2),overlap in findOverlaps(masks).items():
+    print "%s and %s have %d luminosity sections in common"%(name1,name2,len(overlap))
+  return LumiMask().union(*masks.values())
+
 # Example method to access a PAT based on the path and access results and dataset
 def getPAT(path=u"%"):
   dbstore = SAMADhi.DbStore()
@@ -3,31 +3,250 @@ try:
 except ImportError as error:
     raise ImportError("Could not import storm, please make sure to install the dependencies (source installdeps_cmssw.sh inside CMSSW, or SAMADhi/install_standalone.sh otherwise): {0}".format(error))
 
-#db store connection
+import os
+import re
+import threading
+import time
+import weakref
+from collections import namedtuple, deque
+from storm.exceptions import DisconnectionError
+from storm.tracer import install_tracer
+from storm.expr import Sum, Max, LeftJoin, Func, Select, And
+from storm.info import get_cls_info, get_obj_info
+from .lumimask import LumiMask
+from .weightsums import WeightSums
 
-def DbStore(credentials='~/.samadhi'):
-    """create a database object and returns the db store from STORM"""
+#db store connection
 
-    import json, os, stat
+class _ActivityTracer(object):
+    """Storm tracer recording the time of the last statement, commit or rollback of each connection"""
+
+    def __init__(self):
+        self.lastActivity = weakref.WeakKeyDictionary()
+
+    def _record(self, connection, *args):
+        self.lastActivity[connection] = time.time()
+
+    connection_raw_execute = _record
+    connection_commit = _record
+    connection_rollback = _record
+
+_activityTracer = _ActivityTracer()
+install_tracer(_activityTracer)
+
+class StorePool(object):
+    """Process-wide pool of stores connected to one database.
+       Each thread gets its own Storm Store, which is reused across calls
+       and health-checked (and reconnected if needed) when its connection was idle
+       (no statement, commit or rollback) for more than keepalive seconds."""
+
+    def __init__(self, database, keepalive=60, setup=None):
+        self.database = database
+        self.keepalive = keepalive
+        self.setup = setup # called on every new store
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._local = threading.local()
+        self._stores = []
+
+    def getStore(self):
+        """return the store of the calling thread, creating it if needed"""
+        if os.getpid() != self._pid:
+            # forked process: never reuse the connections of the parent
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._reset()
+        store = getattr(self._local, "store", None)
+        if store is None:
+            store = self.newStore()
+            with self._lock:
+                self._stores.append(store)
+            self._local.store = store
+        elif time.time() - _activityTracer.lastActivity.get(store._connection, 0.) > self.keepalive:
+            self.ping(store)
+        return store
+
+    def newStore(self):
+        """create a new store, outside of the pool"""
+        store = Store(self.database)
+        if self.setup is not None:
+            self.setup(store)
+        return store
+
+    @staticmethod
+    def ping(store):
+        """Check that the connection of a store is alive, and reconnect if not.
+           The pending changes of a dropped connection are lost anyway."""
+        try:
+            store.execute("SELECT 1")
+        except DisconnectionError:
+            # storm reconnects on the first statement after the rollback
+            store.rollback()
+
+    def close(self):
+        """close all the stores of the pool"""
+        with self._lock:
+            for store in self._stores:
+                store.close()
+            self._reset()
+
+_storePools = {}
+_storePoolsLock = threading.Lock()
+
+def getStorePool(credentials='~/.samadhi'):
+    """return the store pool for a credentials file. The file is read and validated only once per process"""
+
+    import json, stat
     credentials = os.path.expanduser(credentials)
-    if not os.path.exists(credentials):
-        raise IOError('Credentials file %r not found.' % credentials)
-
-    # Check permission
-    mode = stat.S_IMODE(os.stat(credentials).st_mode)
-    if mode != int('400', 8):
-        raise IOError('Credentials file has wrong permission. Please execute \'chmod 400 %s\'' % credentials)
-
-    with open(credentials, 'r') as f:
-        data = json.load(f)
-
-        login = data['login']
-        password = data['password']
-        hostname = data['hostname'] if 'hostname' in data else 'localhost'
-        database = data['database']
-
-        db_connection_string = "mysql://%s:%s@%s/%s" % (login, password, hostname, database)
-        return Store(create_database(db_connection_string))
+    with _storePoolsLock:
+        if credentials in _storePools:
+            return _storePools[credentials]
+
+        if not os.path.exists(credentials):
+            raise IOError('Credentials file %r not found.' % credentials)
+
+        # Check permission
+        mode = stat.S_IMODE(os.stat(credentials).st_mode)
+        if mode != int('400', 8):
+            raise IOError('Credentials file has wrong permission. Please execute \'chmod 400 %s\'' % credentials)
+
+        with open(credentials, 'r') as f:
+            data = json.load(f)
+
+            login = data['login']
+            password = data['password']
+            hostname = data['hostname'] if 'hostname' in data else 'localhost'
+            database = data['database']
+
+            db_connection_string = "mysql://%s:%s@%s/%s" % (login, password, hostname, database)
+            pool = StorePool(create_database(db_connection_string))
+            _storePools[credentials] = pool
+            return pool
+
+def getReplicaPool(replica):
+    """return the store pool for a local SQLite replica (see replica.syncReplica), opened read-only"""
+
+    replica = os.path.abspath(os.path.expanduser(replica))
+    with _storePoolsLock:
+        if replica not in _storePools:
+            if not os.path.exists(replica):
+                raise IOError('Replica file %r not found.' % replica)
+            _storePools[replica] = StorePool(create_database("sqlite:%s" % replica),
+                                             setup=lambda store : store.execute("PRAGMA query_only = ON"))
+        return _storePools[replica]
+
+def DbStore(credentials='~/.samadhi', pooled=True, replica=None):
+    """returns the db store from STORM.
+       By default this is the pooled store of the calling thread,
+       so repeated calls reuse the same (health-checked) connection.
+       They also share the same transaction: a commit or rollback through any of them
+       affects the changes made through all the others in the thread, and objects are
+       shared (e.g. the sample loaded and the one updated in compute_sample_luminosity.py).
+       With pooled=False, a new independent store (and transaction) is returned.
+       If replica is given, the local SQLite replica at that path is used (read-only) instead of the database."""
+
+    if replica is not None:
+        pool = getReplicaPool(replica)
+    else:
+        pool = getStorePool(credentials)
+    if pooled:
+        return pool.getStore()
+    else:
+        return pool.newStore()
+
+def findRows(store, cls, *args, **kwargs):
+    """Lightweight projection: same arguments as store.find(cls, ...),
+       but yields namedtuples with the values of the scalar columns
+       (or of the columns given with the columns keyword argument, optionally sorted with order_by)
+       instead of Storm objects, so nothing is added to the store cache."""
+    columns = kwargs.pop("columns", None) or get_cls_info(cls).columns
+    order_by = kwargs.pop("order_by", None)
+    Row = namedtuple("%sRow" % cls.__name__, [ column.name for column in columns ])
+    result = store.find(cls, *args, **kwargs)
+    if order_by is not None:
+        result.order_by(order_by)
+    for values in result.values(*columns):
+        yield Row(*values)
+
+#large columns loaded on demand
+
+class Deferred(object):
+    """Property for a large column that is not loaded together with the object.
+       It is fetched on first access, through the class in the __storm_deferred__
+       attribute of the owner, which maps the same table with only the primary key
+       and the deferred columns; use the columns of that class in queries."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, obj, cls=None):
+        if obj is None:
+            return self
+        row = _getDeferredRow(obj)
+        if row is None:
+            return obj.__dict__.get("_pendingDeferred", {}).get(self.name)
+        return getattr(row, self.name)
+
+    def __set__(self, obj, value):
+        row = _getDeferredRow(obj)
+        if row is None:
+            obj.__dict__.setdefault("_pendingDeferred", {})[self.name] = value
+        else:
+            setattr(row, self.name, value)
+
+def _getDeferredRow(obj):
+    """the object holding the deferred columns, or None if obj is not in the database yet"""
+    store = Store.of(obj)
+    if store is None or get_obj_info(obj).get("pending") is not None:
+        return None
+    row = obj.__dict__.get("_deferredRow")
+    if row is None or Store.of(row) is not store:
+        key = tuple(getattr(obj, column.name) for column in get_cls_info(type(obj)).primary_key)
+        row = store.get(obj.__storm_deferred__, key)
+        obj.__dict__["_deferredRow"] = row
+    return row
+
+def _flushDeferred(obj):
+    """store the deferred columns that were set before obj was inserted (__storm_flushed__ hook)"""
+    pending = obj.__dict__.pop("_pendingDeferred", None)
+    if pending and Store.of(obj) is not None:
+        store = Store.of(obj)
+        # called during the flush: the row is retrieved without flushing again
+        store.block_implicit_flushes()
+        try:
+            row = _getDeferredRow(obj)
+        finally:
+            store.unblock_implicit_flushes()
+        for name, value in pending.items():
+            setattr(row, name, value)
+
+def _deferredNames(cls):
+    """names of the deferred columns of a __storm_deferred__ class"""
+    primary_key = [ column.name for column in get_cls_info(cls).primary_key ]
+    return [ column.name for column in get_cls_info(cls).columns if column.name not in primary_key ]
+
+def _deferredIsSet(obj):
+    """dictionary telling which deferred columns are not empty, without loading them"""
+    cls = obj.__storm_deferred__
+    names = _deferredNames(cls)
+    store = Store.of(obj)
+    if store is None or get_obj_info(obj).get("pending") is not None:
+        pending = obj.__dict__.get("_pendingDeferred", {})
+        return dict((name, bool(pending.get(name))) for name in names)
+    if "_deferredRow" in obj.__dict__:
+        row = _getDeferredRow(obj)
+        return dict((name, bool(getattr(row, name))) for name in names)
+    key = [ getattr(obj, column.name) for column in get_cls_info(type(obj)).primary_key ]
+    lengths = store.execute(Select([ Func("LENGTH", getattr(cls, name)) for name in names ],
+                And(*[ column == value for column, value in zip(get_cls_info(cls).primary_key, key) ]))).get_one()
+    return dict((name, bool(length)) for name, length in zip(names, lengths))
+
+def _isMySQL(store):
+    """whether the store is connected to MySQL (rather than e.g. a SQLite replica), for the MySQL-specific statements"""
+    return type(store.get_database()).__name__ == "MySQL"
 
 #definition of the DB interface classes 
 
@@ -99,9 +318,15 @@ class Sample(Storm):
   nevents = Int()
   normalization = Float()
   event_weight_sum = Float()
-  extras_event_weight_sum = Unicode() #  MEDIUMTEXT in MySQL
+  extras_event_weight_sum = Deferred("extras_event_weight_sum") #  MEDIUMTEXT in MySQL, loaded on demand
   luminosity = Float()
-  processed_lumi = Unicode() #  MEDIUMTEXT in MySQL
+  processed_lumi = Deferred("processed_lumi") #  MEDIUMTEXT in MySQL, loaded on demand
+  # number of files, sum of file nevents and event_weight_sum:
+  # only kept up to date by File.bulkInsert and File.removeForSamples (there are no triggers),
+  # after other changes to the file table they must be recomputed with updateFilesAggregates
+  nfiles = Int()
+  files_nevents = Int()
+  files_event_weight_sum = Float()
   code_version = Unicode()
   user_comment = Unicode()
   author = Unicode()
@@ -127,6 +352,9 @@ class Sample(Storm):
     else:
       raise ValueError('sample type %s is unkwown'%sampletype)
 
+  def __storm_flushed__(self):
+    _flushDeferred(self)
+
   def replaceBy(self, sample):
     """Replace one entry, but keep the same key"""
     self.name = sample.name
@@ -145,10 +373,126 @@ class Sample(Storm):
     self.author = sample.author
     self.creation_time = sample.creation_time
 
-  def removeFiles(self, store):
-    store.find(File, File.sample_id == self.sample_id).remove()
-    self.files.clear()
-
+  def addFiles(self, rows, batchSize=1000):
+    """Bulk-insert files for this sample, which must be in a store.
+       See File.bulkInsert for the format of rows."""
+    store = Store.of(self)
+    store.flush()
+    return File.bulkInsert(store, self.sample_id, rows, batchSize)
+
+  def removeFiles(self, store, chunkSize=10000, onChunk=None):
+    """Remove all the files of the sample, in chunks (see File.removeForSamples)"""
+    return File.removeForSamples(store, [self.sample_id], chunkSize, onChunk)
+
+
+  @staticmethod
+  def updateFilesAggregates(store, sample_ids=None):
+    """Recompute the files aggregates (nfiles, files_nevents, files_event_weight_sum)
+       of all samples, or of the given ones. With MySQL, this is a single GROUP BY over the file
+       table (restricted to the files of the given samples); other databases (e.g. a SQLite replica)
+       use correlated subqueries, which do not support the multiple-table UPDATE.
+       Returns the number of samples that changed."""
+    placeholders, params = None, []
+    if sample_ids is not None:
+      sample_ids = list(sample_ids)
+      if not sample_ids:
+        return 0
+      placeholders = ",".join("?" for i in sample_ids)
+    if _isMySQL(store):
+      fileCondition, sampleCondition = "", ""
+      if placeholders is not None:
+        fileCondition = " WHERE sample_id IN (%s)" % placeholders
+        sampleCondition = " WHERE sample.sample_id IN (%s)" % placeholders
+        params = sample_ids+sample_ids
+      statement  = "UPDATE sample LEFT JOIN (SELECT sample_id, COUNT(*) AS nfiles, SUM(nevents) AS nevents, SUM(event_weight_sum) AS weight_sum FROM file%s GROUP BY sample_id) AS agg ON agg.sample_id = sample.sample_id " % fileCondition
+      statement += "SET sample.nfiles = COALESCE(agg.nfiles, 0), sample.files_nevents = COALESCE(agg.nevents, 0), sample.files_event_weight_sum = COALESCE(agg.weight_sum, 0)"
+      statement += sampleCondition
+    else:
+      aggregates = [ ("nfiles", "COUNT(*)"), ("files_nevents", "COALESCE(SUM(nevents), 0)"), ("files_event_weight_sum", "COALESCE(SUM(event_weight_sum), 0)") ]
+      subqueries = [ (column, "(SELECT %s FROM file WHERE file.sample_id = sample.sample_id)" % aggregate) for column, aggregate in aggregates ]
+      # only the samples that change are updated, as for the number of changed rows with MySQL
+      condition = "(%s)" % " OR ".join("%s != %s" % (column, subquery) for column, subquery in subqueries)
+      if placeholders is not None:
+        condition = "sample_id IN (%s) AND %s" % (placeholders, condition)
+        params = sample_ids
+      statement  = "UPDATE sample SET %s" % ", ".join("%s = %s" % (column, subquery) for column, subquery in subqueries)
+      statement += " WHERE %s" % condition
+    nChanged = store.execute(statement, params).rowcount
+    # cached samples are outdated
+    for sample in store.find(Sample).cached():
+      store.invalidate(sample)
+    return nChanged
+
+  @staticmethod
+  def getFilesWeightSums(store, sample_ids):
+    """Sum the extras_event_weight_sum of the files of the given samples,
+       reading the column of all their files in a single query.
+       Returns a dictionary {sample_id: WeightSums}, without the samples whose files have none."""
+    texts = {}
+    sample_ids = list(sample_ids)
+    for i in range(0, len(sample_ids), 1000):
+      query = Select((File.sample_id, FileText.extras_event_weight_sum),
+                     And(File.sample_id.is_in(sample_ids[i:i+1000]), FileText.extras_event_weight_sum != None))
+      for sample_id, text in store.execute(query):
+        texts.setdefault(sample_id, []).append(text)
+    sums = dict((sample_id, WeightSums.sumTexts(sampleTexts)) for sample_id, sampleTexts in texts.items())
+    return dict((sample_id, total) for sample_id, total in sums.items() if total is not None)
+
+  @staticmethod
+  def getFilesDirectories(store, sample_ids):
+    """Directories of the files of the given samples, from the part of their pfn after SFN=.
+       With MySQL, the directories are extracted and grouped on the server side,
+       with a single query per 1000 samples; other databases get the pfns and use a regex.
+       Returns a dictionary {sample_id: sorted list of directories}, without the samples that have none."""
+    sample_ids = list(sample_ids)
+    directories = {}
+    mysql = _isMySQL(store)
+    for i in range(0, len(sample_ids), 1000):
+      chunk = sample_ids[i:i+1000]
+      if mysql:
+        # the directory is the SFN without its last component (the file name)
+        sfn = "SUBSTRING_INDEX(pfn, 'SFN=', -1)"
+        statement  = "SELECT sample_id, SUBSTRING(%s, 1, CHAR_LENGTH(%s) - CHAR_LENGTH(SUBSTRING_INDEX(pfn, '/', -1)) - 1) AS directory " % (sfn, sfn)
+        statement += "FROM file WHERE sample_id IN (%s) AND INSTR(pfn, 'SFN=') > 0 GROUP BY sample_id, directory" % ",".join("?" for sample_id in chunk)
+        rows = store.execute(statement, chunk)
+      else:
+        rows = set()
+        for sample_id, pfn in store.find(File, File.sample_id.is_in(chunk)).values(File.sample_id, File.pfn):
+          m = re.search(r".*SFN=(.*)", pfn)
+          if m:
+            rows.add((sample_id, os.path.dirname(m.group(1))))
+      for sample_id, directory in rows:
+        directories.setdefault(sample_id, set()).add(directory)
+    return dict((sample_id, sorted(sampleDirectories)) for sample_id, sampleDirectories in directories.items())
+
+  @staticmethod
+  def getFilesLastIds(store, sample_ids):
+    """Largest id of the files of the given samples, which changes when their files are replaced
+       (unlike the files aggregates, if the new files have the same number of events),
+       since the ids of removed files are not reused (AUTO_INCREMENT).
+       Returns a dictionary {sample_id: file id}, without the samples that have no files."""
+    sample_ids = list(sample_ids)
+    lastIds = {}
+    for i in range(0, len(sample_ids), 1000):
+      lastIds.update(store.find((File.sample_id, Max(File.id)), File.sample_id.is_in(sample_ids[i:i+1000])).group_by(File.sample_id))
+    return lastIds
+
+  @staticmethod
+  def updateExtrasWeightSums(store, sample_ids):
+    """Store the sum over the files in the extras_event_weight_sum of the given samples.
+       Samples whose files have no extra weight sums are not changed.
+       Returns the number of updated samples."""
+    sums = Sample.getFilesWeightSums(store, sample_ids)
+    for sample_id, total in sums.items():
+      store.find(SampleText, SampleText.sample_id == sample_id).set(extras_event_weight_sum=total.toText())
+    return len(sums)
+
+  def getWeightSums(self):
+    """The extra sums of event weights of the sample, as a WeightSums (None if not set)"""
+    return WeightSums.fromText(self.extras_event_weight_sum)
+
+  def setWeightSums(self, sums):
+    self.extras_event_weight_sum = sums.toText() if sums is not None else None
 
   def getLuminosity(self):
     """Computes the sample (effective) luminosity"""
@@ -163,11 +507,33 @@ class Sample(Storm):
         else:
           # for DATA, it can only be obtained from the parent sample
           if self.source_sample is not None:
-            return self.source_sample.luminosity()
+            return self.source_sample.getLuminosity()
     # in all other cases, it is impossible to compute a number.
     return None
 
+  def getLumiMask(self):
+    """The processed luminosity sections, as a LumiMask (empty if not set)"""
+    return LumiMask.fromJSON(self.processed_lumi)
+
+  def setLumiMask(self, mask):
+    self.processed_lumi = unicode(mask.toJSON()) if mask else None
+
+  def getFilesSummary(self):
+    """Summary of the files of the sample, from the files aggregates
+       and LIMIT-bounded queries for the listed files.
+       Returns None if the sample is not stored yet."""
+    store = Store.of(self)
+    if store is None or self.sample_id is None:
+      return None
+    return FilesSummary.fromStore(store, self.sample_id, (self.nfiles, self.files_nevents, self.files_event_weight_sum))
+
   def __str__(self):
+    return self.describe()
+
+  def describe(self, filesSummary=None):
+    """Printable description of the sample.
+       The files summary is taken from the database unless given,
+       e.g. for a sample that is not stored yet (see FilesSummary.fromRows)."""
     result  = "Sample #%s (created on %s by %s):\n"%(str(self.sample_id),str(self.creation_time),str(self.author))
     result += "  name: %s\n"%str(self.name)
     result += "  path: %s\n"%str(self.path)
@@ -176,10 +542,11 @@ class Sample(Storm):
     result += "  number of events: %s\n"%str(self.nevents)
     result += "  normalization: %s\n"%str(self.normalization)
     result += "  sum of event weight: %s\n"%str(self.event_weight_sum)
-    if self.extras_event_weight_sum:
+    hasDeferred = _deferredIsSet(self)
+    if hasDeferred["extras_event_weight_sum"]:
         result += "  has extras sum of event weight\n"
     result += "  (effective) luminosity: %s\n"%str(self.luminosity)
-    if self.processed_lumi:
+    if hasDeferred["processed_lumi"]:
         result += "  has processed luminosity sections information\n"
     else:
         result += "  does not have processed luminosity sections information\n"
@@ -187,33 +554,80 @@ class Sample(Storm):
     result += "  comment: %s\n"%str(self.user_comment)
     result += "  source dataset: %s\n"%str(self.source_dataset_id)
     result += "  source sample: %s\n"%str(self.source_sample_id)
-    if self.sample_id:
-        result += "  %d files: \n" % (self.files.count())
-        front_files = []
-        last_file = None
-        if self.files.count() > 5:
-            c = 0
-            for f in self.files:
-                if c < 3:
-                    front_files.append(f)
-
-                if c == self.files.count() - 1:
-                    last_file = f
-                c += 1
-        else:
-            front_files = self.files
-
-        for f in front_files:
-            result += "    - %s (%d entries)\n" % (str(f.lfn), f.nevents)
-        if last_file:
-            result += "    - ...\n"
-            result += "    - %s (%d entries)\n" % (str(last_file.lfn), last_file.nevents)
+    if filesSummary is None:
+        filesSummary = self.getFilesSummary()
+    if filesSummary is not None:
+        result += str(filesSummary)
     else:
         # No way to know if some files are here
         result += "  no files"
 
     return result
 
+class LuminosityResolver(object):
+  """Computes the (effective) luminosity of many samples at once,
+     with the same rules as Sample.getLuminosity.
+     The ancestry of the samples is fetched with one query per generation
+     (for all samples together), and the results are memoised per sample id."""
+
+  def __init__(self, store):
+    self.store = store
+    self._rows = {} # sample_id -> (luminosity, nevents_processed, source_sample_id, datatype, xsection), or None if not found
+    self._luminosities = {}
+
+  def _fetch(self, sample_ids):
+    """load the needed columns of the samples, their source dataset, and of all their ancestors"""
+    toFetch = set(sample_ids) - set(self._rows)
+    while toFetch:
+      rows = self.store.using(LeftJoin(Sample, Dataset, Sample.source_dataset_id == Dataset.dataset_id)).find(
+               (Sample.sample_id, Sample.luminosity, Sample.nevents_processed, Sample.source_sample_id, Dataset.datatype, Dataset.xsection),
+               Sample.sample_id.is_in(list(toFetch)))
+      parents = set()
+      for row in rows:
+        self._rows[row[0]] = row[1:]
+        if row[3] is not None:
+          parents.add(row[3])
+      for sample_id in toFetch:
+        self._rows.setdefault(sample_id, None)
+      toFetch = parents - set(self._rows)
+
+  def _resolve(self, sample_id):
+    """follow the source samples until the luminosity is known"""
+    chain = []
+    luminosity = None
+    while sample_id is not None:
+      if sample_id in self._luminosities:
+        luminosity = self._luminosities[sample_id]
+        break
+      row = self._rows.get(sample_id)
+      if row is None or sample_id in chain:
+        # unknown sample, or a loop in the source samples
+        break
+      chain.append(sample_id)
+      sampleLumi, nevents_processed, source_sample_id, datatype, xsection = row
+      sample_id = None
+      if sampleLumi is not None:
+        luminosity = sampleLumi
+      elif datatype == "mc":
+        # for MC, it can be computed as Nevt/xsection
+        if nevents_processed is not None and xsection is not None:
+          luminosity = nevents_processed/xsection
+      elif datatype is not None:
+        # for DATA, it can only be obtained from the parent sample
+        sample_id = source_sample_id
+    for sid in chain:
+      self._luminosities[sid] = luminosity
+    return luminosity
+
+  def getLuminosities(self, sample_ids):
+    """returns a dictionary with the (effective) luminosity of each sample id (None if it cannot be computed)"""
+    sample_ids = list(sample_ids)
+    self._fetch(sample_ids)
+    return dict((sample_id, self._resolve(sample_id)) for sample_id in sample_ids)
+
+  def getLuminosity(self, sample_id):
+    return self.getLuminosities([sample_id])[sample_id]
+
 class Result(Storm):
   """Table to represent one physics result,
      combining several samples."""
@@ -262,7 +676,7 @@ class File(Storm):
     lfn = Unicode()  # Local file name: /store/
     pfn = Unicode()  # Physical file name: srm:// or root://
     event_weight_sum = Float()
-    extras_event_weight_sum = Unicode() #  MEDIUMTEXT in MySQL
+    extras_event_weight_sum = Deferred("extras_event_weight_sum") #  MEDIUMTEXT in MySQL, loaded on demand
     nevents = Int()
 
     sample = Reference(sample_id, "Sample.sample_id")
@@ -274,9 +688,161 @@ class File(Storm):
         self.extras_event_weight_sum = extras_event_weight_sum
         self.nevents = nevents
 
+    def __storm_flushed__(self):
+        _flushDeferred(self)
+
+    def getWeightSums(self):
+        """The extra sums of event weights of the file, as a WeightSums (None if not set)"""
+        return WeightSums.fromText(self.extras_event_weight_sum)
+
+    @staticmethod
+    def bulkInsert(store, sample_id, rows, batchSize=1000):
+        """Insert files of a sample with multi-row INSERTs of (at most) batchSize rows.
+           rows is an iterable of (lfn, pfn, event_weight_sum, extras_event_weight_sum, nevents)
+           tuples, where extras_event_weight_sum may be a WeightSums. It is consumed lazily and no File objects are created,
+           so the memory use does not grow with the number of files.
+           Nothing is committed: all batches belong to the current transaction.
+           Returns the number of inserted files."""
+        columns = (File.sample_id, File.lfn, File.pfn, File.event_weight_sum, FileText.extras_event_weight_sum, File.nevents)
+        def insert(batch):
+            store.execute(Insert(columns, values=batch), noresult=True)
+            # keep the sample files aggregates up to date
+            store.find(Sample, Sample.sample_id == sample_id).set(
+                nfiles = Sample.nfiles + len(batch),
+                files_nevents = Sample.files_nevents + sum(row[5] for row in batch if row[5] is not None),
+                files_event_weight_sum = Sample.files_event_weight_sum + sum(row[3] for row in batch if row[3] is not None))
+            return len(batch)
+        nInserted = 0
+        batch = []
+        for lfn, pfn, event_weight_sum, extras, nevents in rows:
+            if isinstance(extras, WeightSums):
+                extras = extras.toText()
+            batch.append((sample_id, lfn, pfn, event_weight_sum, extras, nevents))
+            if len(batch) >= batchSize:
+                nInserted += insert(batch)
+                batch = []
+        if batch:
+            nInserted += insert(batch)
+        return nInserted
+
+    @staticmethod
+    def removeForSamples(store, sample_ids, chunkSize=10000, onChunk=None):
+        """Delete the files of the given samples with set-based DELETE statements
+           of at most chunkSize rows, to keep locks on the file table short.
+           onChunk(nDeleted) is called after each chunk, e.g. to commit
+           (a chunk of chunkSize files may be followed by others).
+           DELETE ... LIMIT is MySQL-only: other databases delete through a LIMIT subquery on the ids.
+           Returns the total number of deleted files."""
+        sample_ids = list(sample_ids)
+        if not sample_ids:
+            return 0
+        condition = "sample_id IN (%s)" % ",".join("?" for i in sample_ids)
+        if _isMySQL(store):
+            statement = "DELETE FROM file WHERE %s LIMIT %d" % (condition, chunkSize)
+        else:
+            statement = "DELETE FROM file WHERE id IN (SELECT id FROM file WHERE %s LIMIT %d)" % (condition, chunkSize)
+        nDeleted = 0
+        while True:
+            n = store.execute(statement, sample_ids).rowcount
+            nDeleted += n
+            if onChunk is not None:
+                onChunk(n)
+            if n < chunkSize:
+                break
+        store.find(Sample, Sample.sample_id.is_in(sample_ids)).set(nfiles=0, files_nevents=0, files_event_weight_sum=0.)
+        return nDeleted
+
     def __str__(self):
         return "%s"%(self.lfn)
 
+class SampleText(Storm):
+    """Large text columns of the sample table, loaded on demand by Sample"""
+    __storm_table__ = "sample"
+    sample_id = Int(primary=True)
+    extras_event_weight_sum = Unicode() #  MEDIUMTEXT in MySQL
+    processed_lumi = Unicode() #  MEDIUMTEXT in MySQL
+
+Sample.__storm_deferred__ = SampleText
+
+class FileText(Storm):
+    """Large text columns of the file table, loaded on demand by File"""
+    __storm_table__ = "file"
+    id = Int(primary=True)
+    extras_event_weight_sum = Unicode() #  MEDIUMTEXT in MySQL
+
+File.__storm_deferred__ = FileText
+
+class FilesSummary(object):
+    """Number of files, total number of events and sum of event weights
+       of a sample, with the first and last files for display.
+       All files are listed if there are at most maxListed of them."""
+
+    nHead = 3
+    nTail = 1
+    maxListed = 5
+
+    def __init__(self, nFiles, nevents, event_weight_sum, head, tail):
+        self.nFiles = nFiles
+        self.nevents = nevents
+        self.event_weight_sum = event_weight_sum
+        self.head = head # list of (lfn, nevents)
+        self.tail = tail # list of (lfn, nevents)
+
+    @classmethod
+    def fromStore(cls, store, sample_id, totals=None):
+        """Build the summary with LIMIT-bounded fetches of the listed files.
+           The totals (number of files, nevents and sum of weights) are computed
+           with one aggregate query, unless given."""
+        files = store.find(File, File.sample_id == sample_id)
+        if totals is not None:
+            nFiles, nevents, weight_sum = totals
+        else:
+            nFiles, nevents, weight_sum = store.find(
+                (Count(File.id), Sum(File.nevents), Sum(File.event_weight_sum)),
+                File.sample_id == sample_id).one()
+        columns = (File.lfn, File.nevents)
+        if nFiles > cls.maxListed:
+            head = list(files.order_by(File.id)[:cls.nHead].values(*columns))
+            tail = list(files.order_by(Desc(File.id))[:cls.nTail].values(*columns))
+            tail.reverse()
+        else:
+            head = list(files.order_by(File.id).values(*columns))
+            tail = []
+        return cls(nFiles, nevents, weight_sum, head, tail)
+
+    @classmethod
+    def fromRows(cls, rows):
+        """Build the summary from an iterable of file rows, in the format of File.bulkInsert
+           (e.g. files that are not stored yet), keeping only the listed files in memory"""
+        nFiles, nevents, weight_sum = 0, None, None
+        head = []
+        tail = deque(maxlen=cls.maxListed)
+        for lfn, pfn, event_weight_sum, extras, fileNevents in rows:
+            nFiles += 1
+            if fileNevents is not None:
+                nevents = (nevents or 0) + fileNevents
+            if event_weight_sum is not None:
+                weight_sum = (weight_sum or 0.) + event_weight_sum
+            if len(head) < cls.nHead:
+                head.append((lfn, fileNevents))
+            else:
+                tail.append((lfn, fileNevents))
+        if nFiles > cls.maxListed:
+            tail = list(tail)[-cls.nTail:]
+        else:
+            head, tail = head + list(tail), []
+        return cls(nFiles, nevents, weight_sum, head, tail)
+
+    def __str__(self):
+        result = "  %d files (%s entries, sum of event weight: %s): \n" % (self.nFiles, str(self.nevents), str(self.event_weight_sum))
+        for lfn, nevents in self.head:
+            result += "    - %s (%s entries)\n" % (str(lfn), str(nevents))
+        if self.tail:
+            result += "    - ...\n"
+            for lfn, nevents in self.tail:
+                result += "    - %s (%s entries)\n" % (str(lfn), str(nevents))
+        return result
+
 class Analysis(Storm):
     __storm_table__ = "analysis"
     analysis_id = Int(primary=True)
@@ -1,19 +1,129 @@
+import os
 import re
 import json
+import time
+import sqlite3
+import threading
 import subprocess
+from multiprocessing.pool import ThreadPool
+
+from storm.info import get_cls_info
 
 from .SAMADhi import Dataset, DbStore
 from .userPrompt import confirm
 
-def do_das_query(query):
+class DASCache(object):
+    """
+    On-disk (SQLite) cache of DAS responses, keyed by the query string.
+    Entries older than ttl seconds are fetched again; when there are more than
+    maxEntries (checked every pruneEvery insertions), the least recently used ones are evicted.
+    It can be used from several threads.
+    """
+
+    def __init__(self, path="~/.samadhi_das_cache.db", ttl=24*3600, maxEntries=100000, pruneEvery=100):
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.pruneEvery = pruneEvery
+        self._nPut = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.expanduser(path), timeout=60., check_same_thread=False)
+        with self._lock:
+            self._connection.execute("CREATE TABLE IF NOT EXISTS das_cache (query TEXT PRIMARY KEY, response TEXT, fetched REAL, used REAL)")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS idx_das_cache_used ON das_cache (used)")
+            self._prune()
+            self._connection.commit()
+
+    def get(self, query):
+        """cached response (raw JSON) to a query, or None if it is not cached or too old"""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute("SELECT response FROM das_cache WHERE query = ? AND fetched >= ?", (query, now-self.ttl)).fetchone()
+            if row is not None:
+                self._connection.execute("UPDATE das_cache SET used = ? WHERE query = ?", (now, query))
+                self._connection.commit()
+        return row[0] if row is not None else None
+
+    def put(self, query, response):
+        now = time.time()
+        with self._lock:
+            self._connection.execute("INSERT OR REPLACE INTO das_cache (query, response, fetched, used) VALUES (?, ?, ?, ?)", (query, response, now, now))
+            self._nPut += 1
+            if self._nPut % self.pruneEvery == 0:
+                self._prune()
+            self._connection.commit()
+
+    def _prune(self):
+        """evict the least recently used entries above maxEntries (with the lock held)"""
+        nEntries, = self._connection.execute("SELECT COUNT(*) FROM das_cache").fetchone()
+        if nEntries > self.maxEntries:
+            self._connection.execute("DELETE FROM das_cache WHERE query IN (SELECT query FROM das_cache ORDER BY used LIMIT ?)", (nEntries-self.maxEntries,))
+
+    def clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM das_cache")
+            self._connection.commit()
+
+class RateLimiter(object):
     """
-    Execute das_client for the specified query, and return parsed JSON output
+    Limit the rate of some operation, e.g. DAS requests, to rate per second
+    (with bursts of at most burst operations), across threads
     """
 
+    def __init__(self, rate, burst=1):
+        self.interval = 1./rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._next = time.time()
+
+    def wait(self):
+        """block until the next operation is allowed"""
+        with self._lock:
+            now = time.time()
+            start = max(self._next, now - (self.burst-1)*self.interval)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+_dasCache = None
+
+def set_das_cache(cache):
+    """Set the DASCache used by do_das_query (None to disable caching)"""
+    global _dasCache
+    _dasCache = cache
+
+def get_das_cache():
+    return _dasCache
+
+def _isSuccessful(response):
+    """whether a parsed DAS response is a successful, non-empty result (only those are cached)"""
+    if isinstance(response, dict):
+        if response.get("status", "ok") != "ok" or response.get("error"):
+            return False
+        response = response.get("data")
+    if not isinstance(response, list) or not response:
+        return False
+    return not any(isinstance(record, dict) and (record.get("error") or record.get("status", "ok") != "ok") for record in response)
+
+def do_das_query(query, refresh=False):
+    """
+    Execute das_client for the specified query, and return parsed JSON output.
+    If a DASCache is set (see set_das_cache), a recent enough response is reused,
+    unless refresh is set. Error and empty responses are not cached, so that they are retried.
+    """
+
+    cache = _dasCache
+    if cache is not None and not refresh:
+        result = cache.get(query)
+        if result is not None:
+            return json.loads(result)
+
     args = ['dasgoclient', '-json', '-format', 'json', '--query', query]
     result = subprocess.check_output(args)
 
-    return json.loads(result)
+    parsed = json.loads(result)
+    if cache is not None and _isSuccessful(parsed):
+        cache.put(query, result)
+    return parsed
 
 def fillDataset(dataset, dct):
   """
@@ -40,9 +150,9 @@ def fillDataset(dataset, dct):
 
   return dataset
 
-def query_das(dataset):
+def das_queries(dataset):
     """
-    Do a DAS request for the given dataset and return the metadata collected
+    The DAS queries needed to collect the metadata of a dataset (summary, metadata, release and config)
     """
 
     summary_query  = "summary dataset=%s" % dataset
@@ -50,10 +160,68 @@ def query_das(dataset):
     release_query  = "release dataset=%s" % dataset
     config_query  = "config dataset=%s system=dbs3" % dataset
 
-    summary_results = do_das_query(summary_query)
-    metadata_results = do_das_query(metadata_query)
-    release_results = do_das_query(release_query)
-    config_results = do_das_query(config_query)
+    return [summary_query, metadata_query, release_query, config_query]
+
+def query_das(dataset, refresh=False, pool=None):
+    """
+    Do a DAS request for the given dataset and return the metadata collected.
+    The DAS queries are run concurrently, in pool if given (a ThreadPool shared by the callers,
+    which must not be one of its worker threads), or else in a pool of 4 threads for this call.
+    """
+
+    if pool is not None:
+        return parse_das_results(*pool.map(lambda query : do_das_query(query, refresh), das_queries(dataset)))
+
+    pool = ThreadPool(4)
+    try:
+        results = pool.map(lambda query : do_das_query(query, refresh), das_queries(dataset))
+    finally:
+        pool.close()
+        pool.join()
+
+    return parse_das_results(*results)
+
+def query_das_many(datasets, jobs=8, errors=None, refresh=False):
+    """
+    Do the DAS requests for many datasets, with at most jobs dasgoclient processes at a time,
+    and return a dictionary {dataset: metadata}.
+    If errors is a dictionary, the datasets whose requests fail are added to it
+    (with the exception) instead of raising.
+    """
+
+    datasets = list(datasets)
+    queries = [ query for dataset in datasets for query in das_queries(dataset) ]
+    def run(query):
+        try:
+            return do_das_query(query, refresh), None
+        except Exception as error:
+            return None, error
+
+    pool = ThreadPool(jobs)
+    try:
+        results = pool.map(run, queries)
+    finally:
+        pool.close()
+        pool.join()
+
+    metadata = {}
+    for i, dataset in enumerate(datasets):
+        datasetResults = results[4*i:4*i+4]
+        try:
+            for result, error in datasetResults:
+                if error is not None:
+                    raise error
+            metadata[dataset] = parse_das_results(*[ result for result, error in datasetResults ])
+        except Exception as error:
+            if errors is None:
+                raise
+            errors[dataset] = error
+    return metadata
+
+def parse_das_results(summary_results, metadata_results, release_results, config_results):
+    """
+    Collect the metadata of a dataset from the parsed output of its DAS queries
+    """
 
     if not 'nresults' in summary_results:
         raise Exception("Invalid DAS response")
@@ -85,6 +253,90 @@ def query_das(dataset):
 
     return metadata
 
+def guess_process(dataset):
+    splitString = dataset.split('/', 2)
+    if len(splitString) > 1:
+        return splitString[1]
+
+def guess_energy(dataset):
+    energyRe = re.search(r"([\d.]+)TeV", dataset)
+    if energyRe:
+        return float(energyRe.group(1))
+
+def expand_das_pattern(pattern, refresh=False):
+    """
+    Names of the datasets matching a DAS wildcard pattern, e.g. /TT*/RunIIFall17*/MINIAODSIM
+    """
+
+    results = do_das_query("dataset=%s" % pattern, refresh)
+    return sorted(set(d["dataset"][0]["name"] for d in results["data"]))
+
+def import_cms_datasets(datasets, process=None, energy=None, xsection=None, comment=None, jobs=8, dryrun=False, refresh=False):
+    """
+    Do the DAS requests for many datasets (concurrently) and insert or update them all
+    in a single transaction. For new datasets, process and energy are guessed from the name
+    if not given; for existing ones, process, energy, cross-section and comment are only changed if given.
+    The changes are printed; with dryrun, they are not committed.
+    Returns the (new, updated, failed) lists of dataset names.
+    """
+
+    datasets = sorted(set(datasets))
+    errors = {}
+    allMetadata = query_das_many(datasets, jobs=jobs, errors=errors, refresh=refresh)
+
+    dbstore = DbStore()
+    existing = dict((dset.name, dset) for dset in dbstore.find(Dataset, Dataset.name.is_in([ unicode(name) for name in allMetadata ])))
+    columns = [ column.name for column in get_cls_info(Dataset).columns if column.name != "dataset_id" ]
+
+    new, updated = [], []
+    try:
+        for name in datasets:
+            if name not in allMetadata:
+                continue
+            metadata = allMetadata[name]
+            dataset = existing.get(metadata['name'])
+            if dataset is None:
+                metadata.update({
+                    u"process": unicode(process or guess_process(name)),
+                    u"xsection": xsection if xsection is not None else 1.0,
+                    u"energy": energy or guess_energy(name),
+                    u"comment": unicode(comment or "")
+                })
+                dataset = Dataset(metadata['name'], metadata['datatype'])
+                fillDataset(dataset, metadata)
+                dbstore.add(dataset)
+                new.append(name)
+                print "+ %s" % name
+            else:
+                before = dict((column, getattr(dataset, column)) for column in columns)
+                metadata.update({
+                    u"process": unicode(process) if process else dataset.process,
+                    u"xsection": xsection if xsection is not None else dataset.xsection,
+                    u"energy": energy if energy else dataset.energy,
+                    u"comment": unicode(comment) if comment is not None else dataset.user_comment
+                })
+                fillDataset(dataset, metadata)
+                changes = [ (column, before[column], getattr(dataset, column)) for column in columns if before[column] != getattr(dataset, column) ]
+                if changes:
+                    updated.append(name)
+                    print "~ %s" % name
+                    for column, old, value in changes:
+                        print "    %s: %s -> %s" % (column, old, value)
+        for name, error in sorted(errors.items()):
+            print "! %s: error getting dataset in DAS (%s)" % (name, error)
+        print "%d new dataset(s), %d updated, %d unchanged, %d failed" % (len(new), len(updated), len(allMetadata)-len(new)-len(updated), len(errors))
+
+        if dryrun:
+            print "Dry run: nothing was written to the database."
+            dbstore.rollback()
+        else:
+            dbstore.commit()
+    except:
+        dbstore.rollback()
+        raise
+
+    return new, updated, sorted(errors)
+
 def import_cms_dataset(dataset, process=None, energy=None, xsection=1.0, comment="", prompt=False):
     """
     Do a DAS request for the given dataset and insert it into SAMAdhi
@@ -92,14 +344,10 @@ def import_cms_dataset(dataset, process=None, energy=None, xsection=1.0, comment
 
     # Guess default sane values for unspecifed parameters
     if not process:
-        splitString = dataset.split('/', 2)
-        if len(splitString) > 1:
-            process = splitString[1]
+        process = guess_process(dataset)
 
     if not energy:
-        energyRe = re.search(r"([\d.]+)TeV", dataset)
-        if energyRe:
-            energy = float(energyRe.group(1))
+        energy = guess_energy(dataset)
 
     metadata = query_das(dataset)
 
@@ -0,0 +1,345 @@
+import fnmatch
+import os
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+from Queue import Queue
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from .root_reader import ROOTFile, UnsupportedROOTFile
+
+FileScan = namedtuple("FileScan", ["path", "event_weight_sum", "entries", "extras", "error"])
+
+class ScanTimeout(Exception):
+    pass
+
+def _raiseTimeout(signum, frame):
+    raise ScanTimeout()
+
+# Metadata readers: functions that return the sum of event weights (event_weight_sum object)
+# and the number of entries (tree t) of a ROOT file, as (event_weight_sum, entries, extras),
+# where extras (the extra sums of event weights) is not stored in the files for now.
+# They raise IOError if the file cannot be opened.
+
+def readFileDataROOT(path):
+    """Metadata reader using PyROOT"""
+    import ROOT
+
+    f = ROOT.TFile.Open(path)
+    if not f or f.IsZombie():
+        raise IOError("could not open %s" % path)
+
+    try:
+        weight_sum = f.Get("event_weight_sum")
+        if weight_sum:
+            weight_sum = weight_sum.GetVal()
+        else:
+            weight_sum = None
+
+        entries = None
+        tree = f.Get("t")
+        if tree:
+            entries = tree.GetEntriesFast()
+    finally:
+        f.Close()
+
+    return (weight_sum, entries, None)
+
+def readFileDataLight(path):
+    """Metadata reader that parses the file directly, without ROOT (local files only).
+       Raises UnsupportedROOTFile for files it cannot handle."""
+    with ROOTFile(path) as f:
+        weight_sum = f.parameterValue("event_weight_sum") if f.classname("event_weight_sum") else None
+        entries = f.treeEntries("t") if f.classname("t") else None
+    return (weight_sum, entries, None)
+
+def getFileData(path):
+    """Metadata reader using readFileDataLight when possible, and PyROOT otherwise"""
+    if "://" not in path:
+        try:
+            return readFileDataLight(path)
+        except UnsupportedROOTFile:
+            pass
+    return readFileDataROOT(path)
+
+metadataReaders = { "auto": getFileData, "light": readFileDataLight, "root": readFileDataROOT }
+
+def _scanOne(args):
+    """scan one file, with a timeout (in seconds) if given. Never raises."""
+    path, reader, timeout = args
+    if timeout:
+        signal.alarm(timeout)
+    try:
+        weight_sum, entries, extras = reader(path)
+        return FileScan(path, weight_sum, entries, extras, None)
+    except ScanTimeout:
+        return FileScan(path, None, None, None, "timeout after %ds" % timeout)
+    except Exception as error:
+        return FileScan(path, None, None, None, str(error) or error.__class__.__name__)
+    finally:
+        if timeout:
+            signal.alarm(0)
+
+def _initWorker():
+    signal.signal(signal.SIGALRM, _raiseTimeout)
+    # interrupting is handled by the parent process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+class _Done(object):
+    """already available result, in the queue of pending results"""
+    def __init__(self, scan):
+        self.scan = scan
+    def get(self, timeout=None):
+        return self.scan
+    def ready(self):
+        return True
+
+def _discardPool(pool):
+    """terminate a pool in the background: joining a worker blocked in the kernel could take forever"""
+    thread = threading.Thread(target=pool.terminate)
+    thread.daemon = True
+    thread.start()
+
+def scanFiles(paths, jobs=1, timeout=None, reader=getFileData, progress=None, cache=None):
+    """
+    Scan files with reader (a function returning (event_weight_sum, entries, extras) for a path),
+    in jobs processes if jobs > 1, and yield a FileScan for each of them, in the input order.
+    If a MetadataCache is given, only the files that are not in it (or were modified) are read,
+    and their metadata are added to it.
+    paths may be any iterable: it is consumed as the scan goes, with a bounded number of files in flight.
+    Files that cannot be read, or take longer than timeout seconds, are yielded with
+    an error message instead of raising. If a worker is blocked in a call that cannot
+    be interrupted, the file is reported as failed when the timeout has passed twice,
+    and the pool is replaced by a new one (where the files that were not done are submitted again),
+    so blocked workers never reduce the number of jobs.
+    progress is an optional ScanProgress.
+    """
+    def lookup(path):
+        """cached scan, or None and the stat to store the new scan in the cache"""
+        if cache is None:
+            return None, None
+        stat = _stat(path)
+        scan = cache.get(path, *stat) if stat is not None else None
+        return scan, (stat if scan is None else None)
+    def done(scan, stat):
+        if cache is not None and scan.error is None and stat is not None:
+            cache.put(scan, *stat)
+        if progress is not None:
+            progress.update(scan)
+        return scan
+
+    if jobs <= 1:
+        previous = signal.signal(signal.SIGALRM, _raiseTimeout) if timeout else None
+        try:
+            for path in paths:
+                scan, stat = lookup(path)
+                yield done(scan or _scanOne((path, reader, timeout)), stat)
+        finally:
+            if timeout:
+                signal.signal(signal.SIGALRM, previous)
+            if cache is not None:
+                cache.commit()
+        return
+
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs, _initWorker)
+    try:
+        inFlight = deque()
+        paths = iter(paths)
+        exhausted = False
+        while True:
+            while not exhausted and len(inFlight) < 4*jobs:
+                try:
+                    path = next(paths)
+                except StopIteration:
+                    exhausted = True
+                    break
+                scan, stat = lookup(path)
+                inFlight.append((path, stat, _Done(scan) if scan else pool.apply_async(_scanOne, [(path, reader, timeout)])))
+            if not inFlight:
+                break
+            path, stat, result = inFlight.popleft()
+            try:
+                scan = result.get(2*timeout if timeout else 3600*24*365)
+            except multiprocessing.TimeoutError:
+                scan = FileScan(path, None, None, None, "timeout after %ds (worker blocked)" % timeout)
+                _discardPool(pool)
+                pool = multiprocessing.Pool(jobs, _initWorker)
+                inFlight = deque((otherPath, otherStat, otherResult if otherResult.ready() else pool.apply_async(_scanOne, [(otherPath, reader, timeout)]))
+                                 for otherPath, otherStat, otherResult in inFlight)
+            yield done(scan, stat)
+        pool.close()
+    finally:
+        if cache is not None:
+            cache.commit()
+        # also stops the workers that are still blocked
+        pool.terminate()
+        pool.join()
+
+def _stat(path):
+    """(size, mtime) of a file, or None if it is not on a local (or mounted) file system"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_size, stat.st_mtime)
+
+class MetadataCache(object):
+    """
+    On-disk (SQLite) cache of the file metadata, keyed by path, size and modification time,
+    so that only new or modified files are read again.
+    The cache file can be shared: it is created group-writable, and concurrent writers wait for each other.
+    """
+
+    def __init__(self, path, commitEvery=1000):
+        path = os.path.expanduser(path)
+        if not os.path.exists(path):
+            umask = os.umask(0o002)
+            try:
+                open(path, "a").close()
+            finally:
+                os.umask(umask)
+        self.connection = sqlite3.connect(path, timeout=60.)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS file_metadata (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+                                "event_weight_sum REAL, entries INTEGER, extras TEXT, scanned REAL)")
+        self.connection.commit()
+        self.commitEvery = commitEvery
+        self._nPending = 0
+
+    def get(self, path, size, mtime):
+        """cached FileScan of the file, or None if it is not cached or was modified since"""
+        row = self.connection.execute("SELECT event_weight_sum, entries, extras FROM file_metadata WHERE path = ? AND size = ? AND mtime = ?",
+                                      (path, size, mtime)).fetchone()
+        if row is None:
+            return None
+        return FileScan(path, row[0], row[1], row[2], None)
+
+    def put(self, scan, size, mtime):
+        self.connection.execute("INSERT OR REPLACE INTO file_metadata (path, size, mtime, event_weight_sum, entries, extras, scanned) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (scan.path, size, mtime, scan.event_weight_sum, scan.entries, scan.extras, time.time()))
+        self._nPending += 1
+        if self._nPending >= self.commitEvery:
+            self.commit()
+
+    def commit(self):
+        self.connection.commit()
+        self._nPending = 0
+
+    def prune(self, maxAge):
+        """remove the entries scanned more than maxAge seconds ago. Returns the number of removed entries."""
+        nRemoved = self.connection.execute("DELETE FROM file_metadata WHERE scanned < ?", (time.time()-maxAge,)).rowcount
+        self.commit()
+        return nRemoved
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+def _listDirectory(path):
+    """sorted (name, is a directory) entries of a directory"""
+    if scandir is not None:
+        entries = [ (entry.name, entry.is_dir()) for entry in scandir(path) ]
+    else:
+        entries = [ (name, os.path.isdir(os.path.join(path, name))) for name in os.listdir(path) ]
+    return sorted(entries)
+
+def discoverFiles(path, include=("*.root",), exclude=(), recursive=False):
+    """
+    Yield the files under path whose path relative to it matches one of the include patterns
+    and none of the exclude patterns (fnmatch patterns, where * also matches /).
+    Subdirectories are visited if recursive is set and they do not match an exclude pattern.
+    The directories are listed one at a time, as the files are consumed.
+    """
+    def matches(relPath, patterns):
+        return any(fnmatch.fnmatch(relPath, pattern) for pattern in patterns)
+    if os.path.isfile(path):
+        yield path
+        return
+    toVisit = [ "" ]
+    while toVisit:
+        relDir = toVisit.pop()
+        subDirs = []
+        for name, isDir in _listDirectory(os.path.join(path, relDir)):
+            relPath = os.path.join(relDir, name)
+            if matches(relPath, exclude):
+                continue
+            if isDir:
+                if recursive:
+                    subDirs.append(relPath)
+            elif matches(relPath, include):
+                yield os.path.join(path, relPath)
+        toVisit.extend(reversed(subDirs))
+
+def readFileList(fileList):
+    """Yield the paths listed in a file (one per line, - for the standard input)"""
+    f = sys.stdin if fileList == "-" else open(fileList)
+    try:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def prefetch(iterable, size=1000):
+    """Iterate over iterable in a background thread, keeping at most size items ahead of the consumer,
+       e.g. to keep walking directories while the first files are being scanned"""
+    queue = Queue(size)
+    end = object()
+    failure = []
+    def produce():
+        try:
+            for item in iterable:
+                queue.put(item)
+        except Exception:
+            failure.append(sys.exc_info())
+        finally:
+            queue.put(end)
+    thread = threading.Thread(target=produce)
+    thread.daemon = True
+    thread.start()
+    while True:
+        item = queue.get()
+        if item is end:
+            break
+        yield item
+    if failure:
+        excType, excValue, excTraceback = failure[0]
+        raise excType, excValue, excTraceback
+
+class ScanProgress(object):
+    """Periodic report of the scanning progress, and list of the files that could not be read"""
+
+    def __init__(self, total=None, interval=10., stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.nScanned = 0
+        self.failed = []
+        self.start = time.time()
+        self.lastReport = self.start
+
+    def update(self, scan):
+        self.nScanned += 1
+        if scan.error is not None:
+            self.failed.append(scan)
+        now = time.time()
+        if now-self.lastReport >= self.interval:
+            self.lastReport = now
+            self.report()
+
+    def report(self):
+        elapsed = max(time.time()-self.start, 1.e-6)
+        total = " / %d" % self.total if self.total is not None else ""
+        self.stream.write("Scanned %d%s files (%.1f files/s), %d failed\n" % (self.nScanned, total, self.nScanned/elapsed, len(self.failed)))
+        self.stream.flush()
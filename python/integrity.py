@@ -0,0 +1,91 @@
+from collections import namedtuple
+
+from storm.expr import Join, LeftJoin
+from storm.info import ClassAlias, get_cls_info
+
+from .SAMADhi import Dataset, Sample, Result, SampleResult
+
+# Integrity rules: each one is a single set-based query (an anti-join or an aggregate)
+# returning the (id, message) pairs of the objects of cls that violate it.
+# The rules are grouped in sections, one per list of the database analysis report.
+IntegrityRule = namedtuple("IntegrityRule", ["name", "section", "cls", "query"])
+
+integrityRules = []
+
+def integrityRule(name, section, cls):
+    """decorator to register a function(store) returning the (id, message) pairs of the objects of cls violating a rule"""
+    def register(query):
+        integrityRules.append(IntegrityRule(name, section, cls, query))
+        return query
+    return register
+
+@integrityRule("orphan-datasets", "datasets", Dataset)
+def orphanDatasets(store):
+    """datasets without any sample"""
+    return ((dataset_id, "orphan dataset") for dataset_id in
+            store.using(LeftJoin(Dataset, Sample, Sample.source_dataset_id == Dataset.dataset_id)).find(
+                Dataset.dataset_id, Sample.sample_id == None))
+
+@integrityRule("dangling-source-dataset", "samples", Sample)
+def danglingSourceDatasets(store):
+    """samples whose source dataset does not exist"""
+    return ((sample_id, "inconsistent source dataset") for sample_id in
+            store.using(LeftJoin(Sample, Dataset, Sample.source_dataset_id == Dataset.dataset_id)).find(
+                Sample.sample_id, Sample.source_dataset_id != None, Dataset.dataset_id == None))
+
+@integrityRule("dangling-source-sample", "samples", Sample)
+def danglingSourceSamples(store):
+    """samples whose source sample does not exist"""
+    Source = ClassAlias(Sample, "source")
+    return ((sample_id, "inconsistent source sample") for sample_id in
+            store.using(LeftJoin(Sample, Source, Sample.source_sample_id == Source.sample_id)).find(
+                Sample.sample_id, Sample.source_sample_id != None, Source.sample_id == None))
+
+@integrityRule("sample-files-nevents", "samples", Sample)
+def inconsistentFilesNevents(store):
+    """samples with files, whose number of events differs from the sum over the files (the files_nevents aggregate)"""
+    return ((sample_id, "inconsistent number of events: %d in the sample, %d in the files" % (nevents, filesNevents))
+            for sample_id, nevents, filesNevents in
+            store.find(Sample, Sample.nevents != None, Sample.nfiles > 0, Sample.files_nevents != Sample.nevents).values(
+                Sample.sample_id, Sample.nevents, Sample.files_nevents))
+
+@integrityRule("result-without-samples", "results", Result)
+def resultsWithoutSamples(store):
+    """results that are not attached to any sample"""
+    return ((result_id, "no source sample") for result_id in
+            store.using(LeftJoin(Result, SampleResult, SampleResult.result_id == Result.result_id)).find(
+                Result.result_id, SampleResult.result_id == None))
+
+@integrityRule("dangling-result-sample", "results", Result)
+def danglingResultSamples(store):
+    """results attached to a sample that does not exist"""
+    return ((result_id, "inconsistent source sample") for result_id in
+            store.using(LeftJoin(Join(Result, SampleResult, SampleResult.result_id == Result.result_id),
+                                 Sample, Sample.sample_id == SampleResult.sample_id)).find(
+                Result.result_id, Sample.sample_id == None).config(distinct=True))
+
+def _loadObjects(store, cls, ids, chunkSize=1000):
+    """{id: object} for the objects of cls (with a single-column primary key), a few queries in total"""
+    key, = get_cls_info(cls).primary_key
+    ids = sorted(set(ids))
+    objects = {}
+    for i in range(0, len(ids), chunkSize):
+        for obj in store.find(cls, key.is_in(ids[i:i+chunkSize])):
+            objects[getattr(obj, key.name)] = obj
+    return objects
+
+def checkIntegrity(store, section, rules=None):
+    """
+    Run the integrity rules of a section (all registered rules by default) and return
+    the [object, message] pairs of the violations, ordered by id and then by rule,
+    with one query per rule plus the bulk loading of the objects.
+    """
+    violations = []
+    for index, rule in enumerate(rules if rules is not None else integrityRules):
+        if rule.section == section:
+            violations += [ (rule.cls, objId, index, message) for objId, message in rule.query(store) ]
+    objects = {}
+    for cls in set(violation[0] for violation in violations):
+        objects[cls] = _loadObjects(store, cls, [ objId for vCls, objId, index, message in violations if vCls is cls ])
+    return [ [ objects[cls][objId], message ] for cls, objId, index, message in
+             sorted(violations, key=lambda violation: violation[1:3]) ]
@@ -0,0 +1,181 @@
+import json
+from array import array
+from collections import defaultdict
+
+def _pairs(flat):
+    """(first, last) pairs of a flat array of interval bounds"""
+    return zip(flat[::2], flat[1::2])
+
+def _merge(ranges):
+    """sorted, merged flat array from (first, last) pairs, in any order.
+       Adjacent ranges are merged too, since lumi sections are integers."""
+    merged = array("l")
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1]+1:
+            if last > merged[-1]:
+                merged[-1] = last
+        else:
+            merged.extend((first, last))
+    return merged
+
+def _intersect(a, b):
+    """intersection of two sorted, merged flat arrays"""
+    result = array("l")
+    i, j = 0, 0
+    while i < len(a) and j < len(b):
+        first, last = max(a[i], b[j]), min(a[i+1], b[j+1])
+        if first <= last:
+            result.extend((first, last))
+        if a[i+1] < b[j+1]:
+            i += 2
+        else:
+            j += 2
+    return result
+
+def _subtract(a, b):
+    """ranges of a that are not in b, for two sorted, merged flat arrays"""
+    result = array("l")
+    j = 0
+    for first, last in _pairs(a):
+        while j < len(b) and b[j+1] < first:
+            j += 2
+        k = j
+        while k < len(b) and b[k] <= last:
+            if b[k] > first:
+                result.extend((first, b[k]-1))
+            first = b[k+1]+1
+            k += 2
+        if first <= last:
+            result.extend((first, last))
+    return result
+
+class LumiMask(object):
+    """
+    Set of (run, lumi section) pairs, as in the CMS JSON format: {"run": [[first, last], ...], ...}.
+    It is stored as a sorted array of merged, inclusive lumi section ranges per run,
+    so the set operations are linear in the number of ranges.
+    Masks support |, &, - and the corresponding union, intersection and difference methods
+    (which take any number of masks), len() (number of lumi sections), "in" for (run, lumi) pairs and ==.
+    """
+
+    def __init__(self, ranges=None):
+        """ranges: iterable of (run, first, last) lumi section ranges"""
+        runs = defaultdict(list)
+        for run, first, last in (ranges or ()):
+            runs[int(run)].append((int(first), int(last)))
+        self._runs = dict((run, _merge(runRanges)) for run, runRanges in runs.items())
+
+    @classmethod
+    def _fromRuns(cls, runs):
+        mask = cls()
+        mask._runs = dict((run, ranges) for run, ranges in runs.items() if ranges)
+        return mask
+
+    @classmethod
+    def fromJSON(cls, text):
+        """Parse a mask in the CMS JSON format (None or an empty string give an empty mask)"""
+        if not text:
+            return cls()
+        return cls((run, first, last) for run, runRanges in json.loads(text).items() for first, last in runRanges)
+
+    @classmethod
+    def fromFile(cls, path):
+        with open(path) as f:
+            return cls.fromJSON(f.read())
+
+    def toJSON(self):
+        """Serialize the mask in the CMS JSON format, with the runs in increasing order"""
+        return "{%s}" % ", ".join('"%d": [%s]' % (run, ", ".join("[%d, %d]" % pair for pair in _pairs(self._runs[run])))
+                                  for run in self.runs())
+
+    def __str__(self):
+        return self.toJSON()
+
+    def __repr__(self):
+        return "LumiMask(%d runs, %d lumi sections)" % (len(self._runs), len(self))
+
+    def runs(self):
+        """sorted list of the runs in the mask"""
+        return sorted(self._runs)
+
+    def ranges(self):
+        """iterator over the (run, first, last) lumi section ranges, in increasing order"""
+        for run in self.runs():
+            for first, last in _pairs(self._runs[run]):
+                yield run, first, last
+
+    def __len__(self):
+        return sum(last-first+1 for run, ranges in self._runs.items() for first, last in _pairs(ranges))
+
+    def __nonzero__(self):
+        return bool(self._runs)
+
+    def __contains__(self, runLumi):
+        run, lumi = runLumi
+        ranges = self._runs.get(run, ())
+        lo, hi = 0, len(ranges)//2
+        while lo < hi:
+            mid = (lo+hi)//2
+            if ranges[2*mid+1] < lumi:
+                lo = mid+1
+            else:
+                hi = mid
+        return lo < len(ranges)//2 and ranges[2*lo] <= lumi
+
+    def __eq__(self, other):
+        return isinstance(other, LumiMask) and self._runs == other._runs
+
+    def __ne__(self, other):
+        return not self == other
+
+    def union(self, *others):
+        runs = defaultdict(list)
+        for mask in (self,)+others:
+            for run, ranges in mask._runs.items():
+                runs[run].extend(_pairs(ranges))
+        return LumiMask._fromRuns(dict((run, _merge(ranges)) for run, ranges in runs.items()))
+
+    def intersection(self, *others):
+        runs = self._runs
+        for mask in others:
+            runs = dict((run, _intersect(ranges, mask._runs[run])) for run, ranges in runs.items() if run in mask._runs)
+        return LumiMask._fromRuns(runs)
+
+    def difference(self, *others):
+        runs = self._runs
+        for mask in others:
+            runs = dict((run, _subtract(ranges, mask._runs[run]) if run in mask._runs else ranges) for run, ranges in runs.items())
+        return LumiMask._fromRuns(runs)
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def isdisjoint(self, other):
+        return not self.intersection(other)
+
+def findOverlaps(masks):
+    """
+    Find the lumi sections that are in more than one of the masks, e.g. to detect double counting
+    between data samples. masks is a dictionary (or a list of (key, mask) pairs),
+    the result is a dictionary {(key1, key2): overlap mask} with only the overlapping pairs.
+    All the masks are processed in a single sweep per run.
+    """
+    if isinstance(masks, dict):
+        masks = masks.items()
+    perRun = defaultdict(list)
+    for key, mask in masks:
+        for run, ranges in mask._runs.items():
+            perRun[run].extend((first, last, key) for first, last in _pairs(ranges))
+    overlaps = defaultdict(list)
+    for run, ranges in perRun.items():
+        ranges.sort()
+        active = []
+        for first, last, key in ranges:
+            active = [ other for other in active if other[1] >= first ]
+            for otherFirst, otherLast, otherKey in active:
+                if otherKey != key:
+                    pair = (otherKey, key) if otherKey < key else (key, otherKey)
+                    overlaps[pair].append((run, first, min(last, otherLast)))
+            active.append((first, last, key))
+    return dict((pair, LumiMask(ranges)) for pair, ranges in overlaps.items())
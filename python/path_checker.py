@@ -0,0 +1,110 @@
+import errno
+import os
+import threading
+import time
+from collections import defaultdict
+from Queue import Queue, Empty
+
+# status of a checked path
+OK, MISSING, UNKNOWN = "ok", "missing", "unknown"
+
+def _exists(path):
+    """as os.path.exists: links are followed, so broken links do not exist"""
+    try:
+        os.stat(path)
+    except OSError:
+        return False
+    return True
+
+def _checkDirectory(directory, names):
+    """{name: status} for entries of a directory, with a single listing when possible:
+       only the listed entries are looked at (os.stat, to follow the links)"""
+    try:
+        entries = set(os.listdir(directory))
+    except OSError as error:
+        if error.errno in (errno.ENOENT, errno.ENOTDIR):
+            return dict.fromkeys(names, MISSING)
+        # e.g. a directory that can be traversed but not listed
+        return dict((name, OK if _exists(os.path.join(directory, name)) else MISSING) for name in names)
+    return dict((name, OK if not name or (name in entries and _exists(os.path.join(directory, name))) else MISSING) for name in names)
+
+def checkPaths(paths, jobs=16, timeout=30., maxHung=None):
+    """
+    Check that paths exist, concurrently, and return {path: status} with status one of
+    OK, MISSING or UNKNOWN (the check did not finish within timeout seconds, e.g. on a hung mount).
+    Empty (or None) paths are MISSING, as with os.path.exists.
+    The paths are grouped by parent directory, and each directory is listed once.
+    Threads blocked on a hung directory cannot be interrupted: they are left behind (as daemon threads)
+    and replaced, up to maxHung (default: jobs) of them; after that, the remaining paths are reported as UNKNOWN.
+    """
+    byDirectory = defaultdict(set)
+    normalized = {}
+    empty = set()
+    for path in set(paths):
+        if not path:
+            empty.add(path)
+            continue
+        directory, name = os.path.split(os.path.abspath(path))
+        byDirectory[directory].add(name)
+        normalized[path] = (directory, name)
+    if maxHung is None:
+        maxHung = jobs
+    tasks = Queue()
+    for directory in byDirectory:
+        tasks.put(directory)
+    results = Queue()
+    started = {}
+    lock = threading.Lock()
+    def work():
+        while True:
+            try:
+                directory = tasks.get_nowait()
+            except Empty:
+                return
+            with lock:
+                started[directory] = time.time()
+            try:
+                statuses = _checkDirectory(directory, byDirectory[directory])
+            except Exception:
+                statuses = dict.fromkeys(byDirectory[directory], UNKNOWN)
+            results.put((directory, statuses))
+    def startWorker():
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+
+    for i in range(min(jobs, len(byDirectory))):
+        startWorker()
+    statuses = {}
+    pending = set(byDirectory)
+    nHung = 0
+    while pending:
+        try:
+            directory, dirStatuses = results.get(timeout=min(timeout, 1.))
+            if directory in pending:
+                pending.discard(directory)
+                statuses[directory] = dirStatuses
+        except Empty:
+            pass
+        now = time.time()
+        with lock:
+            hung = [ directory for directory in pending if directory in started and now-started[directory] > timeout ]
+        for directory in hung:
+            pending.discard(directory)
+            statuses[directory] = dict.fromkeys(byDirectory[directory], UNKNOWN)
+            nHung += 1
+            if nHung <= maxHung:
+                startWorker()
+        if nHung > maxHung:
+            # give up on the directories that were not started yet,
+            # the running ones finish or time out
+            while True:
+                try:
+                    directory = tasks.get_nowait()
+                except Empty:
+                    break
+                pending.discard(directory)
+                statuses[directory] = dict.fromkeys(byDirectory[directory], UNKNOWN)
+    result = dict((path, statuses[directory][name]) for path, (directory, name) in normalized.items())
+    result.update(dict.fromkeys(empty, MISSING))
+    return result
@@ -0,0 +1,115 @@
+from collections import defaultdict
+
+from .SAMADhi import Analysis, Dataset, Sample, Result, SampleResult
+
+class ProvenanceGraph(object):
+    """
+    In-memory index of the provenance graph: dataset -> sample -> (derived samples) -> result -> analysis.
+    It is loaded with one query per relation, after which all traversals are done in memory.
+    Nodes are (type, id) tuples, with type one of "dataset", "sample", "result" or "analysis";
+    the methods also accept the corresponding Storm objects.
+    The graph is not refreshed automatically: use the add/remove methods to keep it
+    in sync with the samples and results added or removed by the same process.
+    """
+
+    def __init__(self, store=None):
+        self._upstream = defaultdict(set)
+        self._downstream = defaultdict(set)
+        if store is not None:
+            self.load(store)
+
+    def load(self, store):
+        """(Re)load the full graph from the database"""
+        self._upstream.clear()
+        self._downstream.clear()
+        for sample_id, source_dataset_id, source_sample_id in store.find(Sample).values(
+                Sample.sample_id, Sample.source_dataset_id, Sample.source_sample_id):
+            self.addSample(sample_id, source_dataset_id, source_sample_id)
+        for result_id, analysis_id in store.find(Result).values(Result.result_id, Result.analysis_id):
+            self.addResult(result_id, analysis_id=analysis_id)
+        for sample_id, result_id in store.find(SampleResult).values(SampleResult.sample_id, SampleResult.result_id):
+            self._link(("sample", sample_id), ("result", result_id))
+
+    @staticmethod
+    def node(obj):
+        """Graph node for a Storm object, or a (type, id) tuple"""
+        if isinstance(obj, tuple):
+            return obj
+        elif isinstance(obj, Dataset):
+            return ("dataset", obj.dataset_id)
+        elif isinstance(obj, Sample):
+            return ("sample", obj.sample_id)
+        elif isinstance(obj, Result):
+            return ("result", obj.result_id)
+        elif isinstance(obj, Analysis):
+            return ("analysis", obj.analysis_id)
+        raise TypeError("%r is not a provenance graph node" % obj)
+
+    def _link(self, upstream, downstream):
+        self._upstream[downstream].add(upstream)
+        self._downstream[upstream].add(downstream)
+
+    def _unlinkAll(self, node):
+        for up in self._upstream.pop(node, ()):
+            self._downstream[up].discard(node)
+        for down in self._downstream.pop(node, ()):
+            self._upstream[down].discard(node)
+
+    def _walk(self, node, edges):
+        visited = set()
+        toVisit = [ self.node(node) ]
+        while toVisit:
+            for other in edges.get(toVisit.pop(), ()):
+                if other not in visited:
+                    visited.add(other)
+                    toVisit.append(other)
+        return visited
+
+    def children(self, node):
+        """Nodes directly downstream of node (e.g. the derived samples and results of a sample)"""
+        return set(self._downstream.get(self.node(node), ()))
+
+    def ancestors(self, node):
+        """All nodes upstream of node (datasets, source samples...)"""
+        return self._walk(node, self._upstream)
+
+    def descendants(self, node):
+        """All nodes downstream of node (derived samples, results, analyses)"""
+        return self._walk(node, self._downstream)
+
+    def results_depending_on(self, node):
+        """Ids of all the results that (directly or indirectly) depend on node"""
+        return set(nid for ntype, nid in self.descendants(node) if ntype == "result")
+
+    def datasets_upstream_of(self, node):
+        """Ids of all the datasets that node (directly or indirectly) depends on"""
+        return set(nid for ntype, nid in self.ancestors(node) if ntype == "dataset")
+
+    def addSample(self, sample_id, source_dataset_id=None, source_sample_id=None):
+        """Add (or update) a sample and its sources"""
+        node = ("sample", sample_id)
+        for up in list(self._upstream.get(node, ())):
+            self._downstream[up].discard(node)
+        self._upstream[node] = set()
+        if source_dataset_id is not None:
+            self._link(("dataset", source_dataset_id), node)
+        if source_sample_id is not None:
+            self._link(("sample", source_sample_id), node)
+
+    def removeSample(self, sample_id):
+        self._unlinkAll(("sample", sample_id))
+
+    def addResult(self, result_id, sample_ids=(), analysis_id=None):
+        """Add a result, the samples it uses and its analysis (the links of an existing result are kept)"""
+        node = ("result", result_id)
+        self._upstream.setdefault(node, set()) # results without samples are nodes too
+        for sample_id in sample_ids:
+            self._link(("sample", sample_id), node)
+        if analysis_id is not None:
+            self._link(node, ("analysis", analysis_id))
+
+    def removeResult(self, result_id):
+        self._unlinkAll(("result", result_id))
+
+    def removeDataset(self, dataset_id):
+        self._unlinkAll(("dataset", dataset_id))
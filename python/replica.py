@@ -0,0 +1,139 @@
+import sqlite3
+from datetime import timedelta
+
+from storm.info import get_cls_info
+
+from .SAMADhi import Analysis, Dataset, Sample, Result, SampleResult, File, _deferredNames
+
+# tables mirrored in the replica, in dependency order.
+# Rows of tables with a last_modified column are synced incrementally,
+# the others are copied entirely at each sync.
+replicatedTables = [ (Analysis, True), (Dataset, True), (Sample, True), (Result, True), (SampleResult, False) ]
+# the file table is optional. Its rows are synced per sample: adding or removing
+# files updates the files aggregates of the sample, hence its last_modified column.
+replicatedFiles = (File, False)
+
+# margin on the timestamp of the previous sync, for transactions that were still open
+syncMargin = timedelta(minutes=10)
+
+_sqliteTypes = { "IntVariable": "INTEGER", "FloatVariable": "REAL", "UnicodeVariable": "TEXT", "DateTimeVariable": "TIMESTAMP" }
+
+def _tableColumns(cls):
+    """all the columns of the table, including those that cls loads on demand (see SAMADhi.Deferred)"""
+    columns = list(get_cls_info(cls).columns)
+    deferred = getattr(cls, "__storm_deferred__", None)
+    if deferred is not None:
+        columns += [ getattr(deferred, name) for name in _deferredNames(deferred) ]
+    return columns
+
+def _columns(cls):
+    return [ column.name for column in _tableColumns(cls) ]
+
+def _primaryKey(cls):
+    return [ column.name for column in get_cls_info(cls).primary_key ]
+
+def _createTable(replica, cls):
+    info = get_cls_info(cls)
+    columns = [ "%s %s" % (column.name, _sqliteTypes.get(column.variable_factory.func.__name__, "")) for column in _tableColumns(cls) ]
+    replica.execute("CREATE TABLE IF NOT EXISTS %s (%s, PRIMARY KEY (%s))" % (
+        info.table.name, ", ".join(columns), ", ".join(_primaryKey(cls))))
+    if cls is File:
+        replica.execute("CREATE INDEX IF NOT EXISTS idx_file_sample ON file (sample_id)")
+
+def _copyRows(source, replica, cls, where=None, params=(), pageSize=5000):
+    """copy the rows of a table matching where (raw SQL) from the source store to the replica.
+       Tables with a single-column key are read in pages, to bound the memory use."""
+    table = get_cls_info(cls).table.name
+    columns = _columns(cls)
+    select = "SELECT %s FROM %s" % (", ".join(columns), table)
+    insert = "INSERT OR REPLACE INTO %s (%s) VALUES (%s)" % (table, ", ".join(columns), ", ".join("?" for c in columns))
+    condition = "(%s)" % where if where else "1=1"
+    primaryKey = _primaryKey(cls)
+    if len(primaryKey) != 1:
+        rows = source.execute("%s WHERE %s" % (select, condition), params).get_all()
+        replica.executemany(insert, rows)
+        return len(rows)
+    key, = primaryKey
+    keyIndex = columns.index(key)
+    nRows = 0
+    lastKey = None
+    while True:
+        if lastKey is None:
+            page = source.execute("%s WHERE %s ORDER BY %s LIMIT %d" % (select, condition, key, pageSize), params).get_all()
+        else:
+            page = source.execute("%s WHERE %s AND %s > ? ORDER BY %s LIMIT %d" % (select, condition, key, key, pageSize), tuple(params)+(lastKey,)).get_all()
+        replica.executemany(insert, page)
+        nRows += len(page)
+        if len(page) < pageSize:
+            return nRows
+        lastKey = page[-1][keyIndex]
+
+def _removeMissing(source, replica, cls):
+    """remove the rows of the replica that were deleted in the source"""
+    table = get_cls_info(cls).table.name
+    key, = _primaryKey(cls)
+    sourceIds = set(row[0] for row in source.execute("SELECT %s FROM %s" % (key, table)))
+    removed = [ (rowId,) for (rowId,) in replica.execute("SELECT %s FROM %s" % (key, table)) if rowId not in sourceIds ]
+    replica.executemany("DELETE FROM %s WHERE %s = ?" % (table, key), removed)
+    return [ rowId for (rowId,) in removed ]
+
+def syncReplica(source, path, withFiles=None, full=False, verbose=True):
+    """
+    Mirror the SAMADhi tables into a local SQLite file.
+    The first sync copies everything; afterwards only the rows that are new
+    (by id) or changed since the previous sync (by last_modified timestamp) are fetched,
+    and rows deleted in the source are removed.
+    Files are only replicated if withFiles is set (None keeps the choice of the previous sync);
+    the file table of a replica synced without files is removed, rather than left outdated.
+    """
+    replica = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+    try:
+        replica.execute("CREATE TABLE IF NOT EXISTS replica_info (last_sync TIMESTAMP, with_files INTEGER)")
+        info = replica.execute("SELECT last_sync, with_files FROM replica_info").fetchone()
+        if withFiles is None:
+            withFiles = info is not None and bool(info[1])
+        tables = replicatedTables + ([ replicatedFiles ] if withFiles else [])
+        if not withFiles:
+            replica.execute("DROP TABLE IF EXISTS file")
+        for cls, incremental in tables:
+            _createTable(replica, cls)
+        syncStart, = source.execute("SELECT CURRENT_TIMESTAMP").get_one()
+        lastSync = None if full or info is None else info[0]
+        changedSamples = set()
+        for cls, incremental in tables:
+            table = get_cls_info(cls).table.name
+            if cls is File:
+                if lastSync is None or not info[1]:
+                    replica.execute("DELETE FROM file")
+                    nRows = _copyRows(source, replica, File)
+                else:
+                    nRows = 0
+                    changed = list(changedSamples)
+                    for i in range(0, len(changed), 500):
+                        chunk = changed[i:i+500]
+                        marks = ",".join("?" for s in chunk)
+                        replica.execute("DELETE FROM file WHERE sample_id IN (%s)" % marks, chunk)
+                        nRows += _copyRows(source, replica, File, "sample_id IN (%s)" % marks, chunk)
+            elif not incremental:
+                replica.execute("DELETE FROM %s" % table)
+                nRows = _copyRows(source, replica, cls)
+            else:
+                key, = _primaryKey(cls)
+                if lastSync is None:
+                    where, params = None, ()
+                else:
+                    maxId, = replica.execute("SELECT COALESCE(MAX(%s), 0) FROM %s" % (key, table)).fetchone()
+                    where, params = "last_modified >= ? OR %s > ?" % key, (lastSync-syncMargin, maxId)
+                nRows = _copyRows(source, replica, cls, where, params)
+                removed = _removeMissing(source, replica, cls)
+                if cls is Sample and lastSync is not None:
+                    changedSamples.update(row[0] for row in source.execute("SELECT sample_id FROM sample WHERE %s" % where, params))
+                    changedSamples.update(removed)
+            if verbose:
+                print("%s: %d rows copied" % (table, nRows))
+        replica.execute("DELETE FROM replica_info")
+        replica.execute("INSERT INTO replica_info (last_sync, with_files) VALUES (?, ?)", (syncStart, int(withFiles)))
+        replica.commit()
+    finally:
+        replica.close()
+        source.rollback()
@@ -0,0 +1,114 @@
+import json
+import os
+import sqlite3
+import time
+
+class ReportState(object):
+    """
+    Persistent state of the checks of SAMADhi_dbAnalysis (SQLite file), so that
+    a run only repeats the checks that are new, failed or too old.
+    """
+
+    def __init__(self, path, inMemory=False):
+        """with inMemory, the state is a copy of the file in memory, that is never written back (e.g. for a dry run)"""
+        path = os.path.expanduser(path)
+        if inMemory:
+            self.connection = sqlite3.connect(":memory:")
+            if os.path.exists(path):
+                source = sqlite3.connect(path, timeout=60.)
+                try:
+                    self.connection.executescript("\n".join(source.iterdump()))
+                finally:
+                    source.close()
+        else:
+            self.connection = sqlite3.connect(path, timeout=60.)
+        # last_modified is the one of the dataset row at the time of the check
+        self.connection.execute("CREATE TABLE IF NOT EXISTS dataset_check (dataset_id INTEGER PRIMARY KEY, name TEXT, checked REAL, status TEXT, message TEXT, last_modified TEXT)")
+        if "last_modified" not in [ row[1] for row in self.connection.execute("PRAGMA table_info(dataset_check)") ]:
+            # state file of an older version
+            self.connection.execute("ALTER TABLE dataset_check ADD COLUMN last_modified TEXT")
+        # kind is "sample" or "result"; since is the time of the last status change
+        self.connection.execute("CREATE TABLE IF NOT EXISTS path_check (kind TEXT, object_id INTEGER, path TEXT, checked REAL, status TEXT, since REAL, "
+                                "PRIMARY KEY (kind, object_id, path))")
+        # directories of the files of the samples without path, for the files (nfiles, files_nevents, largest file id) at that time
+        self.connection.execute("CREATE TABLE IF NOT EXISTS sample_directories (sample_id INTEGER PRIMARY KEY, nfiles INTEGER, files_nevents INTEGER, "
+                                "resolved REAL, directories TEXT, last_file_id INTEGER)")
+        if "last_file_id" not in [ row[1] for row in self.connection.execute("PRAGMA table_info(sample_directories)") ]:
+            # state file of an older version, the directories will be resolved again
+            self.connection.execute("ALTER TABLE sample_directories ADD COLUMN last_file_id INTEGER")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS path_check_history (kind TEXT, object_id INTEGER, path TEXT, changed REAL, status TEXT)")
+        self.connection.commit()
+
+    def datasetChecks(self):
+        """{dataset_id: (last check time, status, message, last_modified of the dataset when checked)}"""
+        return dict((row[0], row[1:]) for row in self.connection.execute("SELECT dataset_id, checked, status, message, last_modified FROM dataset_check"))
+
+    def setDatasetCheck(self, dataset_id, name, status, message=None, checked=None, lastModified=None):
+        self.connection.execute("INSERT OR REPLACE INTO dataset_check (dataset_id, name, checked, status, message, last_modified) VALUES (?, ?, ?, ?, ?, ?)",
+                                (dataset_id, name, checked if checked is not None else time.time(), status, message, lastModified))
+
+    def removeDatasetChecks(self, keep):
+        """forget the datasets that are not in keep (ids of the existing datasets)"""
+        keep = set(keep)
+        removed = [ (dataset_id,) for dataset_id in self.datasetChecks() if dataset_id not in keep ]
+        self.connection.executemany("DELETE FROM dataset_check WHERE dataset_id = ?", removed)
+
+    def pathChecks(self, kind):
+        """{(object_id, path): (last check time, status, time of the last status change)}"""
+        return dict(((row[0], row[1]), row[2:]) for row in self.connection.execute(
+            "SELECT object_id, path, checked, status, since FROM path_check WHERE kind = ?", (kind,)))
+
+    def setPathChecks(self, kind, checks, checked=None):
+        """
+        Store the results of path checks, from a sequence of (object_id, path, status).
+        The status changes (and new paths) are added to the history.
+        Unknown results (the check did not finish) only update paths that were never checked before.
+        """
+        checked = checked if checked is not None else time.time()
+        previous = self.pathChecks(kind)
+        updated, changed = [], []
+        for object_id, path, status in checks:
+            before = previous.get((object_id, path))
+            if before is not None and status == "unknown":
+                continue
+            since = before[2] if before is not None and before[1] == status else checked
+            if before is None or before[1] != status:
+                changed.append((kind, object_id, path, checked, status))
+            updated.append((kind, object_id, path, checked, status, since))
+        self.connection.executemany("INSERT OR REPLACE INTO path_check (kind, object_id, path, checked, status, since) VALUES (?, ?, ?, ?, ?, ?)", updated)
+        self.connection.executemany("INSERT INTO path_check_history (kind, object_id, path, changed, status) VALUES (?, ?, ?, ?, ?)", changed)
+
+    def pathHistory(self, kind, object_id):
+        """[(time, path, status)] status changes of the paths of an object, oldest first"""
+        return self.connection.execute("SELECT changed, path, status FROM path_check_history WHERE kind = ? AND object_id = ? ORDER BY changed",
+                                       (kind, object_id)).fetchall()
+
+    def removePathChecks(self, kind, keep):
+        """forget the (object_id, path) pairs of kind that are not in keep, and their history"""
+        keep = set(keep)
+        removed = [ (kind,)+key for key in self.pathChecks(kind) if key not in keep ]
+        self.connection.executemany("DELETE FROM path_check WHERE kind = ? AND object_id = ? AND path = ?", removed)
+        self.connection.executemany("DELETE FROM path_check_history WHERE kind = ? AND object_id = ? AND path = ?", removed)
+
+    def sampleDirectories(self):
+        """{sample_id: ((nfiles, files_nevents, largest file id), time of the resolution, [directories])}"""
+        return dict((row[0], ((row[1], row[2], row[3]), row[4], json.loads(row[5]))) for row in self.connection.execute(
+            "SELECT sample_id, nfiles, files_nevents, last_file_id, resolved, directories FROM sample_directories"))
+
+    def setSampleDirectories(self, sample_id, files, directories, resolved=None):
+        """files is (nfiles, files_nevents, largest file id) of the sample when the directories were resolved"""
+        self.connection.execute("INSERT OR REPLACE INTO sample_directories (sample_id, nfiles, files_nevents, last_file_id, resolved, directories) VALUES (?, ?, ?, ?, ?, ?)",
+                                (sample_id, files[0], files[1], files[2], resolved if resolved is not None else time.time(), json.dumps(directories)))
+
+    def removeSampleDirectories(self, keep):
+        """forget the samples that are not in keep"""
+        keep = set(keep)
+        removed = [ (sample_id,) for (sample_id,) in self.connection.execute("SELECT sample_id FROM sample_directories") if sample_id not in keep ]
+        self.connection.executemany("DELETE FROM sample_directories WHERE sample_id = ?", removed)
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        """close the file, without committing"""
+        self.connection.close()
@@ -0,0 +1,130 @@
+"""
+Statistics of the database analysis report (SAMADhi_dbAnalysis), computed with numpy
+from columns fetched in bulk, in the format of the dashboard charts (Highcharts):
+lists of [x, y] points.
+ROOT is only needed to also save the charts in a ROOT file (ROOTWriter).
+"""
+
+import time
+import numpy as np
+
+def epochMilliseconds(times):
+    """
+    Milliseconds since the epoch of naive datetimes in local time (as strftime("%s")*1000), as an int64 array.
+    The UTC offset only changes on hour boundaries, so it is computed once per distinct hour.
+    """
+    wallClock = np.array(times, dtype="datetime64[s]").astype(np.int64)
+    if not len(wallClock):
+        return wallClock
+    hours, inverse = np.unique(wallClock//3600, return_inverse=True)
+    offsets = np.array([ time.mktime(time.gmtime(hour*3600)[:8]+(-1,)) - hour*3600 for hour in hours.tolist() ], dtype=np.int64)
+    return (wallClock + offsets[inverse])*1000
+
+def timeProfile(times, weights=None):
+    """
+    Cumulative profile [[ms since the epoch, total], ...] for sorted times,
+    where the total is the number of entries up to that time, or the sum of their weights if given.
+    """
+    milliseconds = epochMilliseconds(times)
+    if weights is None:
+        totals = np.arange(1, len(milliseconds)+1)
+    else:
+        totals = np.cumsum(np.asarray(weights, dtype=np.int64))
+    return [ [ t, total ] for t, total in zip(milliseconds.tolist(), totals.tolist()) ]
+
+def histogram(values, nbins, low=None, high=None):
+    """
+    Histogram [[bin center, content], ...] of values, as a ROOT TH1 with nbins bins between low and high:
+    the values outside of [low, high) are under- or overflow, and not included.
+    Without range, the bins span the values, from their minimum to their maximum (included).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if low is None or high is None:
+        low, high = (values.min(), values.max()) if len(values) else (0., 1.)
+        if high <= low:
+            high = low+1.
+    else:
+        values = values[(values >= low) & (values < high)]
+    contents, edges = np.histogram(values, nbins, (low, high))
+    centers = (edges[:-1]+edges[1:])/2.
+    return [ [ center, content ] for center, content in zip(centers.tolist(), contents.astype(np.float64).tolist()) ]
+
+def countPerKey(keys, references):
+    """number of times each of keys appears in references (e.g. the source dataset ids of the samples), aligned with keys"""
+    keys = np.asarray(keys, dtype=np.int64)
+    distinct, counts = np.unique(np.asarray(references, dtype=np.int64), return_counts=True)
+    if not len(distinct):
+        return np.zeros(len(keys), dtype=np.int64)
+    index = np.clip(np.searchsorted(distinct, keys), 0, len(distinct)-1)
+    return np.where(distinct[index] == keys, counts[index], 0)
+
+class ROOTWriter(object):
+    """
+    Optional ROOT output of the report: pie charts, graphs and histograms saved in a ROOT file.
+    It does nothing if path is None (e.g. dry run) or ROOT cannot be imported.
+    """
+
+    def __init__(self, path):
+        self.file = None
+        self._histograms = []
+        if path is None:
+            return
+        try:
+            import ROOT
+        except ImportError:
+            return
+        ROOT.gROOT.SetBatch()
+        self.ROOT = ROOT
+        self.file = ROOT.TFile(path, "update")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        if self.file is not None:
+            self.file.Write()
+            self.file.Close()
+            self.file = None
+            self._histograms = []
+
+    def pie(self, name, title, canvasName, entries):
+        """pie chart of (label, count) entries, drawn on a canvas"""
+        if self.file is None:
+            return
+        ROOT = self.ROOT
+        pie = ROOT.TPie(name, title, len(entries))
+        for index, (label, count) in enumerate(entries):
+            pie.SetEntryVal(index, count)
+            pie.SetEntryLabel(index, "None" if label is None else (label if isinstance(label, basestring) else str(label)))
+        pie.SetTextAngle(0)
+        pie.SetRadius(0.3)
+        pie.SetTextColor(1)
+        pie.SetTextFont(62)
+        pie.SetTextSize(0.03)
+        canvas = ROOT.TCanvas(canvasName, "", 2)
+        pie.Draw("r")
+        ROOT.gPad.Write()
+
+    def graph(self, name, profile):
+        """graph of a time profile (see timeProfile), with the time in seconds"""
+        if self.file is None:
+            return
+        graph = self.ROOT.TGraph(len(profile))
+        for i, (t, total) in enumerate(profile):
+            graph.SetPoint(i, t/1000, total)
+        graph.Write(name)
+
+    def histogram(self, name, points):
+        """histogram from the [[bin center, content], ...] points of histogram (with at least 2 bins)"""
+        if self.file is None:
+            return
+        width = points[1][0]-points[0][0]
+        self.file.cd()
+        hist = self.ROOT.TH1D(name, name, len(points), points[0][0]-width/2., points[-1][0]+width/2.)
+        for i, (center, content) in enumerate(points):
+            hist.SetBinContent(i+1, content)
+        # attached to the file, which writes it when closed
+        self._histograms.append(hist)
@@ -0,0 +1,168 @@
+"""
+Minimal reader for the ROOT file format, without ROOT.
+
+It only supports what is needed to register samples: the number of entries
+of a TTree and the value of a TParameter in the top directory of a file.
+Other classes, subdirectories and compression algorithms other than zlib
+raise UnsupportedROOTFile, so callers can fall back to PyROOT.
+"""
+
+import struct
+import zlib
+
+class UnsupportedROOTFile(Exception):
+    pass
+
+_kByteCountMask = 0x40000000
+_kIsReferenced = 1 << 4
+
+class _Cursor(object):
+    """big-endian reader on a byte buffer"""
+
+    def __init__(self, data, pos=0):
+        self.data = data
+        self.pos = pos
+
+    def read(self, fmt):
+        values = struct.unpack_from(">"+fmt, self.data, self.pos)
+        self.pos += struct.calcsize(">"+fmt)
+        return values if len(values) > 1 else values[0]
+
+    def string(self):
+        length = self.read("B")
+        if length == 255:
+            length = self.read("i")
+        value = self.data[self.pos:self.pos+length]
+        self.pos += length
+        return value
+
+    def version(self):
+        """read a (byte count and) version header, and return (version, end position or None)"""
+        byteCount = self.read("I")
+        if byteCount & _kByteCountMask:
+            end = self.pos + (byteCount & ~_kByteCountMask)
+            return self.read("h"), end
+        self.pos -= 4
+        return self.read("h"), None
+
+    def skipTObject(self):
+        """skip a streamed TObject base class, which has no byte count:
+           version, fUniqueID, fBits, and the process id if the object is referenced"""
+        version, uniqueID, bits = self.read("hII")
+        if bits & _kIsReferenced:
+            self.read("H")
+
+    def skipObject(self):
+        """skip a streamed base class or object, using its byte count"""
+        version, end = self.version()
+        if end is None:
+            raise UnsupportedROOTFile("object without byte count")
+        self.pos = end
+
+class _Key(object):
+    def __init__(self, cursor):
+        self.nbytes, version, self.objlen, datime, self.keylen, self.cycle = cursor.read("ihiihh")
+        if version > 1000:
+            self.seekkey, seekpdir = cursor.read("qq")
+        else:
+            self.seekkey, seekpdir = cursor.read("ii")
+        self.classname = cursor.string()
+        self.name = cursor.string()
+        self.title = cursor.string()
+
+class ROOTFile(object):
+    """Keys and simple objects of the top directory of a ROOT file"""
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        try:
+            self._readKeys()
+        except Exception:
+            self.close()
+            raise
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _readAt(self, position, length, exact=True):
+        self.file.seek(position)
+        data = self.file.read(length)
+        if exact and len(data) != length:
+            raise IOError("truncated ROOT file")
+        return data
+
+    def _readKeys(self):
+        header = _Cursor(self._readAt(0, 64, exact=False))
+        if header.data[:4] != b"root":
+            raise UnsupportedROOTFile("not a ROOT file")
+        header.pos = 4
+        version, begin = header.read("ii")
+        header.pos = 28 if version < 1000000 else 36
+        nbytesName = header.read("i")
+        # top directory record, after the key and the name and title of the file
+        directory = _Cursor(self._readAt(begin + nbytesName, 42, exact=False))
+        dirVersion = directory.read("h")
+        directory.pos += 4+4+4+4 # datimes, nbyteskeys, nbytesname
+        if dirVersion > 1000:
+            seekdir, seekparent, seekkeys = directory.read("qqq")
+        else:
+            seekdir, seekparent, seekkeys = directory.read("iii")
+        keysHeader = _Key(_Cursor(self._readAt(seekkeys, 1024, exact=False)))
+        keys = _Cursor(self._readAt(seekkeys, keysHeader.nbytes), keysHeader.keylen)
+        self.keys = {}
+        for i in range(keys.read("i")):
+            key = _Key(keys)
+            if key.name not in self.keys or self.keys[key.name].cycle < key.cycle:
+                self.keys[key.name] = key
+
+    def _objectBuffer(self, key):
+        data = self._readAt(key.seekkey + key.keylen, key.nbytes - key.keylen)
+        if key.objlen == len(data):
+            return data
+        # compressed, in blocks with a 9 bytes header: algorithm, method, compressed and uncompressed sizes
+        blocks = []
+        pos = 0
+        while pos < len(data):
+            algorithm = data[pos:pos+2]
+            compressedSize = struct.unpack("<I", data[pos+3:pos+6]+b"\0")[0]
+            if algorithm != b"ZL":
+                raise UnsupportedROOTFile("unsupported compression algorithm %r" % algorithm)
+            blocks.append(zlib.decompress(data[pos+9:pos+9+compressedSize]))
+            pos += 9 + compressedSize
+        return b"".join(blocks)
+
+    def classname(self, name):
+        key = self.keys.get(name)
+        return key.classname if key is not None else None
+
+    def treeEntries(self, name):
+        """number of entries (fEntries) of a TTree"""
+        key = self.keys[name]
+        if key.classname != b"TTree":
+            raise UnsupportedROOTFile("%s is a %s" % (name, key.classname))
+        cursor = _Cursor(self._objectBuffer(key))
+        cursor.version()
+        for base in range(4): # TNamed, TAttLine, TAttFill, TAttMarker
+            cursor.skipObject()
+        return cursor.read("q")
+
+    _parameterTypes = { b"TParameter<double>": "d", b"TParameter<float>": "f", b"TParameter<int>": "i",
+                        b"TParameter<Long64_t>": "q", b"TParameter<long>": "q" }
+
+    def parameterValue(self, name):
+        """value (fVal) of a TParameter (TObject, fName and fVal)"""
+        key = self.keys[name]
+        fmt = self._parameterTypes.get(key.classname)
+        if fmt is None:
+            raise UnsupportedROOTFile("%s is a %s" % (name, key.classname))
+        cursor = _Cursor(self._objectBuffer(key))
+        cursor.version()
+        cursor.skipTObject()
+        cursor.string() # fName
+        return cursor.read(fmt)
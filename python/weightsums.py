@@ -0,0 +1,101 @@
+import base64
+import json
+
+def _numpy():
+    """numpy is only needed to work with the weight sums"""
+    import numpy
+    return numpy
+
+class WeightSums(object):
+    """
+    Named vector of sums of event weights, e.g. for the systematic variations
+    stored in the extras_event_weight_sum columns of samples and files.
+    In the database, the values are stored as a base64-encoded array of little-endian doubles:
+      {"names": ["scale_0", "scale_1", ...], "sums": "<base64>"}
+    The older format, a JSON dictionary {"scale_0": 1.5, ...}, is also read.
+    """
+
+    def __init__(self, names, values):
+        np = _numpy()
+        self.names = list(names)
+        self.values = np.asarray(values, dtype=np.float64)
+        if self.values.shape != (len(self.names),):
+            raise ValueError("%d names for %s values" % (len(self.names), self.values.shape))
+
+    @classmethod
+    def fromDict(cls, sums):
+        names = sorted(sums)
+        return cls(names, [ sums[name] for name in names ])
+
+    @classmethod
+    def fromText(cls, text):
+        """Parse the content of an extras_event_weight_sum column (None for an empty column)"""
+        if not text:
+            return None
+        data = json.loads(text)
+        if isinstance(data.get("sums"), basestring) and isinstance(data.get("names"), list):
+            return cls(data["names"], _numpy().frombuffer(base64.b64decode(data["sums"]), dtype="<f8"))
+        return cls.fromDict(data)
+
+    def toText(self):
+        return unicode(json.dumps({ "names": self.names, "sums": base64.b64encode(self.values.astype("<f8").tostring()) }))
+
+    def asDict(self):
+        return dict(zip(self.names, self.values.tolist()))
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, name):
+        return self.values[self.names.index(name)]
+
+    def __add__(self, other):
+        return WeightSums.sum([ self, other ])
+
+    def __repr__(self):
+        return "WeightSums(%s)" % ", ".join("%s=%g" % item for item in zip(self.names, self.values))
+
+    @classmethod
+    def sum(cls, allSums):
+        """
+        Sum of many WeightSums (None entries are skipped), in one vectorised pass
+        per list of names; a name missing from some of them counts as zero there.
+        Returns None if there is nothing to sum.
+        """
+        np = _numpy()
+        byNames = {}
+        for sums in allSums:
+            if sums is not None:
+                byNames.setdefault(tuple(sums.names), []).append(sums.values)
+        if not byNames:
+            return None
+        totals = dict((names, np.sum(values, axis=0)) for names, values in byNames.items())
+        if len(totals) == 1:
+            names, total = totals.popitem()
+            return cls(names, total)
+        allNames = sorted(set(name for names in totals for name in names))
+        index = dict((name, i) for i, name in enumerate(allNames))
+        total = np.zeros(len(allNames))
+        for names, values in totals.items():
+            total[[ index[name] for name in names ]] += values
+        return cls(allNames, total)
+
+    @classmethod
+    def sumTexts(cls, texts):
+        """Sum of the weight sums stored in a sequence of column values.
+           The files of one production usually share the list of names: the arrays
+           for each distinct list are concatenated and summed as a single matrix."""
+        np = _numpy()
+        byNames = {}
+        legacy = []
+        for text in texts:
+            if not text:
+                continue
+            data = json.loads(text)
+            if isinstance(data.get("sums"), basestring) and isinstance(data.get("names"), list):
+                byNames.setdefault(tuple(data["names"]), []).append(base64.b64decode(data["sums"]))
+            else:
+                legacy.append(cls.fromDict(data))
+        stacked = [ cls(names, np.frombuffer(b"".join(buffers), dtype="<f8").reshape(len(buffers), len(names)).sum(axis=0))
+                    for names, buffers in byNames.items() ]
+        return cls.sum(stacked+legacy)
@@ -4,17 +4,21 @@
 
 import os,errno,json
 import re
-import ROOT
-ROOT.gROOT.SetBatch()
+import time
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser, OptionGroup
 from datetime import date
 from collections import defaultdict
-from cp3_llbb.SAMADhi.SAMADhi import Analysis, Dataset, Sample, Result, DbStore
-from cp3_llbb.SAMADhi.SAMADhi import File as SFile
+from cp3_llbb.SAMADhi.SAMADhi import Analysis, Dataset, Sample, Result, SampleResult, DbStore
+from storm.expr import Column
 from storm.info import get_cls_info
 from datetime import datetime
 from collections import defaultdict
-from cp3_llbb.SAMADhi.das_import import query_das
+from cp3_llbb.SAMADhi.das_import import query_das, DASCache, set_das_cache, RateLimiter
+from cp3_llbb.SAMADhi.report_state import ReportState
+from cp3_llbb.SAMADhi.integrity import checkIntegrity
+from cp3_llbb.SAMADhi.path_checker import checkPaths, OK, MISSING, UNKNOWN
+from cp3_llbb.SAMADhi.report_stats import ROOTWriter, timeProfile, histogram, countPerKey
 
 class MyOptionParser:
     """
@@ -32,6 +36,36 @@ class MyOptionParser:
         self.parser.add_option("-f","--full", action="store_true",
                                dest="DAScrosscheck", default=False,
              help="Full check: compares each Dataset entry to DAS and check for consistency (slow!)")
+        self.parser.add_option("--das-cache", action="store", type="string",
+                               dest="dasCache", default="~/.samadhi_das_cache.db",
+             help="File used to cache the DAS responses of the full check")
+        self.parser.add_option("--das-ttl", action="store", type="float",
+                               dest="dasTTL", default=24.,
+             help="Maximal age, in hours, of the cached DAS responses: only older entries are queried again")
+        self.parser.add_option("--no-das-cache", action="store_const", const=None,
+                               dest="dasCache",
+             help="Always query DAS, without cache")
+        self.parser.add_option("--das-jobs", action="store", type="int",
+                               dest="dasJobs", default=4,
+             help="Number of datasets checked in parallel against DAS")
+        self.parser.add_option("--das-rate", action="store", type="float",
+                               dest="dasRate", default=2.,
+             help="Maximal number of datasets checked against DAS per second")
+        self.parser.add_option("--das-max-age", action="store", type="float",
+                               dest="dasMaxAge", default=7.,
+             help="Full check: only check the datasets that were never verified, or more than this number of days ago")
+        self.parser.add_option("--state", action="store", type="string",
+                               dest="state", default=None,
+             help="File where the results of the checks are kept between runs (default: basedir/data/checks.db)")
+        self.parser.add_option("--path-jobs", action="store", type="int",
+                               dest="pathJobs", default=16,
+             help="Number of directories checked in parallel for the sample and result paths")
+        self.parser.add_option("--path-timeout", action="store", type="float",
+                               dest="pathTimeout", default=30.,
+             help="Time (in seconds) after which a path check is abandoned, and the path reported as unknown (e.g. hung mount)")
+        self.parser.add_option("--path-max-age", action="store", type="float",
+                               dest="pathMaxAge", default=7.,
+             help="Only check again the paths that were found at the previous runs if their last check is older than this number of days")
         self.parser.add_option("-d","--dry", action="store_true",
                                dest="dryRun", default=False,
              help="Dry run: do no write to disk")
@@ -45,6 +79,8 @@ class MyOptionParser:
           opts.path = os.path.abspath(os.path.expandvars(os.path.expanduser(opts.path)))
         if not opts.dryRun and os.path.exists(opts.path):
            raise OSError(errno.EEXIST,"Existing directory",opts.path);
+        if opts.state is None:
+          opts.state = os.path.join(opts.basedir,"data","checks.db")
         return opts
 
 def main():
@@ -54,6 +90,8 @@ def main():
     opts = optmgr.get_opt()
     # connect to the MySQL database using default credentials
     dbstore = DbStore()
+    if opts.dasCache is not None:
+      set_das_cache(DASCache(opts.dasCache, ttl=opts.dasTTL*3600))
     # prepare the output directory
     if not os.path.exists(opts.path) and not opts.dryRun:
       os.makedirs(opts.path)
@@ -69,7 +107,7 @@ def main():
     # check datasets
     outputDict = {}
     outputDict["DatabaseInconsistencies"] = checkDatasets(dbstore,opts) if opts.DAScrosscheck else copyInconsistencies(opts.basedir)
-    dbstore = DbStore() # reconnect, since the checkDatasets may take very long...
+    dbstore = DbStore() # checks the pooled connection (and reconnects), since the checkDatasets may take very long...
     outputDict["Orphans"] = findOrphanDatasets(dbstore,opts)
     outputDict["IncompleteData"] = checkDatasetsIntegrity(dbstore,opts)
     outputDict["DatasetsStatistics"] = analyzeDatasetsStatistics(dbstore,opts)
@@ -80,7 +118,7 @@ def main():
 
     # check samples
     outputDict = {}
-    outputDict["MissingDirSamples"] = checkSamplePath(dbstore,opts)
+    outputDict["MissingDirSamples"], outputDict["UnknownDirSamples"], outputDict["MissingSince"] = checkSamplePath(dbstore,opts)
     outputDict["DatabaseInconsistencies"] = checkSampleConsistency(dbstore,opts)
     outputDict["SampleStatistics"] = analyzeSampleStatistics(dbstore,opts)
     if not opts.dryRun:
@@ -90,7 +128,7 @@ def main():
 
     # now, check results
     outputDict = {}
-    outputDict["MissingDirSamples"] = checkResultPath(dbstore,opts)
+    outputDict["MissingDirSamples"], outputDict["UnknownDirSamples"], outputDict["MissingSince"] = checkResultPath(dbstore,opts)
     outputDict["DatabaseInconsistencies"] = checkResultConsistency(dbstore,opts)
     outputDict["SelectedResults"] = selectResults(dbstore,opts)
     outputDict["ResultsStatistics"] = analyzeResultsStatistics(dbstore,opts)
@@ -125,49 +163,95 @@ def collectGeneralStats(dbstore,opts):
     print results.count(), " results"
     return result
 
+def openState(opts):
+    """the state of the checks from the previous runs (see --state), a copy in memory for a dry run"""
+    if opts.dryRun:
+      return ReportState(opts.state, inMemory=True)
+    if not os.path.exists(os.path.dirname(os.path.abspath(opts.state))):
+      os.makedirs(os.path.dirname(os.path.abspath(opts.state)))
+    return ReportState(opts.state)
+
+def compareWithDAS(dataset, pool=None):
+    """check one dataset against DAS. dataset is a (name, cmssw_release, datatype, nevents, dsize) tuple.
+       The DAS queries are run in pool if given (see query_das).
+       Returns (status, message), with status ok, inconsistent or error."""
+    name, cmssw_release, datatype, nevents, dsize = dataset
+    # query DAS to get the same dataset, by name
+    try:
+      metadata = query_das(name, pool=pool)
+    except Exception as e:
+      return "error", "Error getting dataset in DAS: %s"%str(e)
+    # perform some checks: 
+    try:
+      # release name either matches or is unknown in DAS
+      test1 = str(metadata[u'release'])=="unknown" or cmssw_release == str(metadata[u'release'])
+      # datatype matches
+      test2 = datatype == metadata[u'datatype']
+      # nevents matches
+      test3 = nevents == metadata[u'nevents']
+      # size matches
+      test4 = dsize == metadata[u'file_size']
+    except Exception as e:
+      return "inconsistent", "Incomplete DAS metadata: %s"%str(e)
+    if not(test1 and test2 and test3 and test4):
+      return "inconsistent", None
+    return "ok", None
+
 def checkDatasets(dbstore,opts):
-    datasets = dbstore.find(Dataset)
+    # Datasets are checked in parallel (with a limited rate of DAS requests),
+    # and only if they were never checked, were modified since (last_modified column), or their last check is older than dasMaxAge.
+    # The results are kept in the state file, so the report also lists the inconsistencies found by the previous runs.
+    datasets = dict((row[0],row) for row in dbstore.find(Dataset).values(Dataset.dataset_id, Dataset.name, Dataset.cmssw_release, Dataset.datatype,
+                                                                         Dataset.nevents, Dataset.dsize, Dataset.creation_time,
+                                                                         Column("last_modified", Dataset)))
+    lastModified = dict((dataset_id, str(row[7]) if row[7] is not None else None) for dataset_id, row in datasets.items())
+    dbstore.rollback() # the DAS queries may take long: do not keep a transaction open
+    state = openState(opts)
+    state.removeDatasetChecks(datasets.keys())
+    checks = state.datasetChecks()
+    oldest = time.time()-opts.dasMaxAge*24*3600
+    toCheck = [ dataset_id for dataset_id in datasets if dataset_id not in checks or checks[dataset_id][0] < oldest or checks[dataset_id][1] != "ok"
+                or checks[dataset_id][3] != lastModified[dataset_id] ]
     print "\nDatasets inconsistent with DAS:"
     print '=================================='
+    print "(checking %d of %d datasets)"%(len(toCheck),len(datasets))
+    limiter = RateLimiter(opts.dasRate)
+    # the DAS queries of all datasets share one pool, separate from the one of the checks that wait for them
+    dasPool = ThreadPool(4*opts.dasJobs)
+    def check(dataset_id):
+      limiter.wait()
+      return dataset_id, compareWithDAS(datasets[dataset_id][1:6], dasPool)
+    pool = ThreadPool(opts.dasJobs)
+    try:
+      for i, (dataset_id, (status, message)) in enumerate(pool.imap_unordered(check, toCheck)):
+        state.setDatasetCheck(dataset_id, datasets[dataset_id][1], status, message, lastModified=lastModified[dataset_id])
+        checks[dataset_id] = (time.time(), status, message, lastModified[dataset_id])
+        if not opts.dryRun and i%100 == 99:
+          state.commit()
+    finally:
+      pool.close()
+      pool.join()
+      dasPool.close()
+      dasPool.join()
+      if not opts.dryRun:
+        state.commit()
+      state.close()
     result = []
-    for dataset in datasets:
-      # query DAS to get the same dataset, by name
-      metadata = {}
-      try:
-        metadata = query_das(dataset.name)
-      except:
+    for dataset_id in sorted(datasets):
+      status, message = checks[dataset_id][1:3]
+      if status != "ok":
+        dataset = dbstore.get(Dataset, dataset_id)
         result.append([dataset,"Inconsistent with DAS"])
-        print "%s (imported on %s) -- Error getting dataset in DAS"%(str(dataset.name),str(dataset.creation_time))
-        continue
-        
-      # perform some checks: 
-      try:
-        # release name either matches or is unknown in DAS
-        test1 = str(metadata[u'release'])=="unknown" or dataset.cmssw_release == str(metadata[u'release'])
-        # datatype matches
-        test2 = dataset.datatype == metadata[u'datatype']
-        # nevents matches
-        test3 = dataset.nevents == metadata[u'nevents']
-        # size matches
-        test4 = dataset.dsize == metadata[u'file_size']
-      except:
-         result.append([dataset,"Inconsistent with DAS"])
-         print "%s (imported on %s)"%(str(dataset.name),str(dataset.creation_time))
-      else:
-         if not(test1 and test2 and test3 and test4):
-             result.append([dataset,"Inconsistent with DAS"])
-             print "%s (imported on %s)"%(str(dataset.name),str(dataset.creation_time))
+        print "%s (imported on %s)%s"%(str(dataset.name),str(dataset.creation_time)," -- %s"%message if message else "")
     return result
 
 def findOrphanDatasets(dbstore,opts):
-    datasets = dbstore.find(Dataset)
     print "\nOrphan Datasets:"
     print '==================='
     result = []
-    for dataset in datasets:
-        if dataset.samples.count()==0:
-            result.append(dataset)
-            print "%s (imported on %s)"%(str(dataset.name),str(dataset.creation_time))
+    for dataset, message in checkIntegrity(dbstore, "datasets"):
+        result.append(dataset)
+        print "%s (imported on %s)"%(str(dataset.name),str(dataset.creation_time))
     if len(result)==0:
        print "None"
     return result
@@ -194,8 +278,7 @@ def checkDatasetsIntegrity(dbstore,opts):
 
 def analyzeDatasetsStatistics(dbstore,opts):
     # ROOT output
-    if not opts.dryRun:
-      rootfile = ROOT.TFile(opts.path+"/analysisReport.root","update")
+    writer = ROOTWriter(None if opts.dryRun else opts.path+"/analysisReport.root")
     stats = {}
     # Releases used
     output =  dbstore.execute("select dataset.cmssw_release,COUNT(dataset.dataset_id) as numOfDataset FROM dataset GROUP BY cmssw_release")
@@ -203,172 +286,178 @@ def analyzeDatasetsStatistics(dbstore,opts):
     if None in stats["cmssw_release"]: 
         stats["cmssw_release"]["Unknown"] = stats["cmssw_release"][None] + stats["cmssw_release"].get("Unknown",0)
         del stats["cmssw_release"][None]
-    releasePie = ROOT.TPie("datasetReleasePie","Datasets release",len(stats["cmssw_release"]))
-    for index,entry in enumerate(stats["cmssw_release"]):
-      releasePie.SetEntryVal(index,entry[1])
-      releasePie.SetEntryLabel(index,"None" if entry[0] is None else entry[0])
-    releasePie.SetTextAngle(0);
-    releasePie.SetRadius(0.3);
-    releasePie.SetTextColor(1);
-    releasePie.SetTextFont(62);
-    releasePie.SetTextSize(0.03);
-    canvas = ROOT.TCanvas("datasetRelease","",2)
-    releasePie.Draw("r")
-    if not opts.dryRun:
-      ROOT.gPad.Write()
+    writer.pie("datasetReleasePie","Datasets release","datasetRelease",stats["cmssw_release"])
     # GlobalTag used
     output =  dbstore.execute("select dataset.globaltag,COUNT(dataset.dataset_id) as numOfDataset FROM dataset GROUP BY globaltag")
     stats["globaltag"] = output.get_all()
     if None in stats["globaltag"]: 
         stats["globaltag"]["Unknown"] = stats["globaltag"][None] + stats["globaltag"].get("Unknown",0)
         del stats["globaltag"][None]
-    globaltagPie = ROOT.TPie("datasetGTPie","Datasets globaltag",len(stats["globaltag"]))
-    for index,entry in enumerate(stats["globaltag"]):
-      globaltagPie.SetEntryVal(index,entry[1])
-      globaltagPie.SetEntryLabel(index,"None" if entry[0] is None else entry[0])
-    globaltagPie.SetTextAngle(0);
-    globaltagPie.SetRadius(0.3);
-    globaltagPie.SetTextColor(1);
-    globaltagPie.SetTextFont(62);
-    globaltagPie.SetTextSize(0.03);
-    canvas = ROOT.TCanvas("datasetGT","",2)
-    globaltagPie.Draw("r")
-    if not opts.dryRun:
-      ROOT.gPad.Write()
+    writer.pie("datasetGTPie","Datasets globaltag","datasetGT",stats["globaltag"])
     # Datatype
     output =  dbstore.execute("select dataset.datatype,COUNT(dataset.dataset_id) as numOfDataset FROM dataset GROUP BY datatype")
     stats["datatype"] = output.get_all()
     if None in stats["datatype"]: 
         stats["datatype"]["Unknown"] = stats["datatype"][None] + stats["datatype"].get("Unknown",0)
         del stats["datatype"][None]
-    datatypePie = ROOT.TPie("datasetTypePie","Datasets datatype",len(stats["datatype"]))
-    for index,entry in enumerate(stats["datatype"]):
-      datatypePie.SetEntryVal(index,entry[1])
-      datatypePie.SetEntryLabel(index,"None" if entry[0] is None else entry[0])
-    datatypePie.SetTextAngle(0);
-    datatypePie.SetRadius(0.3);
-    datatypePie.SetTextColor(1);
-    datatypePie.SetTextFont(62);
-    datatypePie.SetTextSize(0.03);
-    canvas = ROOT.TCanvas("datasetType","",2)
-    datatypePie.Draw("r")
-    if not opts.dryRun:
-      ROOT.gPad.Write()
+    writer.pie("datasetTypePie","Datasets datatype","datasetType",stats["datatype"])
     # Energy
     output =  dbstore.execute("select dataset.energy,COUNT(dataset.dataset_id) as numOfDataset FROM dataset GROUP BY energy")
     stats["energy"] = output.get_all()
-    energyPie = ROOT.TPie("datasetEnergyPie","Datasets energy",len(stats["energy"]))
-    for index,entry in enumerate(stats["energy"]):
-      energyPie.SetEntryVal(index,entry[1])
-      energyPie.SetEntryLabel(index,"None" if entry[0] is None else str(entry[0]))
-    energyPie.SetTextAngle(0);
-    energyPie.SetRadius(0.3);
-    energyPie.SetTextColor(1);
-    energyPie.SetTextFont(62);
-    energyPie.SetTextSize(0.03);
-    canvas = ROOT.TCanvas("datasetEnergy","",2)
-    energyPie.Draw("r")
-    if not opts.dryRun:
-      ROOT.gPad.Write()
-    # get all datasets to loop
-    datasets = dbstore.find(Dataset)
-    datasets.order_by(Dataset.creation_time)
-    # time evolution of # datasets (still in db)
-    datasets_time = [[0,0]]
+    writer.pie("datasetEnergyPie","Datasets energy","datasetEnergy",stats["energy"])
+    # get the needed columns of all datasets, and the source dataset of all samples
+    columns = zip(*dbstore.find(Dataset, Dataset.creation_time != None).order_by(Dataset.creation_time).values(
+                  Dataset.dataset_id, Dataset.creation_time, Dataset.nevents, Dataset.dsize)) or [(),(),(),()]
+    dataset_ids, creation_times, nevents, dsizes = columns
+    sources = list(dbstore.find(Sample, Sample.source_dataset_id != None).values(Sample.source_dataset_id))
+    # time evolution of # datasets (still in db). For Highcharts the time format is #milliseconds since epoch
+    stats["datasetsTimeprof"] = timeProfile(creation_times)
+    writer.graph("datasetsTimeprof_graph",stats["datasetsTimeprof"])
     # various stats (histograms)
-    datasets_nsamples = ROOT.TH1I("dataseets_nsamples","datasets_nsamples",10,0,10)
-    datasets_nevents  = ROOT.TH1I("dataseets_nevents", "datasets_nevents" ,100,0,-100)
-    datasets_dsize    = ROOT.TH1I("dataseets_dsize",   "datasets_dsize"   ,100,0,-100)
-    # let's go... loop
-    for dataset in datasets:
-        # for Highcharts the time format is #seconds since epoch
-        time = int(dataset.creation_time.strftime("%s"))*1000
-        datasets_time.append([time,datasets_time[-1][1]+1])
-        datasets_nsamples.Fill(dataset.samples.count())
-        datasets_nevents.Fill(dataset.nevents)
-        datasets_dsize.Fill(dataset.dsize)
-    # drop this: just to initialize the loop
-    datasets_time.pop(0)
-    # output
-    stats["datasetsTimeprof"] = datasets_time
-    datasetsTimeprof_graph = ROOT.TGraph(len(datasets_time))
-    for i,s in enumerate(datasets_time):
-        datasetsTimeprof_graph.SetPoint(i,s[0]/1000,s[1])
-    if not opts.dryRun:
-        datasetsTimeprof_graph.Write("datasetsTimeprof_graph")
-    data = []
-    for bin in range(1,datasets_nsamples.GetNbinsX()+1):
-        data.append([datasets_nsamples.GetBinCenter(bin),datasets_nsamples.GetBinContent(bin)])
-    stats["datasetsNsamples"] = data
-    data = []
-    for bin in range(1,datasets_nevents.GetNbinsX()+1):
-        data.append([datasets_nevents.GetBinCenter(bin),datasets_nevents.GetBinContent(bin)])
-    stats["datasetsNevents"] = data
-    data = []
-    for bin in range(1,datasets_dsize.GetNbinsX()+1):
-        data.append([datasets_dsize.GetBinCenter(bin),datasets_dsize.GetBinContent(bin)])
-    stats["datasetsDsize"] = data
+    stats["datasetsNsamples"] = histogram(countPerKey(dataset_ids,sources),10,0,10)
+    stats["datasetsNevents"] = histogram([ 0 if n is None else n for n in nevents ],100)
+    stats["datasetsDsize"] = histogram([ 0 if s is None else s for s in dsizes ],100)
+    writer.histogram("dataseets_nsamples",stats["datasetsNsamples"])
+    writer.histogram("dataseets_nevents",stats["datasetsNevents"])
+    writer.histogram("dataseets_dsize",stats["datasetsDsize"])
     # some printout
     print "\nDatasets Statistics extracted."
     print '================================='
     # ROOT output
-    if not opts.dryRun:
-      rootfile.Write();
-      rootfile.Close();
+    writer.close()
     # JSON output
     return stats
 
 
 def checkResultPath(dbstore,opts):
-    # get all samples
-    result = dbstore.find(Result)
+    # get all results
+    result = list(dbstore.find(Result))
     print "\nResults with missing path:"
     print '==========================='
+    # check that the paths exist, all at once
+    statuses = checkPathsIncrementally("result",[ (res.result_id,res.path) for res in result ],opts)
     array = []
+    unknown = []
+    missingSince = {}
     for res in result:
-      # check that the path exists, and keep track of the sample if not the case.
-      if not os.path.exists(res.path):
+      # keep track of the result if the path is missing
+      status, since = statuses[(res.result_id,res.path)]
+      if status==MISSING:
         print "Result #%s (created on %s by %s):"%(str(res.result_id),str(res.creation_time),str(res.author)),
-        print " missing path: %s" %res.path
+        print " missing path: %s (since %s)" %(res.path,formatTime(since))
         array.append(res)
+        missingSince[str(res.result_id)] = formatTime(since)
+      elif status==UNKNOWN:
+        unknown.append(res)
     if len(array)==0: print "None"
-    return array
+    printUnknownPaths("Results",[ (res.result_id,res.path) for res in unknown ])
+    return array, unknown, missingSince
 
     
 def checkSamplePath(dbstore,opts):
-    # get all samples
-    result = dbstore.find(Sample)
+    # get all samples, and the directories of the files of the samples without path
+    samples = list(dbstore.find(Sample))
+    directories = getSamplesDirectories(dbstore,[ sample for sample in samples if sample.path=="" ],opts)
+    result = [ (sample,[sample.path] if sample.path!="" else directories.get(sample.sample_id,[])) for sample in samples ]
     print "\nSamples with missing path:"
     print '==========================='
+    # check that the paths exist, all at once
+    statuses = checkPathsIncrementally("sample",[ (sample.sample_id,path) for sample,vpath in result for path in vpath ],opts)
     array = []
-    for sample in result:
-      # check that the path exists, and keep track of the sample if not the case.
-      vpath = getSamplePath(sample,dbstore)
-      for path in vpath:
-        if not os.path.exists(path):
-          print "Sample #%s (created on %s by %s):"%(str(sample.sample_id),str(sample.creation_time),str(sample.author)),
-          print " missing path: %s" %path
-          print vpath
-          array.append(sample)
-          break
+    unknown = []
+    unknownPaths = []
+    missingSince = {}
+    for sample,vpath in result:
+      # keep track of the sample if one of its paths is missing.
+      missing = [ (statuses[(sample.sample_id,path)][1],path) for path in vpath if statuses[(sample.sample_id,path)][0]==MISSING ]
+      if missing:
+        since, path = min(missing)
+        print "Sample #%s (created on %s by %s):"%(str(sample.sample_id),str(sample.creation_time),str(sample.author)),
+        print " missing path: %s (since %s)" %(path,formatTime(since))
+        print vpath
+        array.append(sample)
+        missingSince[str(sample.sample_id)] = formatTime(since)
+      elif any(statuses[(sample.sample_id,path)][0]==UNKNOWN for path in vpath):
+        unknown.append(sample)
+        unknownPaths += [ (sample.sample_id,path) for path in vpath if statuses[(sample.sample_id,path)][0]==UNKNOWN ]
     if len(array)==0: print "None"
-    return array
+    printUnknownPaths("Samples",unknownPaths)
+    return array, unknown, missingSince
+
+def checkPathsIncrementally(kind,objectPaths,opts):
+    # Only the paths that are new, were not found at the previous check, or were last checked
+    # more than pathMaxAge days ago are checked again. The results are kept in the state file,
+    # with the time of the last status change (since) and the history of the changes.
+    # Returns {(object_id,path): (status,since)}, with since None for unknown paths.
+    objectPaths = set(objectPaths)
+    state = openState(opts)
+    try:
+      state.removePathChecks(kind,objectPaths)
+      previous = state.pathChecks(kind)
+      oldest = time.time()-opts.pathMaxAge*24*3600
+      toCheck = set(key for key in objectPaths if key not in previous or previous[key][1]!=OK or previous[key][0]<oldest)
+      print "(checking %d of %d %s paths)"%(len(toCheck),len(objectPaths),kind)
+      statuses = checkPaths([ path for object_id,path in toCheck ], opts.pathJobs, opts.pathTimeout)
+      state.setPathChecks(kind,[ (object_id,path,statuses[path]) for object_id,path in toCheck ])
+      if not opts.dryRun:
+        state.commit()
+      checks = state.pathChecks(kind)
+    finally:
+      state.close()
+    result = {}
+    for key in objectPaths:
+      if key in toCheck and statuses[key[1]]==UNKNOWN:
+        result[key] = (UNKNOWN,None)
+      else:
+        result[key] = checks[key][1:]
+    return result
+
+def formatTime(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S") if timestamp is not None else "unknown"
+
+def printUnknownPaths(kind,paths):
+    # paths that could not be checked (timeout) are neither reported as missing nor as present
+    if paths:
+      print "\n%s with paths that could not be checked:"%kind
+      print '=========================================='
+      for objId,path in paths:
+        print "#%s: %s"%(str(objId),path)
 
 def getSamplePath(sample,dbstore):
-    vpath=[]
     # the path should be stored in sample.path
     # if it is empty, look for files in that path
     if sample.path=="":
-      regex = r".*SFN=(.*)"
-      files = dbstore.find(SFile, SFile.sample_id==sample.sample_id)
-      for file in files:
-        m = re.search(regex,str(file.pfn))
-        if m: vpath.append(os.path.dirname(m.group(1)))
-      vpath=list(set(vpath))
-      return vpath
+      return Sample.getFilesDirectories(dbstore,[sample.sample_id]).get(sample.sample_id,[])
     else:
       return [sample.path]
 
+def getSamplesDirectories(dbstore,samples,opts):
+    # Directories of the files of many samples (see getSamplePath), resolved in bulk.
+    # They are kept in the state file, and only resolved again for the samples whose
+    # files changed (from the files aggregates and the largest file id, which changes
+    # when the files are replaced), or after pathMaxAge days.
+    # Returns {sample_id: [directories]}
+    state = openState(opts)
+    try:
+      cached = state.sampleDirectories()
+      state.removeSampleDirectories([ sample.sample_id for sample in samples ])
+      oldest = time.time()-opts.pathMaxAge*24*3600
+      lastIds = Sample.getFilesLastIds(dbstore,[ sample.sample_id for sample in samples ])
+      aggregates = dict((sample.sample_id,(sample.nfiles,sample.files_nevents,lastIds.get(sample.sample_id))) for sample in samples)
+      stale = [ sample_id for sample_id in aggregates if sample_id not in cached or cached[sample_id][0]!=aggregates[sample_id] or cached[sample_id][1]<oldest ]
+      print "(resolving the directories of %d of %d samples without path)"%(len(stale),len(samples))
+      resolved = Sample.getFilesDirectories(dbstore,stale)
+      for sample_id in stale:
+        state.setSampleDirectories(sample_id,aggregates[sample_id],resolved.get(sample_id,[]))
+      if not opts.dryRun:
+        state.commit()
+    finally:
+      state.close()
+    directories = dict((sample_id,entry[2]) for sample_id,entry in cached.items() if sample_id in aggregates)
+    for sample_id in stale:
+      directories[sample_id] = resolved.get(sample_id,[])
+    return directories
+
 def selectResults(dbstore,opts):
     # look for result records pointing to a ROOT file
     # eventually further filter 
@@ -395,91 +484,51 @@ def selectResults(dbstore,opts):
     return array
 
 def checkResultConsistency(dbstore,opts):
-    # get all samples
-    result = dbstore.find(Result)
     print "\nResults with missing source:"
     print '============================='
     array = []
-    for res in result:
-      # check that the source sample exists in the database.
-      # normaly, this should be protected already at the level of sql rules
-      for sample in res.samples:
-        if sample is None:
-          print "Result #%s (created on %s by %s):"%(str(res.result_id),str(res.creation_time),str(res.author)),
-          print "inconsistent source sample"
-          array.append([res,"inconsistent source sample"])
-          print res
-          break
+    # check that the results have source samples, and that they exist in the database.
+    # normaly, the latter should be protected already at the level of sql rules
+    for res, message in checkIntegrity(dbstore, "results"):
+      print "Result #%s (created on %s by %s):"%(str(res.result_id),str(res.creation_time),str(res.author)),
+      print message
+      array.append([res,message])
     if len(array)==0: print "None"
     return array
 
 
 def checkSampleConsistency(dbstore,opts):
-    # get all samples
-    result = dbstore.find(Sample)
     print "\nSamples with missing source:"
     print '============================='
     array = []
-    for sample in result:
-      # check that either the source dataset or the source sample exists in the database.
-      # normaly, this should be protected already at the level of sql rules
-      sourceDataset = sample.source_dataset
-      sourceSample = sample.source_sample
-      if (sample.source_dataset_id is not None) and (sourceDataset is None):
-        print "Sample #%s (created on %s by %s):"%(str(sample.sample_id),str(sample.creation_time),str(sample.author)),
-        print "inconsistent source dataset"
-        array.append([sample,"inconsistent source dataset"])
-        print sample
-      if (sample.source_sample_id is not None) and (sourceSample is None):
-        print "Sample #%s (created on %s by %s):"%(str(sample.sample_id),str(sample.creation_time),str(sample.author)),
-        print "inconsistent source sample"
-        array.append([sample,"inconsistent source sample"])
+    # check that either the source dataset or the source sample exists in the database,
+    # (normaly, this should be protected already at the level of sql rules)
+    # and that the number of events matches the files
+    for sample, message in checkIntegrity(dbstore, "samples"):
+      print "Sample #%s (created on %s by %s):"%(str(sample.sample_id),str(sample.creation_time),str(sample.author)),
+      print message
+      array.append([sample,message])
     if len(array)==0: print "None"
     return array
 
 def analyzeAnalysisStatistics(dbstore,opts):
     stats = {}
     # ROOT output
-    if not opts.dryRun:
-      rootfile = ROOT.TFile(opts.path+"/analysisReport.root","update")
+    writer = ROOTWriter(None if opts.dryRun else opts.path+"/analysisReport.root")
     # contact
     output =  dbstore.execute("select analysis.contact,COUNT(analysis.analysis_id) as numOfAnalysis FROM analysis GROUP BY contact")
     stats["analysisContacts"] = output.get_all()
     if None in stats["analysisContacts"]: 
         stats["analysisContacts"]["Unknown"] = stats["analysisContacts"][None] + stats["analysisContacts"].get("Unknown",0)
         del stats["analysisContacts"][None]
-    contactPie = ROOT.TPie("AnalysisContactPie","Analysis contacts",len(stats["analysisContacts"]))
-    for index,entry in enumerate(stats["analysisContacts"]):
-      contactPie.SetEntryVal(index,entry[1])
-      contactPie.SetEntryLabel(index,"None" if entry[0] is None else entry[0])
-    contactPie.SetTextAngle(0);
-    contactPie.SetRadius(0.3);
-    contactPie.SetTextColor(1);
-    contactPie.SetTextFont(62);
-    contactPie.SetTextSize(0.03);
-    canvas = ROOT.TCanvas("analysisContact","",2)
-    contactPie.Draw("r")
-    if not opts.dryRun:
-      ROOT.gPad.Write()
+    writer.pie("AnalysisContactPie","Analysis contacts","analysisContact",stats["analysisContacts"])
     # analysis size in terms of results (pie)
     output =  dbstore.execute("select analysis.description,COUNT(result.result_id) as numOfResults  FROM result INNER JOIN analysis ON result.analysis_id=analysis.analysis_id GROUP BY result.analysis_id;")
     stats["analysisResults"] = output.get_all()
     if None in stats["analysisResults"]: 
         stats["analysisResults"]["Unknown"] = stats["analysisResults"][None] + stats["analysisResults"].get("Unknown",0)
         del stats["analysisResults"][None]
-    resultPie = ROOT.TPie("AnalysisResultsPie","Analysis results",len(stats["analysisResults"]))
-    for index,entry in enumerate(stats["analysisResults"]):
-      resultPie.SetEntryVal(index,entry[1])
-      resultPie.SetEntryLabel(index,"None" if entry[0] is None else entry[0])
-    resultPie.SetTextAngle(0);
-    resultPie.SetRadius(0.3);
-    resultPie.SetTextColor(1);
-    resultPie.SetTextFont(62);
-    resultPie.SetTextSize(0.03);
-    canvas = ROOT.TCanvas("analysisResults","",2)
-    resultPie.Draw("r")
-    if not opts.dryRun:
-      ROOT.gPad.Write()
+    writer.pie("AnalysisResultsPie","Analysis results","analysisResults",stats["analysisResults"])
     # stats to collect: group distribution (from CADI line) (pie)
     analyses = dbstore.find(Analysis)
     regex = r".*([A-Z]{3})-\d{2}-\d{3}"
@@ -496,26 +545,12 @@ def analyzeAnalysisStatistics(dbstore,opts):
         del stats["physicsGroup"][None]
 
     # the end of the loop, we have all what we need to fill a pie chart.
-    physicsGroupPie = ROOT.TPie("physicsGroupPie","Physics groups",len(stats["physicsGroup"]))
-    for index,(group,count) in enumerate(stats["physicsGroup"].iteritems()):
-      physicsGroupPie.SetEntryVal(index,count)
-      physicsGroupPie.SetEntryLabel(index,group)
-    physicsGroupPie.SetTextAngle(0);
-    physicsGroupPie.SetRadius(0.3);
-    physicsGroupPie.SetTextColor(1);
-    physicsGroupPie.SetTextFont(62);
-    physicsGroupPie.SetTextSize(0.03);
-    canvas = ROOT.TCanvas("physicsGroup","",2)
-    physicsGroupPie.Draw("r")
-    if not opts.dryRun:
-      ROOT.gPad.Write()
+    writer.pie("physicsGroupPie","Physics groups","physicsGroup",stats["physicsGroup"].items())
     # some printout
     print "\nAnalysis Statistics extracted."
     print '================================'
     # ROOT output
-    if not opts.dryRun:
-      rootfile.Write();
-      rootfile.Close();
+    writer.close()
     # JSON output
     stats["physicsGroup"] = [ [a,b] for (a,b) in stats["physicsGroup"].items()]
     return stats
@@ -523,164 +558,71 @@ def analyzeAnalysisStatistics(dbstore,opts):
 def analyzeResultsStatistics(dbstore,opts):
     stats = {}
     # ROOT output
-    if not opts.dryRun:
-      rootfile = ROOT.TFile(opts.path+"/analysisReport.root","update")
+    writer = ROOTWriter(None if opts.dryRun else opts.path+"/analysisReport.root")
     #authors statistics
     output =  dbstore.execute("select result.author,COUNT(result.result_id) as numOfResults FROM result GROUP BY author")
     stats["resultsAuthors"] = output.get_all()
     if None in stats["resultsAuthors"]: 
         stats["resultsAuthors"]["Unknown"] = stats["resultsAuthors"][None] + stats["resultsAuthors"].get("Unknown",0)
         del stats["resultsAuthors"][None]
-    authorPie = ROOT.TPie("resultsAuthorsPie","Results authors",len(stats["resultsAuthors"]))
-    for index,entry in enumerate(stats["resultsAuthors"]):
-      authorPie.SetEntryVal(index,entry[1])
-      authorPie.SetEntryLabel(index,"None" if entry[0] is None else entry[0])
-    authorPie.SetTextAngle(0);
-    authorPie.SetRadius(0.3);
-    authorPie.SetTextColor(1);
-    authorPie.SetTextFont(62);
-    authorPie.SetTextSize(0.03);
-    canvas = ROOT.TCanvas("resultsAuthor","",2)
-    authorPie.Draw("r")
-    if not opts.dryRun:
-      ROOT.gPad.Write()
-    result_nsamples = ROOT.TH1I("result_nsamples","result_nsamples",20,0,20)
-    # get all samples to loop
-    results = dbstore.find(Result)
-    results.order_by(Result.creation_time)
-    # time evolution of # results (still in db)
-    results_time = [[0,0]]
-    # let's go... loop
-    for result in results:
-        # for Highcharts the time format is #seconds since epoch
-        time = int(result.creation_time.strftime("%s"))*1000
-        results_time.append([time,results_time[-1][1]+1])
-        result_nsamples.Fill(result.samples.count())
-    # drop this: just to initialize the loop
-    results_time.pop(0)
-    # output
-    stats["resultsTimeprof"] = results_time
-    resultsTimeprof_graph = ROOT.TGraph(len(results_time))
-    for i,s in enumerate(results_time):
-        resultsTimeprof_graph.SetPoint(i,s[0]/1000,s[1])
-    if not opts.dryRun:
-        resultsTimeprof_graph.Write("resultsTimeprof_graph")
-    data = []
-    for bin in range(1,result_nsamples.GetNbinsX()+1):
-        data.append([result_nsamples.GetBinCenter(bin),result_nsamples.GetBinContent(bin)])
-    stats["resultNsamples"] = data
+    writer.pie("resultsAuthorsPie","Results authors","resultsAuthor",stats["resultsAuthors"])
+    # get the needed columns of all results, and the results of all samples
+    result_ids, creation_times = zip(*dbstore.find(Result, Result.creation_time != None).order_by(Result.creation_time).values(
+                                     Result.result_id, Result.creation_time)) or [(),()]
+    sampleResults = list(dbstore.find(SampleResult).values(SampleResult.result_id))
+    # time evolution of # results (still in db). For Highcharts the time format is #milliseconds since epoch
+    stats["resultsTimeprof"] = timeProfile(creation_times)
+    writer.graph("resultsTimeprof_graph",stats["resultsTimeprof"])
+    stats["resultNsamples"] = histogram(countPerKey(result_ids,sampleResults),20,0,20)
+    writer.histogram("result_nsamples",stats["resultNsamples"])
     # some printout
     print "\nResults Statistics extracted."
     print '================================'
     # ROOT output
-    if not opts.dryRun:
-      rootfile.Write();
-      rootfile.Close();
+    writer.close()
     # JSON output
     return stats
 
 def analyzeSampleStatistics(dbstore,opts):
     stats = {}
     # ROOT output
-    if not opts.dryRun:
-      rootfile = ROOT.TFile(opts.path+"/analysisReport.root","update")
+    writer = ROOTWriter(None if opts.dryRun else opts.path+"/analysisReport.root")
     #authors statistics
     output =  dbstore.execute("select sample.author,COUNT(sample.sample_id) as numOfSamples FROM sample GROUP BY author")
     stats["sampleAuthors"] = output.get_all()
     if None in stats["sampleAuthors"]: 
         stats["sampleAuthors"]["Unknown"] = stats["sampleAuthors"][None] + stats["sampleAuthors"].get("Unknown",0)
         del stats["sampleAuthors"][None]
-    authorPie = ROOT.TPie("sampleAuthorsPie","Samples authors",len(stats["sampleAuthors"]))
-    for index,entry in enumerate(stats["sampleAuthors"]):
-      authorPie.SetEntryVal(index,entry[1])
-      authorPie.SetEntryLabel(index,"None" if entry[0] is None else entry[0])
-    authorPie.SetTextAngle(0);
-    authorPie.SetRadius(0.3);
-    authorPie.SetTextColor(1);
-    authorPie.SetTextFont(62);
-    authorPie.SetTextSize(0.03);
-    canvas = ROOT.TCanvas("sampleAuthor","",2)
-    authorPie.Draw("r")
-    if not opts.dryRun:
-      ROOT.gPad.Write()
+    writer.pie("sampleAuthorsPie","Samples authors","sampleAuthor",stats["sampleAuthors"])
     #sample types statistics
     output =  dbstore.execute("select sample.sampletype,COUNT(sample.sample_id) as numOfSamples FROM sample GROUP BY sampletype")
     stats["sampleTypes"] = output.get_all()
     if None in stats["sampleTypes"]: 
         stats["sampleTypes"]["Unknown"] = stats["sampleTypes"][None] + stats["sampleTypes"].get("Unknown",0)
         del stats["sampleTypes"][None]
-    typePie = ROOT.TPie("sampleTypesPie","Samples types",len(stats["sampleTypes"]))
-    for index,entry in enumerate(stats["sampleTypes"]):
-      typePie.SetEntryVal(index,entry[1])
-      typePie.SetEntryLabel(index,"None" if entry[0] is None else entry[0])
-    typePie.SetTextAngle(0);
-    typePie.SetRadius(0.3);
-    typePie.SetTextColor(1);
-    typePie.SetTextFont(62);
-    typePie.SetTextSize(0.03);
-    canvas = ROOT.TCanvas("sampleType","",2)
-    typePie.Draw("r")
-    if not opts.dryRun:
-      ROOT.gPad.Write()
-    # get all samples to loop
-    result = dbstore.find(Sample)
-    result.order_by(Sample.creation_time)
-    # events statistics
-    sample_nevents_processed = ROOT.TH1I("sample_nevents_processed","sample_nevents_processed",100,0,-100)
-    sample_nevents = ROOT.TH1I("sample_nevents","sample_nevents",100,0,-100)
-    # time evolution of statistics & # samples (still in db)
-    sample_nevents_processed_time = [[0,0]]
-    sample_nevents_time = [[0,0]] 
-    samples_time = [[0,0]]
-    # let's go... loop
-    for sample in result:
-        # for Highcharts the time format is #seconds since epoch
-        time = int(sample.creation_time.strftime("%s"))*1000
-        ne = 0 if sample.nevents is None else sample.nevents
-        np = 0 if sample.nevents_processed is None else sample.nevents_processed
-        sample_nevents_processed.Fill(np)
-        sample_nevents.Fill(ne)
-        sample_nevents_processed_time.append([time,sample_nevents_processed_time[-1][1]+np])
-        sample_nevents_time.append([time,sample_nevents_time[-1][1]+ne])
-        samples_time.append([time,samples_time[-1][1]+1])
-    # drop this: just to initialize the loop
-    sample_nevents_processed_time.pop(0)
-    sample_nevents_time.pop(0)
-    samples_time.pop(0)
-    # output
-    stats["sampleNeventsTimeprof"] = sample_nevents_time
-    stats["sampleNeventsProcessedTimeprof"] = sample_nevents_processed_time
-    stats["samplesTimeprof"] = samples_time
-    sampleNeventsTimeprof_graph = ROOT.TGraph(len(sample_nevents_time))
-    sampleNeventsProcessedTimeprof_graph = ROOT.TGraph(len(sample_nevents_processed_time))
-    samplesTimeprof_graph = ROOT.TGraph(len(samples_time))
-    for i,s in enumerate(sample_nevents_time):
-        sampleNeventsTimeprof_graph.SetPoint(i,s[0]/1000,s[1])
-    for i,s in enumerate(sample_nevents_processed_time):
-        sampleNeventsProcessedTimeprof_graph.SetPoint(i,s[0]/1000,s[1])
-    for i,s in enumerate(samples_time):
-        samplesTimeprof_graph.SetPoint(i,s[0]/1000,s[1])
-    if not opts.dryRun:
-        sampleNeventsTimeprof_graph.Write("sampleNeventsTimeprof_graph")
-        sampleNeventsProcessedTimeprof_graph.Write("sampleNeventsProcessedTimeprof_graph")
-        samplesTimeprof_graph.Write("samplesTimeprof_graph")
-    # unfortunately, TBufferJSON is not available in CMSSW (no libRHttp) -> no easy way to export to JSON
-    # the JSON format for highcharts data is [ [x1,y1], [x2,y2], ... ]
-    data = []
-    for bin in range(1,sample_nevents.GetNbinsX()+1):
-      data.append([sample_nevents.GetBinCenter(bin),sample_nevents.GetBinContent(bin)])
-    stats["sampleNevents"] = data
-    data = []
-    for bin in range(1,sample_nevents_processed.GetNbinsX()+1):
-      data.append([sample_nevents_processed.GetBinCenter(bin),sample_nevents_processed.GetBinContent(bin)])
-    stats["sampleNeventsProcessed"] = data
+    writer.pie("sampleTypesPie","Samples types","sampleType",stats["sampleTypes"])
+    # get the needed columns of all samples
+    creation_times, nevents, nevents_processed = zip(*dbstore.find(Sample, Sample.creation_time != None).order_by(Sample.creation_time).values(
+                                                     Sample.creation_time, Sample.nevents, Sample.nevents_processed)) or [(),(),()]
+    nevents = [ 0 if n is None else n for n in nevents ]
+    nevents_processed = [ 0 if n is None else n for n in nevents_processed ]
+    # time evolution of statistics & # samples (still in db). For Highcharts the time format is #milliseconds since epoch
+    stats["sampleNeventsTimeprof"] = timeProfile(creation_times,nevents)
+    stats["sampleNeventsProcessedTimeprof"] = timeProfile(creation_times,nevents_processed)
+    stats["samplesTimeprof"] = timeProfile(creation_times)
+    writer.graph("sampleNeventsTimeprof_graph",stats["sampleNeventsTimeprof"])
+    writer.graph("sampleNeventsProcessedTimeprof_graph",stats["sampleNeventsProcessedTimeprof"])
+    writer.graph("samplesTimeprof_graph",stats["samplesTimeprof"])
+    # events statistics. The JSON format for highcharts data is [ [x1,y1], [x2,y2], ... ]
+    stats["sampleNevents"] = histogram(nevents,100)
+    stats["sampleNeventsProcessed"] = histogram(nevents_processed,100)
+    writer.histogram("sample_nevents",stats["sampleNevents"])
+    writer.histogram("sample_nevents_processed",stats["sampleNeventsProcessed"])
     # some printout
     print "\nSamples Statistics extracted."
     print '================================'
     # ROOT output
-    if not opts.dryRun:
-      rootfile.Write();
-      rootfile.Close();
+    writer.close()
     # JSON output
     return stats
 
@@ -3,33 +3,15 @@
 # Script to add a sample to the database
 
 import os
-import glob
+import copy
+import json
+from collections import deque
 from pwd import getpwuid
 from optparse import OptionParser
 from datetime import datetime
-from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample, File, DbStore
+from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample, DbStore, LuminosityResolver, FilesSummary
 from cp3_llbb.SAMADhi.userPrompt import confirm, prompt_dataset, prompt_sample
-
-def get_file_data_(f_):
-    import ROOT
-
-    f = ROOT.TFile.Open(f_)
-    if not f:
-        return (None, None)
-
-    weight_sum = f.Get("event_weight_sum")
-    if weight_sum:
-        weight_sum = weight_sum.GetVal()
-    else:
-        weight_sum = None
-
-    entries = None
-    tree = f.Get("t")
-    if tree:
-        entries = tree.GetEntriesFast()
-
-    return (weight_sum, entries)
-
+from cp3_llbb.SAMADhi.file_metadata import scanFiles, ScanProgress, MetadataCache, metadataReaders, discoverFiles, readFileList, prefetch
 
 class MyOptionParser: 
     """
@@ -38,7 +20,8 @@ class MyOptionParser:
     def __init__(self):
         usage  = "Usage: %prog type path [options]\n"
         usage += "where type is one of PAT, SKIM, RDS, NTUPLES, HISTOS, ...\n"
-        usage += "      and path is the location of the sample on disk"  
+        usage += "      and path is the location of the sample on disk\n"
+        usage += "   or: %prog --manifest manifest.json [options]"
         self.parser = OptionParser(usage=usage)
         self.parser.add_option("--name", action="store", type="string", 
                                default=None, dest="name",
@@ -76,48 +59,96 @@ class MyOptionParser:
         self.parser.add_option("--files", action="store", type="string",
                                default="", dest="files",
              help="list of files (full path, comma-separated values)")
+        self.parser.add_option("--file-list", action="store", type="string",
+                               default=None, dest="file_list",
+             help="file with the list of files (full path, one per line, - for the standard input)")
+        self.parser.add_option("-r", "--recursive", action="store_true",
+                               default=False, dest="recursive",
+             help="also look for files in the subdirectories of the sample path")
+        self.parser.add_option("--include", action="append",
+                               default=None, dest="include",
+             help="pattern of the files to add, relative to the sample path (can be repeated, default is *.root)")
+        self.parser.add_option("--exclude", action="append",
+                               default=[], dest="exclude",
+             help="pattern of the files or directories to skip, relative to the sample path (can be repeated, e.g. '*/failed')")
+        self.parser.add_option("--batch-size", action="store", type="int",
+                               default=1000, dest="batch_size",
+             help="number of files inserted in the database per INSERT statement")
+        self.parser.add_option("-j", "--jobs", action="store", type="int",
+                               default=1, dest="jobs",
+             help="number of processes used to read the files")
+        self.parser.add_option("--timeout", action="store", type="int",
+                               default=300, dest="timeout",
+             help="maximal time (in seconds) to read one file; files that take longer are reported as failed (0 for no limit)")
+        self.parser.add_option("--reader", action="store", type="choice",
+                               choices=sorted(metadataReaders.keys()), default="auto", dest="reader",
+             help="how to read the files: light (without ROOT), root (PyROOT) or auto (light, with PyROOT as fallback). Default is auto")
+        self.parser.add_option("--cache", action="store", type="string",
+                               default=os.environ.get("SAMADHI_FILE_CACHE", "~/.samadhi_files.db"), dest="cache",
+             help="file metadata cache (SQLite file, can be shared), to read only the new or modified files. Default is $SAMADHI_FILE_CACHE or ~/.samadhi_files.db")
+        self.parser.add_option("--no-cache", action="store_const", const=None, dest="cache",
+             help="do not use the file metadata cache")
+        self.parser.add_option("--prune-cache", action="store", type="float",
+                               default=None, dest="prune_cache",
+             help="remove the cache entries older than this number of days")
         self.parser.add_option("-t", "--time", action="store", type="string",
                                default=None, dest="time",
              help="result timestamp. If set to \"path\", timestamp will be taken from the path. Otherwise, it must be formated like YYYY-MM-DD HH:MM:SS. Default is current time.")
+        self.parser.add_option("--manifest", action="store", type="string",
+                               default=None, dest="manifest",
+             help="add (or replace) all the samples listed in a JSON or YAML file, without prompting, in a single transaction. "
+                  "Each entry has a type and a path, and optionally a source_dataset and source_sample (id or name) and any of "
+                  + ", ".join(sorted(manifestKeys)) + ". The options given on the command line are the defaults for all samples.")
+        self.parser.add_option("--dry-run", action="store_true",
+                               default=False, dest="dry_run",
+             help="with --manifest, do everything but commit")
 
     def get_opt(self):
         """
         Returns parse list of options
         """
         opts, args = self.parser.parse_args()
+        if opts.manifest is not None:
+          return opts
         # mandatory arguments
         if len(args) < 2:
           self.parser.error("type and path are mandatory")
         opts.sampletype = args[0]
-        opts.path = os.path.abspath(os.path.expandvars(os.path.expanduser(args[1])))
-        # check path
-        if not os.path.exists(opts.path) or not ( os.path.isdir(opts.path) or os.path.isfile(opts.path)) :
-          self.parser.error("%s is not an existing directory"%opts.path)
-        # set author
-        if opts.author is None:
-          opts.author = getpwuid(os.stat(opts.path).st_uid).pw_name
-        # set timestamp
-        if not opts.time is None:
-          if opts.time=="path":
-            opts.datetime = datetime.fromtimestamp(os.path.getctime(opts.path))
-          else:
-            opts.datetime = datetime.strptime(opts.time,'%Y-%m-%d %H:%M:%S')
-        else:
-          opts.datetime = datetime.now()
-        # set name
-        if opts.name is None:
-          if opts.path[-1]=='/':
-            opts.name = opts.path.split('/')[-2]
-          else:
-            opts.name = opts.path.split('/')[-1]
+        opts.path = args[1]
+        complete_options(opts, self.parser.error)
         return opts
 
-def main():
-    """Main function"""
-    # get the options
-    optmgr = MyOptionParser()
-    opts   = optmgr.get_opt()
-    # build the sample from user input
+# options that can be set per sample in a manifest (the sample type is "type")
+manifestKeys = set(["name", "path", "type", "source_dataset", "source_sample", "nevents_processed", "nevents", "normalization",
+                    "weight_sum", "luminosity", "code_version", "user_comment", "author", "time",
+                    "files", "file_list", "recursive", "include", "exclude"])
+
+def complete_options(opts, error):
+    """Check the path, and set the sample author, timestamp and name if not given"""
+    opts.path = os.path.abspath(os.path.expandvars(os.path.expanduser(opts.path)))
+    # check path
+    if not os.path.exists(opts.path) or not ( os.path.isdir(opts.path) or os.path.isfile(opts.path)) :
+      error("%s is not an existing directory"%opts.path)
+    # set author
+    if opts.author is None:
+      opts.author = getpwuid(os.stat(opts.path).st_uid).pw_name
+    # set timestamp
+    if not opts.time is None:
+      if opts.time=="path":
+        opts.datetime = datetime.fromtimestamp(os.path.getctime(opts.path))
+      else:
+        opts.datetime = datetime.strptime(opts.time,'%Y-%m-%d %H:%M:%S')
+    else:
+      opts.datetime = datetime.now()
+    # set name
+    if opts.name is None:
+      if opts.path[-1]=='/':
+        opts.name = opts.path.split('/')[-2]
+      else:
+        opts.name = opts.path.split('/')[-1]
+
+def build_sample(opts):
+    """Sample from the options (without the sources)"""
     sample  = Sample(unicode(opts.name), unicode(opts.path), unicode(opts.sampletype), opts.nevents_processed)
     sample.nevents = opts.nevents
     sample.normalization = opts.normalization
@@ -129,6 +160,189 @@ def main():
     sample.source_sample_id = opts.source_sample_id
     sample.author = unicode(opts.author)
     sample.creation_time = opts.datetime
+    return sample
+
+def list_files(opts, path):
+    """The input files of a sample, as a list or an iterator.
+       The directories are walked in the background, while the first files are already being scanned."""
+    if opts.file_list is not None:
+        return readFileList(opts.file_list)
+    elif isinstance(opts.files, list):
+        return [ unicode(f) for f in opts.files ]
+    elif opts.files != "":
+        return unicode(opts.files).split(",")
+    else:
+        return prefetch(discoverFiles(path, include=opts.include or ["*.root"], exclude=opts.exclude, recursive=opts.recursive))
+
+def open_cache(opts):
+    cache = MetadataCache(opts.cache) if opts.cache is not None else None
+    if cache is not None and opts.prune_cache is not None:
+      print "Removed %d old entries from the file metadata cache" % cache.prune(opts.prune_cache*24*3600)
+    return cache
+
+def report_failed(progress):
+    """print the list of files that could not be read"""
+    if progress.failed:
+        print "Warning: %d file(s) could not be read, and were not added:" % len(progress.failed)
+        for scan in progress.failed:
+            print "  %s: %s" % (scan.path, scan.error)
+
+def load_manifest(path):
+    """list of sample entries from a JSON or YAML file (a list, or a dictionary with a samples list)"""
+    with open(path) as f:
+        if path.endswith(".yaml") or path.endswith(".yml"):
+            import yaml
+            entries = yaml.safe_load(f)
+        else:
+            entries = json.load(f)
+    if isinstance(entries, dict):
+        entries = entries.get("samples", [])
+    for i, entry in enumerate(entries):
+        if "type" not in entry or "path" not in entry:
+            raise ValueError("Manifest entry #%d: type and path are mandatory" % i)
+        unknown = set(entry) - manifestKeys
+        if unknown:
+            raise ValueError("Manifest entry #%d: unknown key(s) %s" % (i, ", ".join(sorted(unknown))))
+        # a single pattern may be given as a string, null means the default patterns
+        for key in ("include", "exclude"):
+            if key in entry and entry[key] is None:
+                del entry[key]
+            elif isinstance(entry.get(key), basestring):
+                entry[key] = [ entry[key] ]
+            if key in entry and not (isinstance(entry[key], list) and all(isinstance(item, basestring) for item in entry[key])):
+                raise ValueError("Manifest entry #%d: %s must be a string or a list of strings" % (i, key))
+    return entries
+
+def resolve(store, cls, idColumn, refs):
+    """{reference: object} for references that are ids or names, with (at most) two queries"""
+    ids = [ ref for ref in refs if isinstance(ref, (int, long)) ]
+    names = [ unicode(ref) for ref in refs if isinstance(ref, basestring) ]
+    found = {}
+    if ids:
+        found.update((getattr(obj, idColumn.name), obj) for obj in store.find(cls, idColumn.is_in(ids)))
+    if names:
+        found.update((obj.name, obj) for obj in store.find(cls, cls.name.is_in(names)))
+    return found
+
+def add_manifest(opts):
+    """Add or replace all the samples of a manifest, in a single transaction and without prompting"""
+    entries = load_manifest(opts.manifest)
+    def error(message):
+        raise ValueError(message)
+    sampleOpts = []
+    for entry in entries:
+        entryOpts = copy.copy(opts)
+        for key, value in entry.items():
+            setattr(entryOpts, "sampletype" if key == "type" else key, value)
+        complete_options(entryOpts, error)
+        sampleOpts.append(entryOpts)
+    names = [ entryOpts.name for entryOpts in sampleOpts ]
+    duplicates = set(name for name in names if names.count(name) > 1)
+    if duplicates:
+        raise ValueError("Samples listed more than once: %s" % ", ".join(sorted(duplicates)))
+
+    # sources of each sample: from the entry, or else from the command line
+    sources = [ dict((key, entry[key] if key in entry else getattr(opts, key+"_id")) for key in ("source_dataset", "source_sample"))
+                for entry in entries ]
+
+    dbstore = DbStore()
+    try:
+        # all the references are resolved together, before anything is written
+        datasets = resolve(dbstore, Dataset, Dataset.dataset_id, [ refs["source_dataset"] for refs in sources if refs["source_dataset"] is not None ])
+        sourceSamples = resolve(dbstore, Sample, Sample.sample_id, [ refs["source_sample"] for refs in sources if refs["source_sample"] is not None ])
+        existing = dict((sample.name, sample) for sample in dbstore.find(Sample, Sample.name.is_in([ unicode(name) for name in names ])))
+        manifestSamples = {}
+        plan = [] # (new sample, source sample: from the database or new from the manifest)
+        for entry, entryOpts, refs in zip(entries, sampleOpts, sources):
+            new = build_sample(entryOpts)
+            for key, known in (("source_dataset", datasets), ("source_sample", sourceSamples)):
+                ref = refs[key]
+                if ref is not None and ref not in known and ref not in manifestSamples:
+                    raise IndexError("No %s %r (needed by sample %s)" % (key.replace("_", " "), ref, new.name))
+            dataset = datasets[refs["source_dataset"]] if refs["source_dataset"] is not None else None
+            new.source_dataset_id = dataset.dataset_id if dataset is not None else None
+            source = refs["source_sample"]
+            if source is not None and source not in sourceSamples:
+                source = manifestSamples[source] # sample defined earlier in the manifest
+            elif source is not None:
+                source = sourceSamples[source]
+            new.source_sample_id = None # set below, through the reference (the source may not be flushed yet)
+            if new.nevents_processed is None and source is not None:
+                new.nevents_processed = source.nevents_processed
+            if new.nevents_processed is None and dataset is not None:
+                new.nevents_processed = dataset.nevents
+            manifestSamples[entry.get("name", new.name)] = new
+            plan.append((new, source))
+        # do not keep the transaction of the queries above open during the scan
+        dbstore.rollback()
+
+        # the files of all samples are scanned in a single pipeline, before anything is written,
+        # so that no row is locked while scanning (only the rows of the files are kept in memory)
+        owners = deque()
+        def allFiles():
+            for (new, source), entryOpts in zip(plan, sampleOpts):
+                for path in list_files(entryOpts, new.path):
+                    owners.append(new)
+                    yield path
+        fileRows = dict((new, []) for new, source in plan)
+        progress = ScanProgress()
+        for scan in scanFiles(allFiles(), jobs=opts.jobs, timeout=opts.timeout, progress=progress, cache=open_cache(opts), reader=metadataReaders[opts.reader]):
+            owner = owners.popleft()
+            if scan.error is None:
+                fileRows[owner].append((unicode(scan.path), unicode(scan.path), scan.event_weight_sum, scan.extras, scan.entries))
+
+        # short write phase: the samples are added or replaced, with their files
+        stored = {} # new sample -> sample in the database
+        samples = []
+        for new, source in plan:
+            if new.name in existing:
+                sample = existing[new.name]
+                sample.replaceBy(new)
+                sample.removeFiles(dbstore)
+            else:
+                sample = new
+                dbstore.add(sample)
+            if source is not None:
+                sample.source_sample = stored.get(source, source)
+            stored[new] = sample
+            samples.append(sample)
+        dbstore.flush()
+        for new, source in plan:
+            stored[new].addFiles(fileRows[new], opts.batch_size)
+
+        # luminosities, in batch
+        dbstore.flush()
+        luminosities = LuminosityResolver(dbstore).getLuminosities([ sample.sample_id for sample in samples if sample.luminosity is None ])
+        for sample in samples:
+            if sample.luminosity is None:
+                sample.luminosity = luminosities[sample.sample_id]
+        dbstore.flush()
+    except:
+        dbstore.rollback()
+        raise
+
+    print "%-10s %-8s %8s %12s  %s" % ("", "id", "files", "events", "name")
+    for sample in samples:
+        print "%-10s %-8d %8d %12d  %s" % ("replaced" if sample.name in existing else "added", sample.sample_id, sample.nfiles, sample.files_nevents or 0, sample.name)
+    progress.report()
+    report_failed(progress)
+    print "%d sample(s) added, %d replaced" % (len(samples)-len(existing), len(existing))
+    if opts.dry_run:
+        print "Dry run: nothing was written to the database."
+        dbstore.rollback()
+    else:
+        dbstore.commit()
+
+def main():
+    """Main function"""
+    # get the options
+    optmgr = MyOptionParser()
+    opts   = optmgr.get_opt()
+    if opts.manifest is not None:
+      add_manifest(opts)
+      return
+    # build the sample from user input
+    sample = build_sample(opts)
     # connect to the MySQL database using default credentials
     dbstore = DbStore()
     # unless the source is set, prompt the user and present a list to make a choice
@@ -154,41 +368,56 @@ def main():
       print "Warning: Number of processed events not given, and no way to guess it."
 
     # List input files
-    files = []
-    if opts.files == "":
-        files = glob.glob(os.path.join(sample.path, '*.root'))
-    else:
-        files = unicode(opts.files).split(",")
-    if len(files) == 0:
-      print "Warning: no root files found in %r" % sample.path
+    files = list_files(opts, sample.path)
 
-    # Try to guess the number of events stored into the file, as well as the weight sum
-    for f in files:
-        (weight_sum, entries) = get_file_data_(f)
-        sample.files.add(File(f, f, weight_sum, entries))
+    # Try to guess the number of events stored into the file, as well as the weight sum.
+    # All files are scanned before anything is written, so that no lock is held while waiting for the confirmation
+    # (only the rows are kept in memory). Files that cannot be read are not inserted, but listed before the confirmation.
+    progress = ScanProgress(total=len(files) if isinstance(files, list) else None)
+    cache = open_cache(opts)
+    fileRows = [ (unicode(scan.path), unicode(scan.path), scan.event_weight_sum, scan.extras, scan.entries)
+                 for scan in scanFiles(files, jobs=opts.jobs, timeout=opts.timeout, progress=progress, cache=cache, reader=metadataReaders[opts.reader])
+                 if scan.error is None ]
+    filesSummary = FilesSummary.fromRows(fileRows)
+    def reportFailed():
+        if progress.nScanned == 0:
+            print "Warning: no root files found in %r" % sample.path
+            return
+        progress.report()
+        report_failed(progress)
 
     # check that there is no existing entry
-    checkExisting = dbstore.find(Sample,Sample.name==sample.name)
-    if checkExisting.is_empty():
-      print sample
-      if confirm(prompt="Insert into the database?", resp=True):
-        dbstore.add(sample)
-        # compute the luminosity, if possible
-        if sample.luminosity is None:
-          dbstore.flush()
-          sample.luminosity = sample.getLuminosity()
-    else:
-      existing = checkExisting.one()
+    existing = dbstore.find(Sample,Sample.name==sample.name).one()
+    if existing is not None:
       prompt  = "Replace existing "
       prompt += str(existing)
       prompt += "\nby new "
-      prompt += str(sample)
+      prompt += sample.describe(filesSummary)
       prompt += "\n?"
-      if confirm(prompt, resp=False):
-        existing.replaceBy(sample)
-        if existing.luminosity is None:
-          dbstore.flush()
-          existing.luminosity = existing.getLuminosity()
+    # do not keep the transaction of the queries above open while prompting
+    dbstore.rollback()
+    if existing is None:
+      print sample.describe(filesSummary)
+      reportFailed()
+      if not confirm(prompt="Insert into the database?", resp=True):
+        return
+      dbstore.add(sample)
+      sample.addFiles(fileRows, opts.batch_size)
+      # compute the luminosity, if possible
+      if sample.luminosity is None:
+        dbstore.flush()
+        sample.luminosity = sample.getLuminosity()
+    else:
+      reportFailed()
+      if not confirm(prompt, resp=False):
+        return
+      # the files of the existing entry are replaced as well
+      existing.replaceBy(sample)
+      existing.removeFiles(dbstore)
+      existing.addFiles(fileRows, opts.batch_size)
+      if existing.luminosity is None:
+        dbstore.flush()
+        existing.luminosity = existing.getLuminosity()
     # commit
     dbstore.commit()
 
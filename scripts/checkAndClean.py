@@ -2,8 +2,10 @@
 import json
 import os
 import sys
+import time
 from cp3_llbb.SAMADhi.SAMADhi import Analysis, Dataset, Sample, Result, DbStore
 from cp3_llbb.SAMADhi.SAMADhi import File as SFile
+from cp3_llbb.SAMADhi.provenance import ProvenanceGraph
 from optparse import OptionParser, OptionGroup
 
 class MyOptionParser:
@@ -31,6 +33,9 @@ class MyOptionParser:
         self.parser.add_option("-w","--whitelist", action="store", type="string",
                                dest="whitelist", default=None,
              help="JSON file with sample whitelists per analysis.")
+        self.parser.add_option("-c","--chunk-size", action="store", type="int",
+                               dest="chunkSize", default=10000,
+             help="Maximum number of files deleted per transaction.")
         self.parser.add_option("-d","--dry-run", action="store_true",
                                dest="dryrun", default=False,
              help="Dry run: do not write to file and/or touch the database.")
@@ -68,26 +73,103 @@ class StoreCleaner():
   handle to the db store, with basic facilities to cleanup entries
   """
 
-  def __init__(self):
+  def __init__(self, dryrun=False, chunkSize=10000):
     self.dbstore = DbStore()
+    self.dryrun = dryrun
+    self.chunkSize = chunkSize
+    self._graph = None
+
+  def provenanceGraph(self):
+     """provenance graph of the database, loaded when first needed and kept in sync with the deletions"""
+     if self._graph is None:
+       self._graph = ProvenanceGraph(self.dbstore)
+     return self._graph
 
   def deleteSample(self,sample_id):
+     self.deleteSamples([sample_id])
+
+  def deletableSamples(self,sample_ids):
+     """
+     split samples in those that can be deleted, ordered such that derived samples
+     come before their source, and those that are still referenced by a result
+     or by a sample that is not deleted (with the reason)
+     """
+     graph = self.provenanceGraph()
+     sample_ids = set(sample_ids)
+     blocked = {}
+     derived = {}
+     for source_id in sample_ids:
+       for ntype, nid in sorted(graph.children(("sample",source_id))):
+         if ntype == "result":
+           blocked.setdefault(source_id,"used by result %d"%nid)
+         elif nid in sample_ids:
+           derived.setdefault(source_id,set()).add(nid)
+         else:
+           blocked.setdefault(source_id,"source of sample %d"%nid)
+     # the sources of blocked samples are blocked too
+     toCheck = list(blocked)
+     while toCheck:
+       sample_id = toCheck.pop()
+       for source_id, children in derived.items():
+         if sample_id in children and source_id not in blocked:
+           blocked[source_id] = "source of sample %d"%sample_id
+           toCheck.append(source_id)
+     ordered = []
+     remaining = sample_ids-set(blocked)
+     while remaining:
+       leaves = sorted(sample_id for sample_id in remaining if not (derived.get(sample_id,set()) & remaining))
+       ordered += leaves
+       remaining -= set(leaves)
+     return ordered, blocked
+
+  def deleteSamples(self,sample_ids):
+     """
+     delete samples and their files, one sample at a time. Samples that are still referenced
+     are not deleted (nor their files). The files are deleted with set-based DELETE statements
+     of at most chunkSize rows; a sample with more files is committed after each chunk,
+     the others are deleted with their files in a single transaction.
+     In dry-run mode, only the number of files is reported.
+     """
      store = self.dbstore
-     # first remove the files associated with the sample
-     files = store.find(SFile,SFile.sample_id==sample_id)
-     for sampleFile in files:
-       store.remove(sampleFile)
-     # then remove the sample
-     sample = store.find(Sample,Sample.sample_id==sample_id).one()
-     print("deleting sample %d"%sample_id)
-     store.remove(sample)
+     sample_ids, blocked = self.deletableSamples(sample_ids)
+     for sample_id, reason in sorted(blocked.items()):
+       print("not deleting sample %d: %s"%(sample_id,reason))
+     if len(sample_ids)==0:
+       return
+     if self.dryrun:
+       nFiles = store.find(SFile,SFile.sample_id.is_in(sample_ids)).count()
+       print("would delete %d samples with %d files"%(len(sample_ids),nFiles))
+       return
+     start = time.time()
+     nFiles = 0
+     nSamples = 0
+     for sample_id in sample_ids:
+       print("deleting sample %d"%sample_id)
+       try:
+         # first remove the files associated with the sample, then the sample
+         nFiles += SFile.removeForSamples(store, [sample_id], self.chunkSize, lambda n: store.commit() if n==self.chunkSize else None)
+         store.find(Sample,Sample.sample_id==sample_id).remove()
+         store.commit()
+         self.provenanceGraph().removeSample(sample_id)
+         nSamples += 1
+       except Exception as e:
+         store.rollback()
+         print("could not delete sample %d: %s"%(sample_id,str(e)))
+     elapsed = time.time()-start
+     print("deleted %d samples with %d files in %.1f s (%.0f files/s)"%(nSamples,nFiles,elapsed,nFiles/elapsed if elapsed>0 else 0.))
 
   def deleteDataset(self,dataset_id):
      store = self.dbstore
-     # simply delete the dataset
+     # the report may be outdated: only delete the dataset if it is still orphan
+     graph = self.provenanceGraph()
+     samples = sorted(nid for ntype, nid in graph.children(("dataset",dataset_id)))
+     if samples:
+       print("not deleting dataset %d: source of sample %d"%(dataset_id,samples[0]))
+       return
      dataset = store.find(Dataset,Dataset.dataset_id==dataset_id).one()
      print("deleting dataset %d"%dataset_id)
      store.remove(dataset)
+     graph.removeDataset(dataset_id)
 
   def commit(self):
      self.dbstore.commit()
@@ -114,13 +196,18 @@ def main():
     whitelist = {}
 
   # utility class to clean the db
-  myCleaner = StoreCleaner()
+  myCleaner = StoreCleaner(opts.dryrun, opts.chunkSize)
 
   # open the sample analysis report and classify bad samples
   samplesAnalysisReport = os.path.join(opts.path, "SamplesAnalysisReport.json")
   with open(samplesAnalysisReport) as jfile:
     data = json.load(jfile)
   samples = data["MissingDirSamples"]
+  # date from which the path is missing, for reports with a persistent check state
+  missingSince = data.get("MissingSince",{})
+  def describe(sample):
+    since = missingSince.get(str(sample["sample_id"]))
+    return "%s (missing since %s)"%(sample["name"],since) if since else sample["name"]
   investigate = []
   delete = []
   empty = []
@@ -143,18 +230,18 @@ def main():
          delete.append(sample)
   print("\n\nWhitelisted sample with missing path. Investigate:")
   for sample in empty:
-    print(sample["name"])
+    print(describe(sample))
   print("\n\nWhitelisted sample with unreachable path. Investigate:")
   for sample in investigate:
-    print(sample["name"])
+    print(describe(sample))
   print("\n\nSamples to be deleted because of missing path:")
   for sample in empty_delete:
-    print(sample["name"])
-    if opts.cleanupMissing : myCleaner.deleteSample(sample["sample_id"])
+    print(describe(sample))
+  if opts.cleanupMissing : myCleaner.deleteSamples([ sample["sample_id"] for sample in empty_delete ])
   print("\n\nSamples to be deleted because of unreachable path:")
   for sample in delete:
-    print(sample["name"])
-    if opts.cleanupUnreachable : myCleaner.deleteSample(sample["sample_id"])
+    print(describe(sample))
+  if opts.cleanupUnreachable : myCleaner.deleteSamples([ sample["sample_id"] for sample in delete ])
 
   # now clean orphan datasets
   datasetsAnalysisReport = os.path.join(opts.path, "DatasetsAnalysisReport.json")
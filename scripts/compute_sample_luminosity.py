@@ -75,11 +75,16 @@ def compute_luminosity(sample, options):
     print("Computing luminosity for %r") % str(sample.name)
 
     lumi = 0
+    mask = sample.getLumiMask()
+    if not mask:
+        print("Error: the sample does not have processed luminosity sections information.")
+        return 0
+
     if not options.local:
         print("Running brilcalc on lxplus... You'll probably need to enter your lxplus password in a moment")
         print('')
 
-        cmds = ['brilcalc', 'lumi', '--normtag', options.normtag, '--output-style', 'csv', '-i', '"%s"' % str(sample.processed_lumi.replace('"', ''))]
+        cmds = ['brilcalc', 'lumi', '--normtag', options.normtag, '--output-style', 'csv', '-i', '"%s"' % mask.toJSON().replace('"', '')]
         cmd = 'export PATH="$HOME/.local/bin:/afs/cern.ch/cms/lumi/brilconda-1.1.7/bin:$PATH"; ' + ' '.join(cmds)
         ssh_cmds = ['ssh', '%s@lxplus.cern.ch' % options.username, cmd]
         brilcalc_result = subprocess.check_output(ssh_cmds)
@@ -2,25 +2,61 @@
 
 import argparse
 
-from cp3_llbb.SAMADhi.das_import import import_cms_dataset
+from cp3_llbb.SAMADhi.das_import import import_cms_dataset, import_cms_datasets, expand_das_pattern, DASCache, set_das_cache
 
 def get_options():
     parser = argparse.ArgumentParser(description='Import CMS datasets into SAMADhi')
 
     parser.add_argument("-p", "--process", action="store", type=str, dest="process", help="Process name.")
 
-    parser.add_argument("--xsection", action="store", type=float, default=1.0, dest="xsection", help="Cross-section in pb.")
+    parser.add_argument("--xsection", action="store", type=float, dest="xsection", help="Cross-section in pb (default: 1 for new datasets).")
 
     parser.add_argument("--energy", action="store", type=float, dest="energy", help="CoM energy, in TeV.")
 
-    parser.add_argument("--comment", action="store", type=str, default="", dest="comment", help="User defined comment")
+    parser.add_argument("--comment", action="store", type=str, dest="comment", help="User defined comment")
 
-    parser.add_argument("dataset", action="store", type=str, nargs=1, help="CMS dataset")
+    parser.add_argument("dataset", action="store", type=str, nargs="*", help="CMS dataset(s), or DAS wildcard pattern(s) like /TT*/RunIIFall17*/MINIAODSIM")
+
+    parser.add_argument("-f", "--file", action="store", type=str, dest="file", help="File with a list of datasets (or patterns), one per line")
+
+    parser.add_argument("-j", "--jobs", action="store", type=int, default=8, dest="jobs", help="Number of concurrent DAS queries in bulk mode (default: %(default)s)")
+
+    parser.add_argument("-n", "--dry-run", action="store_true", dest="dryrun", help="Bulk mode: only print the differences with the database")
+
+    parser.add_argument("--das-cache", action="store", type=str, default="~/.samadhi_das_cache.db", dest="das_cache", help="File used to cache the DAS responses (default: %(default)s)")
+
+    parser.add_argument("--das-ttl", action="store", type=float, default=24., dest="das_ttl", help="Maximal age, in hours, of the cached DAS responses (default: %(default)s)")
+
+    parser.add_argument("--no-das-cache", action="store_const", const=None, dest="das_cache", help="Do not use the DAS responses cache")
+
+    parser.add_argument("--refresh", action="store_true", dest="refresh", help="Query DAS even if the response is cached, and update the cache")
 
     args = parser.parse_args()
 
+    if args.file:
+        with open(args.file) as f:
+            args.dataset += [ line.strip() for line in f if line.strip() and not line.startswith("#") ]
+    if not args.dataset:
+        parser.error("No dataset given")
+
     return args
 
 if __name__ == '__main__':
     options = get_options()
-    import_cms_dataset(options.dataset[0], options.process, options.energy, options.xsection, options.comment, True)
+    if options.das_cache is not None:
+        set_das_cache(DASCache(options.das_cache, ttl=(0 if options.refresh else options.das_ttl*3600)))
+    if len(options.dataset) == 1 and "*" not in options.dataset[0] and not options.file:
+        # single dataset: interactive import
+        xsection = options.xsection if options.xsection is not None else 1.0
+        import_cms_dataset(options.dataset[0], options.process, options.energy, xsection, options.comment or "", True)
+    else:
+        # bulk import, in a single transaction
+        datasets = set()
+        for name in options.dataset:
+            if "*" in name:
+                expanded = expand_das_pattern(name, options.refresh)
+                print("%s: %d dataset(s)" % (name, len(expanded)))
+                datasets.update(expanded)
+            else:
+                datasets.add(name)
+        import_cms_datasets(datasets, options.process, options.energy, options.xsection, options.comment, jobs=options.jobs, dryrun=options.dryrun, refresh=options.refresh)
@@ -26,6 +26,9 @@ class MyOptionParser:
         self.parser.add_option("-i","--id", action="store", type="int",
                                dest="objid", default=None,
              help="filter on id")
+        self.parser.add_option("-r","--replica", action="store", type="string",
+                               dest="replica", default=None,
+             help="use a local replica of the database (see sync_SAMADhi.py)")
 
     def get_opt(self):
         """
@@ -58,8 +61,8 @@ def main():
     # get the options
     optmgr = MyOptionParser()
     opts = optmgr.get_opt()
-    # connect to the MySQL database using default credentials
-    dbstore = DbStore()
+    # connect to the MySQL database using default credentials, or to the local replica
+    dbstore = DbStore(replica=opts.replica)
     # build the query
     if opts.objtype == "dataset":
       objectClass = Dataset
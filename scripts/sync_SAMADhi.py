@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+""" Simple script to create or update a local SQLite replica of the database """
+
+import argparse
+from cp3_llbb.SAMADhi.SAMADhi import DbStore
+from cp3_llbb.SAMADhi.replica import syncReplica
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Create or update a local, read-only SQLite replica of SAMADhi. It can be used with DbStore(replica=path).')
+
+    parser.add_argument('replica', type=str, help='Path of the SQLite file', metavar='REPLICA')
+
+    parser.add_argument('--files', dest='files', action='store_true', default=None, help='Also replicate the file table (the choice is kept for the next syncs)')
+
+    parser.add_argument('--no-files', dest='files', action='store_false', help='Do not replicate the file table anymore, and remove it from the replica')
+
+    parser.add_argument('--full', dest='full', action='store_true', help='Copy everything again instead of only the new and changed rows')
+
+    options = parser.parse_args()
+
+    return options
+
+def main():
+    options = get_options()
+
+    syncReplica(DbStore(), options.replica, withFiles=options.files, full=options.full)
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
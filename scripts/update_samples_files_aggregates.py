@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+""" Simple script to recompute the files aggregates (number of files, sum of nevents and of event weights) of samples """
+
+import argparse
+from cp3_llbb.SAMADhi.SAMADhi import Sample, DbStore
+
+def get_options():
+    parser = argparse.ArgumentParser(description='Recompute the number of files, sum of file nevents and sum of file event weights stored with each sample.')
+
+    parser.add_argument('-i', '--id', type=int, nargs='+', dest='ids', help='IDs of the samples (all samples by default)', metavar='ID')
+
+    parser.add_argument('-e', '--extras', dest='extras', action='store_true', help='Also store the sum of the extra event weight sums (systematic variations) of the files with each sample')
+
+    parser.add_argument('-w', '--write', dest='write', action='store_true', help='Write changes to the database')
+
+    options = parser.parse_args()
+
+    return options
+
+def main():
+    options = get_options()
+
+    dbstore = DbStore()
+
+    nChanged = Sample.updateFilesAggregates(dbstore, options.ids)
+    print("Files aggregates changed for {} sample(s).".format(nChanged))
+
+    if options.extras:
+        ids = options.ids if options.ids is not None else list(dbstore.find(Sample).values(Sample.sample_id))
+        nUpdated = Sample.updateExtrasWeightSums(dbstore, ids)
+        print("Extra event weight sums updated for {} sample(s).".format(nUpdated))
+
+    if options.write:
+        dbstore.commit()
+    else:
+        print("Currently running in dry-run mode. If you are happy with the change, pass the '-w' flag to this script to store the changes into the database.")
+        dbstore.rollback()
+
+#
+# main
+#
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+import imp
+import os
+import sys
+
+import pytest
+
+testdir = os.path.dirname(os.path.abspath(__file__))
+datadir = os.path.join(testdir, "data")
+
+# import the modules of this tree as cp3_llbb.SAMADhi, as with setup_standalone.sh
+for name, path in (("cp3_llbb", testdir), ("cp3_llbb.SAMADhi", os.path.join(os.path.dirname(testdir), "python"))):
+    package = imp.new_module(name)
+    package.__path__ = [ path ]
+    sys.modules[name] = package
+sys.modules["cp3_llbb"].SAMADhi = sys.modules["cp3_llbb.SAMADhi"]
+
+@pytest.fixture
+def datafile():
+    """path of a file in tests/data"""
+    return lambda name: os.path.join(datadir, name)
+
+# SQLite version of data/SAMADhi.sql (the columns used by the Storm classes)
+sqliteSchema = [
+    "CREATE TABLE analysis (analysis_id INTEGER PRIMARY KEY, description TEXT, cadiline TEXT, contact TEXT, "
+    "last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE dataset (dataset_id INTEGER PRIMARY KEY, name TEXT NOT NULL, datatype TEXT NOT NULL, process TEXT, nevents INTEGER, dsize INTEGER, "
+    "xsection REAL, cmssw_release TEXT, globaltag TEXT, energy REAL, creation_time TIMESTAMP, user_comment TEXT, "
+    "last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE sample (sample_id INTEGER PRIMARY KEY, name TEXT NOT NULL, path TEXT NOT NULL, sampletype TEXT NOT NULL, nevents_processed INTEGER, "
+    "nevents INTEGER, normalization REAL NOT NULL DEFAULT 1.0, event_weight_sum REAL NOT NULL DEFAULT 1.0, extras_event_weight_sum TEXT, processed_lumi TEXT, "
+    "nfiles INTEGER NOT NULL DEFAULT 0, files_nevents INTEGER NOT NULL DEFAULT 0, files_event_weight_sum REAL NOT NULL DEFAULT 0, luminosity REAL, "
+    "code_version TEXT, user_comment TEXT, author TEXT, creation_time TIMESTAMP, last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP, "
+    "source_dataset_id INTEGER, source_sample_id INTEGER)",
+    "CREATE TABLE result (result_id INTEGER PRIMARY KEY, path TEXT NOT NULL, description TEXT, author TEXT, creation_time TIMESTAMP, "
+    "analysis_id INTEGER, elog TEXT, last_modified TIMESTAMP DEFAULT CURRENT_TIMESTAMP)",
+    "CREATE TABLE sampleresult (sample_id INTEGER NOT NULL, result_id INTEGER NOT NULL, PRIMARY KEY (sample_id, result_id))",
+    # AUTOINCREMENT: the ids of removed files are not reused, as with AUTO_INCREMENT in MySQL
+    "CREATE TABLE file (id INTEGER PRIMARY KEY AUTOINCREMENT, sample_id INTEGER NOT NULL, lfn TEXT NOT NULL, pfn TEXT NOT NULL, "
+    "event_weight_sum REAL, extras_event_weight_sum TEXT, nevents INTEGER)",
+    ]
+
+@pytest.fixture
+def store():
+    """Storm store on an empty in-memory SQLite database with the SAMADhi tables"""
+    from storm.locals import create_database, Store
+    store = Store(create_database("sqlite:"))
+    for statement in sqliteSchema:
+        store.execute(statement)
+    store.commit()
+    yield store
+    store.close()
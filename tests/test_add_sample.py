@@ -0,0 +1,84 @@
+import imp
+import json
+import os
+import shutil
+import sys
+
+import pytest
+
+from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample, File
+
+scriptsdir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+
+@pytest.fixture
+def addSample(store, monkeypatch):
+    """the add_sample script, using the test store"""
+    module = imp.load_source("add_sample", os.path.join(scriptsdir, "add_sample.py"))
+    monkeypatch.setattr(module, "DbStore", lambda *args, **kwargs: store)
+    return module
+
+def runManifest(addSample, monkeypatch, tmpdir, samples, *args):
+    manifest = tmpdir.join("manifest.json")
+    manifest.write(json.dumps({ "samples": samples }))
+    monkeypatch.setattr(sys, "argv", [ "add_sample.py", "--manifest", str(manifest), "--no-cache", "--reader", "light" ]+list(args))
+    addSample.main()
+
+def sampleFiles(store, name):
+    sample = store.find(Sample, Sample.name == name).one()
+    return sorted(os.path.basename(lfn) for lfn in store.find(File, File.sample_id == sample.sample_id).values(File.lfn))
+
+@pytest.fixture
+def sampleDir(tmpdir, datafile):
+    directory = tmpdir.mkdir("sample")
+    for name in ("a.root", "b.root", "c.tmp"):
+        shutil.copy(datafile("tree.root"), str(directory.join(name)))
+    return directory
+
+def test_manifestPatterns(addSample, store, monkeypatch, tmpdir, sampleDir):
+    runManifest(addSample, monkeypatch, tmpdir, [
+        { "type": "NTUPLES", "path": str(sampleDir), "name": "included", "include": "*.tmp" },
+        { "type": "NTUPLES", "path": str(sampleDir), "name": "excluded", "exclude": "b*" },
+        { "type": "NTUPLES", "path": str(sampleDir), "name": "default", "include": None } ])
+    assert sampleFiles(store, u"included") == [ "c.tmp" ]
+    assert sampleFiles(store, u"excluded") == [ "a.root" ]
+    assert sampleFiles(store, u"default") == [ "a.root", "b.root" ]
+
+def test_manifestWrongPatterns(addSample, tmpdir):
+    manifest = tmpdir.join("manifest.json")
+    manifest.write(json.dumps([ { "type": "NTUPLES", "path": "/data", "include": { "pattern": "*.root" } } ]))
+    with pytest.raises(ValueError):
+        addSample.load_manifest(str(manifest))
+
+def test_manifestSources(addSample, store, monkeypatch, tmpdir, sampleDir):
+    dataset = Dataset(u"/A/B/C", u"mc")
+    dataset.nevents = 100
+    store.add(dataset)
+    source = Sample(u"source", u"/source", u"NTUPLES", 7)
+    store.add(source)
+    store.commit()
+    runManifest(addSample, monkeypatch, tmpdir, [
+        { "type": "NTUPLES", "path": str(sampleDir), "name": "default" },
+        { "type": "NTUPLES", "path": str(sampleDir), "name": "noSource", "source_sample": None },
+        { "type": "NTUPLES", "path": str(sampleDir), "name": "derived", "source_sample": "default" } ],
+        "--source_sample", str(source.sample_id), "--source_dataset", str(dataset.dataset_id))
+    samples = dict((sample.name, sample) for sample in store.find(Sample))
+    assert (samples[u"default"].source_sample_id, samples[u"default"].nevents_processed) == (source.sample_id, 7)
+    assert (samples[u"noSource"].source_sample_id, samples[u"noSource"].nevents_processed) == (None, 100)
+    assert (samples[u"derived"].source_sample_id, samples[u"derived"].nevents_processed) == (samples[u"default"].sample_id, 7)
+    assert all(sample.source_dataset_id == dataset.dataset_id for name, sample in samples.items() if name != u"source")
+
+def test_manifestReplace(addSample, store, monkeypatch, tmpdir, sampleDir):
+    runManifest(addSample, monkeypatch, tmpdir, [ { "type": "NTUPLES", "path": str(sampleDir), "name": "s", "include": "a.root" } ])
+    # the files are scanned before the files of the replaced sample are removed
+    scanFiles = addSample.scanFiles
+    filesDuringScan = []
+    def checkedScan(*args, **kwargs):
+        for scan in scanFiles(*args, **kwargs):
+            filesDuringScan.append(sampleFiles(store, u"s"))
+            yield scan
+    monkeypatch.setattr(addSample, "scanFiles", checkedScan)
+    runManifest(addSample, monkeypatch, tmpdir, [ { "type": "NTUPLES", "path": str(sampleDir), "name": "s" } ])
+    assert filesDuringScan == [ [ "a.root" ] ]*2
+    assert sampleFiles(store, u"s") == [ "a.root", "b.root" ]
+    sample = store.find(Sample, Sample.name == u"s").one()
+    assert (store.find(Sample).count(), sample.nfiles) == (1, 2)
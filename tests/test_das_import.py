@@ -0,0 +1,65 @@
+import json
+import threading
+from multiprocessing.pool import ThreadPool
+
+from cp3_llbb.SAMADhi import das_import
+from cp3_llbb.SAMADhi.das_import import DASCache, query_das
+
+def fakeDAS(query):
+    """parsed response of a DAS query for any dataset"""
+    if query.startswith("summary"):
+        return { "nresults": 1, "data": [ { "summary": [ { "nevents": 10, "file_size": 100, "nfiles": 2 } ] } ] }
+    elif query.startswith("dataset="):
+        return { "data": [ { "dataset": [ { "name": query.split("=")[1], "datatype": "mc" } ] } ] }
+    elif query.startswith("release"):
+        return { "data": [ { "release": [ { "name": [ "CMSSW_9_4_0" ] } ] } ] }
+    return { "data": [ { "config": [ { "global_tag": "GT" } ] } ] }
+
+def test_queryDAS(monkeypatch):
+    monkeypatch.setattr(das_import, "do_das_query", lambda query, refresh=False: fakeDAS(query))
+    nThreads = threading.active_count()
+    metadata = query_das("/A/B/C")
+    assert (metadata["name"], metadata["nevents"], metadata["release"], metadata["globalTag"]) == ("/A/B/C", 10, "CMSSW_9_4_0", "GT")
+    # the pool of the call is joined
+    assert threading.active_count() == nThreads
+    # or a pool shared by the callers is used
+    dasPool, pool = ThreadPool(4), ThreadPool(2)
+    try:
+        names = [ "/D%d/B/C" % i for i in range(4) ]
+        assert [ metadata["name"] for metadata in pool.map(lambda name : query_das(name, pool=dasPool), names) ] == names
+    finally:
+        for p in (pool, dasPool):
+            p.close()
+            p.join()
+
+def test_isSuccessful():
+    assert das_import._isSuccessful({ "data": [ { "dataset": [ { "name": "/A/B/C" } ] } ] })
+    assert das_import._isSuccessful([ { "dataset": [ { "name": "/A/B/C" } ] } ])
+    assert not das_import._isSuccessful({ "status": "fail", "reason": "timeout" })
+    assert not das_import._isSuccessful({ "data": [] })
+    assert not das_import._isSuccessful([])
+    assert not das_import._isSuccessful([ { "error": "no such dataset" } ])
+
+def test_cacheOnlySuccessful(tmpdir, monkeypatch):
+    responses = { "dataset=/A/B/C": { "data": [ { "dataset": [ { "name": "/A/B/C" } ] } ] }, "dataset=/X/Y/Z": { "status": "fail" } }
+    calls = []
+    def check_output(args):
+        calls.append(args[-1])
+        return json.dumps(responses[args[-1]])
+    monkeypatch.setattr(das_import.subprocess, "check_output", check_output)
+    monkeypatch.setattr(das_import, "_dasCache", DASCache(str(tmpdir.join("das.db"))))
+    for i in range(2):
+        das_import.do_das_query("dataset=/A/B/C")
+        das_import.do_das_query("dataset=/X/Y/Z")
+    assert calls == [ "dataset=/A/B/C", "dataset=/X/Y/Z", "dataset=/X/Y/Z" ]
+
+def test_cachePrune(tmpdir):
+    cache = DASCache(str(tmpdir.join("das.db")), maxEntries=2, pruneEvery=3)
+    for i in range(3):
+        cache.put("q%d" % i, "r%d" % i)
+    assert [ cache.get("q%d" % i) for i in range(3) ] == [ None, "r1", "r2" ]
+    cache.put("q3", "r3")
+    assert cache.get("q3") == "r3"
+    # checked again every 3 insertions, and when opened
+    reopened = DASCache(str(tmpdir.join("das.db")), maxEntries=1)
+    assert [ reopened.get("q%d" % i) for i in range(4) ] == [ None, None, None, "r3" ]
@@ -0,0 +1,54 @@
+import imp
+import os
+
+import pytest
+
+from cp3_llbb.SAMADhi.SAMADhi import Sample
+
+scriptsdir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "scripts")
+
+@pytest.fixture
+def dbAnalysis():
+    """the SAMADhi_dbAnalysis script"""
+    return imp.load_source("SAMADhi_dbAnalysis", os.path.join(scriptsdir, "SAMADhi_dbAnalysis.py"))
+
+class Options(object):
+    def __init__(self, state, dryRun=False, pathMaxAge=7.):
+        self.state = state
+        self.dryRun = dryRun
+        self.pathMaxAge = pathMaxAge
+
+def fileRows(directory, n):
+    return [ (u"/store/f%d.root" % i, u"srm://se/SFN=/data/%s/f%d.root" % (directory, i), 1., None, 10) for i in range(n) ]
+
+def test_samplesDirectories(dbAnalysis, store, tmpdir):
+    opts = Options(str(tmpdir.join("state.db")))
+    sample = Sample(u"s", u"", u"NTUPLES", 20)
+    store.add(sample)
+    sample.addFiles(fileRows(u"old", 2))
+    assert dbAnalysis.getSamplesDirectories(store, [ sample ], opts) == { sample.sample_id: [ u"/data/old" ] }
+    # files replaced by others with the same aggregates
+    sample.removeFiles(store)
+    sample.addFiles(fileRows(u"new", 2))
+    store.invalidate(sample)
+    assert (sample.nfiles, sample.files_nevents) == (2, 20)
+    assert dbAnalysis.getSamplesDirectories(store, [ sample ], opts) == { sample.sample_id: [ u"/data/new" ] }
+
+def test_openStateDryRun(dbAnalysis, store, tmpdir):
+    opts = Options(str(tmpdir.join("state.db")), dryRun=True)
+    sample = Sample(u"s", u"", u"NTUPLES", 20)
+    store.add(sample)
+    sample.addFiles(fileRows(u"dir", 2))
+    assert dbAnalysis.getSamplesDirectories(store, [ sample ], opts) == { sample.sample_id: [ u"/data/dir" ] }
+    assert not tmpdir.join("state.db").check()
+    # the existing state file is used, but not written
+    opts.dryRun = False
+    dbAnalysis.getSamplesDirectories(store, [ sample ], opts)
+    before = tmpdir.join("state.db").read_binary()
+    opts.dryRun = True
+    state = dbAnalysis.openState(opts)
+    assert list(state.sampleDirectories()) == [ sample.sample_id ]
+    state.setPathChecks("sample", [ (sample.sample_id, u"/data/dir", "ok") ])
+    state.commit()
+    state.close()
+    assert tmpdir.join("state.db").read_binary() == before
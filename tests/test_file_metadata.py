@@ -0,0 +1,31 @@
+from cp3_llbb.SAMADhi.file_metadata import scanFiles, MetadataCache, discoverFiles
+
+def test_discoverFiles(tmpdir):
+    for path in ("a.root", "b.txt", "sub/c.root", "sub/failed/d.root"):
+        tmpdir.join(path).ensure()
+    top = str(tmpdir)
+    relative = lambda paths: [ path[len(top)+1:] for path in paths ]
+    assert relative(discoverFiles(top)) == [ "a.root" ]
+    assert relative(discoverFiles(top, recursive=True)) == [ "a.root", "sub/c.root", "sub/failed/d.root" ]
+    assert relative(discoverFiles(top, recursive=True, exclude=[ "*/failed" ])) == [ "a.root", "sub/c.root" ]
+    assert relative(discoverFiles(top, include=[ "sub/*.root" ], recursive=True)) == [ "sub/c.root", "sub/failed/d.root" ]
+
+def test_scanFilesCache(tmpdir):
+    paths = [ str(tmpdir.join("f%d.root" % i).ensure()) for i in range(3) ]+[ str(tmpdir.join("missing.root")) ]
+    read = []
+    def reader(path):
+        read.append(path)
+        if path.endswith("missing.root"):
+            raise IOError("could not open %s" % path)
+        return (1.5, 10, None)
+    cache = MetadataCache(str(tmpdir.join("cache.db")))
+    scans = list(scanFiles(iter(paths), reader=reader, cache=cache))
+    assert [ scan.path for scan in scans ] == paths
+    assert [ (scan.event_weight_sum, scan.entries) for scan in scans[:3] ] == [ (1.5, 10) ]*3
+    assert scans[3].error == "could not open %s" % paths[3]
+    # only the failed file is read again, and a modified one
+    tmpdir.join("f1.root").write("modified")
+    del read[:]
+    scans = list(scanFiles(paths, reader=reader, cache=cache))
+    assert read == [ paths[1], paths[3] ]
+    assert [ scan.error is None for scan in scans ] == [ True, True, True, False ]
@@ -0,0 +1,54 @@
+from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample, Result, SampleResult
+from cp3_llbb.SAMADhi.integrity import checkIntegrity
+
+def violations(store, section):
+    return [ (obj.__class__.__name__, obj.name if hasattr(obj, "name") else obj.path, message) for obj, message in checkIntegrity(store, section) ]
+
+def test_datasets(store):
+    used, orphan = Dataset(u"/Used/X/Y", u"mc"), Dataset(u"/Orphan/X/Y", u"mc")
+    store.add(used)
+    store.add(orphan)
+    store.flush()
+    sample = Sample(u"s", u"/s", u"NTUPLES", None)
+    sample.source_dataset_id = used.dataset_id
+    store.add(sample)
+    store.flush()
+    assert violations(store, "datasets") == [ ("Dataset", u"/Orphan/X/Y", "orphan dataset") ]
+
+def test_samples(store):
+    good = Sample(u"good", u"/good", u"NTUPLES", None)
+    store.add(good)
+    store.flush()
+    good.addFiles([ (u"a", u"a", 1., None, 4), (u"b", u"b", 1., None, 6) ])
+    good.nevents = 10
+    wrongEvents = Sample(u"wrongEvents", u"/wrongEvents", u"NTUPLES", None)
+    store.add(wrongEvents)
+    store.flush()
+    wrongEvents.addFiles([ (u"c", u"c", 1., None, 4) ])
+    wrongEvents.nevents = 5
+    noFiles = Sample(u"noFiles", u"/noFiles", u"NTUPLES", None)
+    noFiles.nevents = 5
+    dangling = Sample(u"dangling", u"/dangling", u"NTUPLES", None)
+    dangling.source_dataset_id = 1000
+    dangling.source_sample_id = 1001
+    store.add(noFiles)
+    store.add(dangling)
+    store.flush()
+    assert violations(store, "samples") == [
+        ("Sample", u"wrongEvents", "inconsistent number of events: 5 in the sample, 4 in the files"),
+        ("Sample", u"dangling", "inconsistent source dataset"),
+        ("Sample", u"dangling", "inconsistent source sample") ]
+
+def test_results(store):
+    sample = Sample(u"s", u"/s", u"NTUPLES", None)
+    store.add(sample)
+    for path in (u"/good", u"/alone", u"/dangling"):
+        store.add(Result(path))
+    store.flush()
+    good, alone, dangling = [ store.find(Result, Result.path == path).one() for path in (u"/good", u"/alone", u"/dangling") ]
+    for sample_id, result in ((sample.sample_id, good), (1000, dangling)):
+        link = SampleResult()
+        link.sample_id, link.result_id = sample_id, result.result_id
+        store.add(link)
+    store.flush()
+    assert violations(store, "results") == [ ("Result", u"/alone", "no source sample"), ("Result", u"/dangling", "inconsistent source sample") ]
@@ -0,0 +1,42 @@
+import pytest
+
+from cp3_llbb.SAMADhi.lumimask import LumiMask, findOverlaps
+
+def test_merge():
+    mask = LumiMask([ (1, 5, 10), (1, 1, 4), (1, 20, 30), (2, 3, 3), (1, 8, 12) ])
+    assert list(mask.ranges()) == [ (1, 1, 12), (1, 20, 30), (2, 3, 3) ]
+    assert len(mask) == 12+11+1
+    assert mask.runs() == [ 1, 2 ]
+
+def test_json():
+    text = '{"2": [[3, 3]], "1": [[1, 12], [20, 30]]}'
+    mask = LumiMask.fromJSON(text)
+    assert mask.toJSON() == '{"1": [[1, 12], [20, 30]], "2": [[3, 3]]}'
+    assert LumiMask.fromJSON(mask.toJSON()) == mask
+    assert not LumiMask.fromJSON(None)
+    assert not LumiMask.fromJSON("")
+
+def test_contains():
+    mask = LumiMask([ (1, 1, 12), (1, 20, 30) ])
+    assert (1, 1) in mask
+    assert (1, 12) in mask
+    assert (1, 13) not in mask
+    assert (1, 30) in mask
+    assert (1, 31) not in mask
+    assert (2, 1) not in mask
+
+def test_setOperations():
+    a = LumiMask([ (1, 1, 10), (2, 1, 5) ])
+    b = LumiMask([ (1, 5, 15), (3, 1, 1) ])
+    assert list((a | b).ranges()) == [ (1, 1, 15), (2, 1, 5), (3, 1, 1) ]
+    assert list((a & b).ranges()) == [ (1, 5, 10) ]
+    assert list((a - b).ranges()) == [ (1, 1, 4), (2, 1, 5) ]
+    assert list(LumiMask([ (1, 1, 10) ]).difference(LumiMask([ (1, 3, 4), (1, 7, 7) ])).ranges()) == [ (1, 1, 2), (1, 5, 6), (1, 8, 10) ]
+    assert a.isdisjoint(LumiMask([ (1, 11, 20) ]))
+    assert not a.isdisjoint(b)
+
+def test_findOverlaps():
+    masks = { "A": LumiMask([ (1, 1, 10) ]), "B": LumiMask([ (1, 8, 12), (2, 1, 1) ]), "C": LumiMask([ (2, 2, 3) ]) }
+    overlaps = findOverlaps(masks)
+    assert list(overlaps) == [ ("A", "B") ]
+    assert list(overlaps[("A", "B")].ranges()) == [ (1, 8, 10) ]
@@ -0,0 +1,27 @@
+import os
+import time
+
+from cp3_llbb.SAMADhi import path_checker
+from cp3_llbb.SAMADhi.path_checker import checkPaths, OK, MISSING, UNKNOWN
+
+def test_checkPaths(tmpdir):
+    tmpdir.join("a.root").write("")
+    tmpdir.mkdir("sub").join("b.root").write("")
+    os.symlink(str(tmpdir.join("nowhere")), str(tmpdir.join("broken.root")))
+    paths = [ str(tmpdir.join("a.root")), str(tmpdir.join("sub", "b.root")), str(tmpdir.join("sub")),
+              str(tmpdir.join("c.root")), str(tmpdir.join("broken.root")), str(tmpdir.join("nodir", "d.root")), "", None ]
+    assert checkPaths(paths, jobs=2) == dict(zip(paths, [ OK, OK, OK, MISSING, MISSING, MISSING, MISSING, MISSING ]))
+
+def test_hungDirectory(tmpdir, monkeypatch):
+    tmpdir.mkdir("hung").join("a.root").write("")
+    tmpdir.join("b.root").write("")
+    checkDirectory = path_checker._checkDirectory
+    def slowCheck(directory, names):
+        if directory.endswith("hung"):
+            time.sleep(3.)
+        return checkDirectory(directory, names)
+    monkeypatch.setattr(path_checker, "_checkDirectory", slowCheck)
+    paths = [ str(tmpdir.join("hung", "a.root")), str(tmpdir.join("b.root")) ]
+    start = time.time()
+    assert checkPaths(paths, jobs=2, timeout=0.5) == dict(zip(paths, [ UNKNOWN, OK ]))
+    assert time.time()-start < 2.5
@@ -0,0 +1,31 @@
+from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample, Result, SampleResult
+from cp3_llbb.SAMADhi.provenance import ProvenanceGraph
+
+def test_graph(store):
+    dataset = Dataset(u"/D/X/Y", u"mc")
+    store.add(dataset)
+    store.flush()
+    parent = Sample(u"parent", u"/parent", u"NTUPLES", None)
+    parent.source_dataset_id = dataset.dataset_id
+    store.add(parent)
+    store.flush()
+    child = Sample(u"child", u"/child", u"NTUPLES", None)
+    child.source_sample_id = parent.sample_id
+    result = Result(u"/result")
+    store.add(child)
+    store.add(result)
+    store.flush()
+    link = SampleResult()
+    link.sample_id, link.result_id = child.sample_id, result.result_id
+    store.add(link)
+    store.flush()
+
+    graph = ProvenanceGraph(store)
+    assert graph.results_depending_on(dataset) == set([ result.result_id ])
+    assert graph.datasets_upstream_of(result) == set([ dataset.dataset_id ])
+    assert graph.children(parent) == set([ ("sample", child.sample_id) ])
+    graph.removeSample(child.sample_id)
+    assert graph.results_depending_on(dataset) == set()
+    graph.addSample(child.sample_id, source_sample_id=parent.sample_id)
+    graph.addResult(result.result_id, [ child.sample_id ])
+    assert graph.results_depending_on(("dataset", dataset.dataset_id)) == set([ result.result_id ])
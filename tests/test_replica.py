@@ -0,0 +1,57 @@
+import sqlite3
+
+from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample
+from cp3_llbb.SAMADhi.replica import syncReplica
+
+def addSample(store, name, nFiles):
+    sample = Sample(name, u"/data/%s" % name, u"NTUPLES", 10*nFiles)
+    store.add(sample)
+    sample.addFiles([ (u"/store/%s/f%d.root" % (name, i), u"/data/%s/f%d.root" % (name, i), 1., None, 10) for i in range(nFiles) ])
+    return sample
+
+def replicaRows(path, statement):
+    replica = sqlite3.connect(path)
+    try:
+        return sorted(replica.execute(statement).fetchall())
+    finally:
+        replica.close()
+
+def test_incrementalSync(store, tmpdir):
+    path = str(tmpdir.join("replica.db"))
+    dataset = Dataset(u"/A/X/Y", u"mc")
+    store.add(dataset)
+    first, second = addSample(store, u"first", 2), addSample(store, u"second", 1)
+    # rows that were not modified since long before the sync
+    store.execute("UPDATE dataset SET last_modified = '2000-01-01 00:00:00'")
+    store.execute("UPDATE sample SET last_modified = '2000-01-01 00:00:00'")
+    store.commit()
+    syncReplica(store, path, withFiles=True, verbose=False)
+    assert replicaRows(path, "SELECT name FROM sample") == [ (u"first",), (u"second",) ]
+    assert replicaRows(path, "SELECT sample_id, COUNT(*) FROM file GROUP BY sample_id") == [ (first.sample_id, 2), (second.sample_id, 1) ]
+    # a change without last_modified update is not fetched, unlike a change with, a new row and a deleted one
+    store.execute("UPDATE sample SET name = 'renamed' WHERE sample_id = ?", (first.sample_id,))
+    store.execute("UPDATE dataset SET name = '/B/X/Y', last_modified = CURRENT_TIMESTAMP")
+    store.execute("DELETE FROM file WHERE sample_id = ?", (second.sample_id,))
+    store.execute("DELETE FROM sample WHERE sample_id = ?", (second.sample_id,))
+    third = addSample(store, u"third", 3)
+    store.commit()
+    syncReplica(store, path, verbose=False)
+    assert replicaRows(path, "SELECT name FROM dataset") == [ (u"/B/X/Y",) ]
+    assert replicaRows(path, "SELECT name FROM sample") == [ (u"first",), (u"third",) ]
+    assert replicaRows(path, "SELECT sample_id, COUNT(*) FROM file GROUP BY sample_id") == [ (first.sample_id, 2), (third.sample_id, 3) ]
+    # a full sync fetches everything again
+    syncReplica(store, path, full=True, verbose=False)
+    assert replicaRows(path, "SELECT name FROM sample") == [ (u"renamed",), (u"third",) ]
+
+def test_syncWithoutFiles(store, tmpdir):
+    path = str(tmpdir.join("replica.db"))
+    addSample(store, u"sample", 2)
+    store.commit()
+    syncReplica(store, path, withFiles=True, verbose=False)
+    assert replicaRows(path, "SELECT COUNT(*) FROM file") == [ (2,) ]
+    # the files that are not synced anymore are removed, rather than left outdated
+    syncReplica(store, path, withFiles=False, verbose=False)
+    assert replicaRows(path, "SELECT name FROM sqlite_master WHERE name LIKE '%file%'") == []
+    syncReplica(store, path, verbose=False)
+    assert replicaRows(path, "SELECT name FROM sqlite_master WHERE name LIKE '%file%'") == []
+    assert replicaRows(path, "SELECT name FROM sample") == [ (u"sample",) ]
@@ -0,0 +1,60 @@
+import sqlite3
+
+from cp3_llbb.SAMADhi.report_state import ReportState
+
+def test_pathChecks():
+    state = ReportState(":memory:")
+    state.setPathChecks("sample", [ (1, "/a", "ok"), (2, "/b", "unknown") ], checked=10.)
+    state.setPathChecks("sample", [ (1, "/a", "missing"), (2, "/b", "ok") ], checked=20.)
+    state.setPathChecks("sample", [ (1, "/a", "unknown"), (2, "/b", "ok") ], checked=30.)
+    # unknown results only update the paths that were never checked
+    assert state.pathChecks("sample") == { (1, "/a"): (20., "missing", 20.), (2, "/b"): (30., "ok", 20.) }
+    assert state.pathHistory("sample", 1) == [ (10., "/a", "ok"), (20., "/a", "missing") ]
+    state.removePathChecks("sample", [ (2, "/b") ])
+    assert list(state.pathChecks("sample")) == [ (2, "/b") ]
+    assert state.pathHistory("sample", 1) == []
+
+def test_datasetChecks(tmpdir):
+    path = str(tmpdir.join("state.db"))
+    # state file of a version without last_modified
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE dataset_check (dataset_id INTEGER PRIMARY KEY, name TEXT, checked REAL, status TEXT, message TEXT)")
+    connection.execute("INSERT INTO dataset_check VALUES (1, '/A/X/Y', 10., 'ok', NULL)")
+    connection.commit()
+    connection.close()
+    state = ReportState(path)
+    assert state.datasetChecks() == { 1: (10., "ok", None, None) }
+    state.setDatasetCheck(2, "/B/X/Y", "inconsistent", "wrong", checked=20., lastModified="2018-01-01 00:00:00")
+    state.removeDatasetChecks([ 2 ])
+    assert state.datasetChecks() == { 2: (20., "inconsistent", "wrong", "2018-01-01 00:00:00") }
+
+def test_sampleDirectories(tmpdir):
+    path = str(tmpdir.join("state.db"))
+    # state file of a version without last_file_id
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE sample_directories (sample_id INTEGER PRIMARY KEY, nfiles INTEGER, files_nevents INTEGER, resolved REAL, directories TEXT)")
+    connection.execute("INSERT INTO sample_directories VALUES (1, 2, 20, 10., '[\"/data/a\"]')")
+    connection.commit()
+    connection.close()
+    state = ReportState(path)
+    assert state.sampleDirectories() == { 1: ((2, 20, None), 10., [ "/data/a" ]) }
+    state.setSampleDirectories(2, (3, 30, 7), [ "/data/b" ], resolved=20.)
+    state.removeSampleDirectories([ 2 ])
+    assert state.sampleDirectories() == { 2: ((3, 30, 7), 20., [ "/data/b" ]) }
+
+def test_inMemory(tmpdir):
+    path = str(tmpdir.join("state.db"))
+    assert ReportState(path, inMemory=True).pathChecks("sample") == {}
+    assert not tmpdir.join("state.db").check()
+    state = ReportState(path)
+    state.setPathChecks("sample", [ (1, "/a", "ok") ], checked=10.)
+    state.commit()
+    state.close()
+    before = tmpdir.join("state.db").read_binary()
+    # copy of the file, changes are not written back
+    state = ReportState(path, inMemory=True)
+    assert state.pathChecks("sample") == { (1, "/a"): (10., "ok", 10.) }
+    state.setPathChecks("sample", [ (1, "/a", "missing") ], checked=20.)
+    state.commit()
+    state.close()
+    assert tmpdir.join("state.db").read_binary() == before
@@ -0,0 +1,30 @@
+import time
+from datetime import datetime
+
+from cp3_llbb.SAMADhi.report_stats import epochMilliseconds, timeProfile, histogram, countPerKey
+
+def test_epochMilliseconds():
+    times = [ datetime(2017, 1, 15, 12, 30), datetime(2017, 7, 15, 12, 30, 5) ]
+    assert epochMilliseconds(times).tolist() == [ int(time.mktime(t.timetuple()))*1000 for t in times ]
+    assert len(epochMilliseconds([])) == 0
+
+def test_timeProfile():
+    times = [ datetime(2017, 1, 1), datetime(2017, 1, 2) ]
+    ms = epochMilliseconds(times).tolist()
+    assert timeProfile(times) == [ [ ms[0], 1 ], [ ms[1], 2 ] ]
+    assert timeProfile(times, [ 10, 5 ]) == [ [ ms[0], 10 ], [ ms[1], 15 ] ]
+
+def test_histogramRange():
+    # as a TH1: the values outside of [low, high) are not included
+    points = histogram([ -1., 0., 0.5, 1.5, 1.99, 2. ], 2, 0., 2.)
+    assert points == [ [ 0.5, 2. ], [ 1.5, 2. ] ]
+
+def test_histogramAutoRange():
+    points = histogram([ 1., 2., 3. ], 2)
+    assert [ center for center, content in points ] == [ 1.5, 2.5 ]
+    assert sum(content for center, content in points) == 3.
+    assert sum(content for center, content in histogram([], 4)) == 0.
+
+def test_countPerKey():
+    assert countPerKey([ 1, 2, 3, 7 ], [ 3, 1, 3, 5, 3 ]).tolist() == [ 1, 0, 3, 0 ]
+    assert countPerKey([ 1, 2 ], []).tolist() == [ 0, 0 ]
@@ -0,0 +1,31 @@
+import pytest
+
+from cp3_llbb.SAMADhi.root_reader import ROOTFile, UnsupportedROOTFile
+from cp3_llbb.SAMADhi.file_metadata import readFileDataLight
+
+def test_parameterValue(datafile):
+    with ROOTFile(datafile("parameter.root")) as f:
+        assert f.classname("G4RUNTIME") == b"TParameter<double>"
+        assert f.parameterValue("G4RUNTIME") == pytest.approx(1.48)
+
+def test_treeEntries(datafile):
+    with ROOTFile(datafile("tree.root")) as f:
+        assert f.classname("tree") == b"TTree"
+        assert f.treeEntries("tree") == 100
+
+def test_wrongClass(datafile):
+    with ROOTFile(datafile("parameter.root")) as f:
+        with pytest.raises(UnsupportedROOTFile):
+            f.treeEntries("G4RUNTIME")
+        with pytest.raises(UnsupportedROOTFile):
+            f.parameterValue("MC_TAG") # TNamed
+
+def test_notROOT(tmpdir):
+    path = tmpdir.join("notroot.root")
+    path.write("not a ROOT file")
+    with pytest.raises(UnsupportedROOTFile):
+        ROOTFile(str(path))
+
+def test_readFileDataLight_missingObjects(datafile):
+    # no event_weight_sum nor t in these files
+    assert readFileDataLight(datafile("tree.root")) == (None, None, None)
@@ -0,0 +1,143 @@
+from cp3_llbb.SAMADhi.SAMADhi import Dataset, Sample, File, FilesSummary, LuminosityResolver, findRows
+from cp3_llbb.SAMADhi.weightsums import WeightSums
+
+def addDataset(store, name, datatype=u"mc", xsection=None):
+    dataset = Dataset(name, datatype)
+    dataset.xsection = xsection
+    store.add(dataset)
+    store.flush()
+    return dataset
+
+def addSample(store, name, nevents_processed=None, luminosity=None, source_dataset=None, source_sample=None):
+    sample = Sample(name, u"/data/%s" % name, u"NTUPLES", nevents_processed)
+    sample.luminosity = luminosity
+    if source_dataset is not None:
+        sample.source_dataset_id = source_dataset.dataset_id
+    if source_sample is not None:
+        sample.source_sample_id = source_sample.sample_id
+    store.add(sample)
+    store.flush()
+    return sample
+
+def fileRows(n, extras=None):
+    return [ (u"/store/f%d.root" % i, u"srm://se/SFN=/data/dir%d/f%d.root" % (i%2, i), 0.5*i, extras, 10*i) for i in range(n) ]
+
+def test_bulkInsert(store):
+    sample = addSample(store, u"s")
+    rows = fileRows(5, WeightSums([ "a" ], [ 1. ]))
+    assert File.bulkInsert(store, sample.sample_id, iter(rows), batchSize=2) == 5
+    assert store.find(File, File.sample_id == sample.sample_id).count() == 5
+    store.invalidate(sample)
+    assert (sample.nfiles, sample.files_nevents, sample.files_event_weight_sum) == (5, 100, 5.)
+    f = store.find(File, File.lfn == u"/store/f3.root").one()
+    assert (f.nevents, f.event_weight_sum) == (30, 1.5)
+    assert f.getWeightSums().asDict() == { "a": 1. }
+
+def test_removeForSamples(store):
+    sample, other = addSample(store, u"s"), addSample(store, u"other")
+    sample.addFiles(fileRows(5))
+    other.addFiles(fileRows(1))
+    chunks = []
+    assert File.removeForSamples(store, [ sample.sample_id ], chunkSize=2, onChunk=chunks.append) == 5
+    assert chunks == [ 2, 2, 1 ]
+    assert store.find(File, File.sample_id == sample.sample_id).is_empty()
+    assert store.find(File, File.sample_id == other.sample_id).count() == 1
+    store.invalidate()
+    assert (sample.nfiles, sample.files_nevents, sample.files_event_weight_sum) == (0, 0, 0.)
+    assert other.nfiles == 1
+    assert File.removeForSamples(store, []) == 0
+
+def test_updateFilesAggregates(store):
+    sample, other, empty = addSample(store, u"s"), addSample(store, u"other"), addSample(store, u"empty")
+    sample.addFiles(fileRows(3))
+    other.addFiles(fileRows(2))
+    # changes to the file table that do not maintain the aggregates
+    store.execute("DELETE FROM file WHERE lfn = ? AND sample_id = ?", (u"/store/f2.root", sample.sample_id))
+    store.execute("UPDATE sample SET nfiles = 7 WHERE sample_id = ?", (empty.sample_id,))
+    assert Sample.updateFilesAggregates(store, [ sample.sample_id ]) == 1
+    assert (sample.nfiles, sample.files_nevents, sample.files_event_weight_sum) == (2, 10, 0.5)
+    assert empty.nfiles == 7
+    assert Sample.updateFilesAggregates(store) == 1
+    assert (empty.nfiles, empty.files_nevents, empty.files_event_weight_sum) == (0, 0, 0.)
+    assert (other.nfiles, other.files_nevents) == (2, 10)
+    assert Sample.updateFilesAggregates(store) == 0
+    assert Sample.updateFilesAggregates(store, []) == 0
+
+def test_filesSummary(store):
+    sample = addSample(store, u"s")
+    sample.addFiles(fileRows(7))
+    summary = FilesSummary.fromStore(store, sample.sample_id)
+    assert (summary.nFiles, summary.nevents, summary.event_weight_sum) == (7, 210, 10.5)
+    assert [ lfn for lfn, nevents in summary.head ] == [ u"/store/f0.root", u"/store/f1.root", u"/store/f2.root" ]
+    assert summary.tail == [ (u"/store/f6.root", 60) ]
+    assert "    - ...\n" in str(summary)
+    # from the aggregates of the sample
+    store.invalidate(sample)
+    assert sample.getFilesSummary().nFiles == 7
+
+def test_filesSummaryShort(store):
+    sample = addSample(store, u"s")
+    sample.addFiles(fileRows(2))
+    summary = FilesSummary.fromStore(store, sample.sample_id, (2, 10, 0.5))
+    assert (summary.nFiles, summary.nevents, summary.event_weight_sum) == (2, 10, 0.5)
+    assert len(summary.head) == 2 and summary.tail == []
+
+def test_filesSummaryRows(store):
+    rows = fileRows(7)
+    summary = FilesSummary.fromRows(iter(rows))
+    sample = addSample(store, u"s")
+    sample.addFiles(rows)
+    stored = FilesSummary.fromStore(store, sample.sample_id)
+    assert (summary.nFiles, summary.nevents, summary.event_weight_sum, summary.head, summary.tail) == (stored.nFiles, stored.nevents, stored.event_weight_sum, stored.head, stored.tail)
+    short = FilesSummary.fromRows(fileRows(4))
+    assert len(short.head) == 4 and short.tail == []
+    # description of a sample that is not stored yet
+    new = Sample(u"new", u"/data/new", u"NTUPLES", 210)
+    assert "no files" in str(new)
+    assert "  7 files (210 entries" in new.describe(summary)
+
+def test_luminosityResolver(store):
+    mc = addDataset(store, u"/MC/X/Y", u"mc", xsection=2.)
+    data = addDataset(store, u"/Data/X/Y", u"data")
+    mcSample = addSample(store, u"mc", nevents_processed=100, source_dataset=mc)
+    mcNoEvents = addSample(store, u"mcNoEvents", source_dataset=mc)
+    parent = addSample(store, u"parent", luminosity=35.)
+    dataSample = addSample(store, u"data", source_dataset=data, source_sample=parent)
+    dataChild = addSample(store, u"dataChild", source_dataset=data, source_sample=dataSample)
+    orphan = addSample(store, u"orphan")
+    ids = [ sample.sample_id for sample in (mcSample, mcNoEvents, parent, dataSample, dataChild, orphan) ]
+    luminosities = LuminosityResolver(store).getLuminosities(ids+[ 1000 ])
+    assert luminosities == dict(zip(ids+[ 1000 ], [ 50., None, 35., 35., 35., None, None ]))
+    for sample in (mcSample, mcNoEvents, parent, dataSample, dataChild, orphan):
+        assert sample.getLuminosity() == luminosities[sample.sample_id]
+
+def test_luminosityResolverLoop(store):
+    data = addDataset(store, u"/Data/X/Y", u"data")
+    first = addSample(store, u"first", source_dataset=data)
+    second = addSample(store, u"second", source_dataset=data, source_sample=first)
+    first.source_sample_id = second.sample_id
+    store.flush()
+    assert LuminosityResolver(store).getLuminosities([ first.sample_id ]) == { first.sample_id: None }
+
+def test_weightSums(store):
+    sample, empty = addSample(store, u"s"), addSample(store, u"empty")
+    sample.addFiles([ (u"a", u"a", 1., WeightSums([ "x", "y" ], [ 1., 2. ]), 1), (u"b", u"b", 1., WeightSums([ "x", "y" ], [ 3., 4. ]), 1),
+                      (u"c", u"c", 1., None, 1) ])
+    empty.addFiles(fileRows(1))
+    sums = Sample.getFilesWeightSums(store, [ sample.sample_id, empty.sample_id ])
+    assert list(sums) == [ sample.sample_id ]
+    assert sums[sample.sample_id].asDict() == { "x": 4., "y": 6. }
+    assert Sample.updateExtrasWeightSums(store, [ sample.sample_id, empty.sample_id ]) == 1
+    store.invalidate()
+    assert sample.getWeightSums().asDict() == { "x": 4., "y": 6. }
+    assert empty.getWeightSums() is None
+
+def test_filesDirectories(store):
+    sample = addSample(store, u"s")
+    sample.addFiles(fileRows(3)+[ (u"/store/g.root", u"/store/g.root", None, None, None) ])
+    assert Sample.getFilesDirectories(store, [ sample.sample_id ]) == { sample.sample_id: [ u"/data/dir0", u"/data/dir1" ] }
+
+def test_findRows(store):
+    sample = addSample(store, u"s", nevents_processed=5)
+    rows = list(findRows(store, Sample, Sample.sample_id == sample.sample_id, columns=[ Sample.name, Sample.nevents_processed ]))
+    assert [ (row.name, row.nevents_processed) for row in rows ] == [ (u"s", 5) ]
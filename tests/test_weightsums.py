@@ -0,0 +1,30 @@
+import json
+
+import pytest
+
+from cp3_llbb.SAMADhi.weightsums import WeightSums
+
+def test_textRoundTrip():
+    sums = WeightSums([ "a", "b" ], [ 1.5, -2. ])
+    parsed = WeightSums.fromText(sums.toText())
+    assert parsed.names == [ "a", "b" ]
+    assert parsed.values.tolist() == [ 1.5, -2. ]
+    assert WeightSums.fromText(None) is None
+
+def test_legacyFormat():
+    parsed = WeightSums.fromText(json.dumps({ "b": 2., "a": 1. }))
+    assert parsed.asDict() == { "a": 1., "b": 2. }
+
+def test_wrongLength():
+    with pytest.raises(ValueError):
+        WeightSums([ "a" ], [ 1., 2. ])
+
+def test_sum():
+    total = WeightSums.sum([ WeightSums([ "a", "b" ], [ 1., 2. ]), None, WeightSums([ "a", "b" ], [ 3., 4. ]), WeightSums([ "c", "a" ], [ 5., 6. ]) ])
+    assert total.asDict() == { "a": 10., "b": 6., "c": 5. }
+    assert WeightSums.sum([ None ]) is None
+
+def test_sumTexts():
+    texts = [ WeightSums([ "a", "b" ], [ 1., 2. ]).toText(), None, "", WeightSums([ "a", "b" ], [ 3., 4. ]).toText(), json.dumps({ "a": 1. }) ]
+    assert WeightSums.sumTexts(texts).asDict() == { "a": 5., "b": 6. }
+    assert WeightSums.sumTexts([ None ]) is None